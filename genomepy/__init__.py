@@ -2,9 +2,12 @@
 from genomepy.functions import (  # noqa: F401
     list_available_providers,
     list_available_genomes,
+    list_available_genomes_async,
     list_installed_genomes,
     search,
+    search_async,
     install_genome,
+    install_many,
     Genome,
 )
 from genomepy.__about__ import __version__, __author__  # noqa: F401
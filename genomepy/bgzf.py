@@ -0,0 +1,351 @@
+"""Parallel BGZF compression and random access.
+
+BGZF is a series of independent gzip blocks of at most 64 kB, which allows
+random access in a compressed file. Because the blocks are independent,
+they can be compressed in parallel. zlib releases the GIL, so a thread pool
+is enough to use multiple cores. For reading, only the blocks that overlap
+the requested range are decompressed, optionally with a cache of
+decompressed blocks.
+"""
+import norns
+import os
+import struct
+import threading
+import zlib
+
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+
+config = norns.config("genomepy", default="cfg/default.yaml")
+
+# uncompressed data per block, the same as bgzip
+BLOCK_SIZE = 0xFF00
+# number of blocks that are compressed in a single task
+BLOCKS_PER_TASK = 64
+# empty block that marks the end of a BGZF file
+EOF_BLOCK = (
+    b"\x1f\x8b\x08\x04\x00\x00\x00\x00\x00\xff\x06\x00\x42\x43"
+    b"\x02\x00\x1b\x00\x03\x00\x00\x00\x00\x00\x00\x00\x00\x00"
+)
+
+
+def compress_block(data, level=6):
+    """Return data (at most BLOCK_SIZE bytes) as a single BGZF block."""
+    c = zlib.compressobj(level, zlib.DEFLATED, -15, zlib.DEF_MEM_LEVEL, 0)
+    cdata = c.compress(data) + c.flush()
+    header = struct.pack(
+        "<4BI2BH2BHH",
+        0x1F,
+        0x8B,
+        8,
+        4,
+        0,
+        0,
+        0xFF,
+        6,
+        ord("B"),
+        ord("C"),
+        2,
+        len(cdata) + 25,
+    )
+    trailer = struct.pack("<II", zlib.crc32(data), len(data))
+    return header + cdata + trailer
+
+
+def _compress_blocks(data, level):
+    """Compress data into consecutive blocks, return (block, size) tuples."""
+    return [
+        (compress_block(data[i : i + BLOCK_SIZE], level), len(data[i : i + BLOCK_SIZE]))
+        for i in range(0, len(data), BLOCK_SIZE)
+    ]
+
+
+class BgzfWriter(object):
+    """
+    Write a BGZF file, compressing blocks on a thread pool.
+
+    The offsets of all blocks are recorded, so the .gzi index (as written by
+    `bgzip -i`) is available as soon as the file is written.
+
+    Parameters
+    ----------
+    fname : str
+        Output filename.
+
+    level : int , optional
+        Compression level (1-9). If not specified, `bgzip_level` from the
+        configuration file is used (default 6).
+
+    threads : int , optional
+        Number of compression threads. If not specified, `bgzip_threads`
+        from the configuration file is used (default: number of cores).
+    """
+
+    def __init__(self, fname, level=None, threads=None):
+        if level is None:
+            level = config.get("bgzip_level", 6)
+        if threads is None:
+            threads = config.get("bgzip_threads", None) or os.cpu_count() or 1
+        self.fname = fname
+        self.level = level
+        self.blocks = []
+        self._out = open(fname, "wb")
+        self._buf = bytearray()
+        self._pool = ThreadPoolExecutor(threads)
+        self._pending = deque()
+        self._max_pending = 2 * threads
+        self._coffset = 0
+        self._uoffset = 0
+
+    def write(self, data):
+        self._buf += data
+        size = BLOCK_SIZE * BLOCKS_PER_TASK
+        if len(self._buf) >= size:
+            n = len(self._buf) // size * size
+            for i in range(0, n, size):
+                self._submit(bytes(self._buf[i : i + size]))
+            del self._buf[:n]
+
+    def _submit(self, data):
+        self._pending.append(self._pool.submit(_compress_blocks, data, self.level))
+        while len(self._pending) > self._max_pending:
+            self._write_pending()
+
+    def _write_pending(self):
+        """Write the oldest compressed task, blocks are written in order."""
+        for block, size in self._pending.popleft().result():
+            self.blocks.append((self._coffset, self._uoffset))
+            self._out.write(block)
+            self._coffset += len(block)
+            self._uoffset += size
+
+    def close(self):
+        if self._out.closed:
+            return
+        try:
+            if self._buf:
+                self._submit(bytes(self._buf))
+                self._buf = bytearray()
+            while self._pending:
+                self._write_pending()
+            self._out.write(EOF_BLOCK)
+        finally:
+            self._pool.shutdown()
+            self._out.close()
+
+    def write_gzi(self, fname=None):
+        """
+        Write the block index in the .gzi format of bgzip.
+
+        Parameters
+        ----------
+        fname : str , optional
+            Index filename, by default the output filename + .gzi
+        """
+        if fname is None:
+            fname = self.fname + ".gzi"
+        # the first block (offset 0, 0) is not stored
+        with open(fname, "wb") as f:
+            f.write(struct.pack("<Q", max(len(self.blocks) - 1, 0)))
+            for coffset, uoffset in self.blocks[1:]:
+                f.write(struct.pack("<QQ", coffset, uoffset))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def is_bgzf(fname):
+    """Return True if fname is a BGZF file."""
+    with open(fname, "rb") as f:
+        header = f.read(16)
+    return header[:4] == b"\x1f\x8b\x08\x04" and header[12:14] == b"BC"
+
+
+def read_gzi(fname):
+    """
+    Return the (compressed, uncompressed) offsets of all blocks of a BGZF file.
+
+    The .gzi index is used if it exists, otherwise the block headers are
+    read (without decompressing the blocks).
+
+    Parameters
+    ----------
+    fname : str
+        Filename of the BGZF file.
+
+    Returns
+    -------
+    list of (compressed offset, uncompressed offset) tuples
+    """
+    gzi = fname + ".gzi"
+    if os.path.exists(gzi) and os.path.getmtime(gzi) >= os.path.getmtime(fname):
+        with open(gzi, "rb") as f:
+            n = struct.unpack("<Q", f.read(8))[0]
+            offsets = struct.unpack("<{}Q".format(2 * n), f.read(16 * n))
+        return [(0, 0)] + list(zip(offsets[::2], offsets[1::2]))
+
+    blocks = []
+    coffset, uoffset = 0, 0
+    with open(fname, "rb") as f:
+        while True:
+            header = f.read(18)
+            if len(header) < 18:
+                break
+            bsize = struct.unpack("<H", header[16:18])[0] + 1
+            f.seek(coffset + bsize - 4)
+            isize = struct.unpack("<I", f.read(4))[0]
+            if isize:
+                blocks.append((coffset, uoffset))
+            coffset += bsize
+            uoffset += isize
+    return blocks or [(0, 0)]
+
+
+class BgzfReader(object):
+    """
+    Random access to the uncompressed content of a BGZF file.
+
+    Only the blocks that overlap the requested range are read and
+    decompressed. Optionally, decompressed blocks are kept in a
+    least-recently-used cache, so regions in the same blocks are not
+    decompressed again. The reader can be shared by multiple threads.
+
+    Parameters
+    ----------
+    fname : str
+        Filename of the BGZF file.
+
+    cache_size : int , optional
+        Maximum size (in bytes, uncompressed) of the block cache. By default
+        blocks are not cached.
+
+    read_ahead : int , optional
+        Number of blocks after a cache miss that are decompressed (and
+        cached) at the same time, for reading sorted regions.
+
+    Attributes
+    ----------
+    hits, misses : int
+        Number of blocks that were, and were not, in the cache.
+    """
+
+    def __init__(self, fname, cache_size=0, read_ahead=0):
+        self.fname = fname
+        self.blocks = read_gzi(fname)
+        self._coffsets = [c for c, _ in self.blocks]
+        self._uoffsets = [u for _, u in self.blocks]
+        self._f = open(fname, "rb")
+        self._lock = threading.Lock()
+
+        self.cache_size = cache_size
+        self.read_ahead = read_ahead if cache_size else 0
+        self._cache = OrderedDict()
+        self._cached = 0
+        self.hits = 0
+        self.misses = 0
+
+    def read(self, start, length):
+        """Return length bytes, starting at uncompressed offset start."""
+        if length <= 0:
+            return b""
+        i = bisect_right(self._uoffsets, start) - 1
+        j = bisect_left(self._uoffsets, start + length)
+        with self._lock:
+            if self.cache_size:
+                blocks = self._cached_blocks(i, j)
+            else:
+                self.misses += j - i
+                blocks = [_inflate(self._read_blocks(i, j))]
+        data = blocks[0] if len(blocks) == 1 else b"".join(blocks)
+        start -= self._uoffsets[i]
+        return data[start : start + length]
+
+    def _read_blocks(self, i, j):
+        """Return the compressed data of blocks i to j (exclusive)."""
+        self._f.seek(self._coffsets[i])
+        if j < len(self._coffsets):
+            return self._f.read(self._coffsets[j] - self._coffsets[i])
+        return self._f.read()
+
+    def _cached_blocks(self, i, j):
+        """Return the uncompressed blocks i to j (exclusive), using the cache."""
+        data = []
+        k = i
+        while k < j:
+            block = self._cache.get(k)
+            if block is not None:
+                self._cache.move_to_end(k)
+                self.hits += 1
+                data.append(block)
+                k += 1
+                continue
+
+            # read the missing blocks (and the next blocks) at once
+            end = k + 1
+            while end < j and end not in self._cache:
+                end += 1
+            self.misses += end - k
+            last = min(len(self._coffsets), end + self.read_ahead)
+            while last > end and last - 1 in self._cache:
+                last -= 1
+            cdata = self._read_blocks(k, last)
+            for n in range(k, last):
+                first = self._coffsets[n] - self._coffsets[k]
+                if n + 1 < len(self._coffsets):
+                    block = _inflate(
+                        cdata[first : self._coffsets[n + 1] - self._coffsets[k]]
+                    )
+                else:
+                    block = _inflate(cdata[first:])
+                self._add(n, block)
+                if n < end:
+                    data.append(block)
+            k = end
+        return data
+
+    def _add(self, n, block):
+        """Add a block to the cache, remove the least recently used blocks."""
+        old = self._cache.pop(n, None)
+        if old is not None:
+            self._cached -= len(old)
+        self._cache[n] = block
+        self._cached += len(block)
+        while self._cached > self.cache_size and len(self._cache) > 1:
+            _, old = self._cache.popitem(last=False)
+            self._cached -= len(old)
+
+    def cache_info(self):
+        """Return the hits, misses, number of blocks and size of the cache."""
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "blocks": len(self._cache),
+                "size": self._cached,
+            }
+
+    def close(self):
+        self._f.close()
+        self._cache.clear()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def _inflate(cdata):
+    """Return the uncompressed data of one or more complete BGZF blocks."""
+    data = []
+    pos = 0
+    while pos + 18 <= len(cdata):
+        xlen = struct.unpack("<H", cdata[pos + 10 : pos + 12])[0]
+        bsize = struct.unpack("<H", cdata[pos + 16 : pos + 18])[0] + 1
+        data.append(zlib.decompress(cdata[pos + 12 + xlen : pos + bsize - 8], -15))
+        pos += bsize
+    return b"".join(data)
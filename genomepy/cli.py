@@ -1,6 +1,7 @@
 #!/usr/bin/env python
 import click
 import genomepy
+import yaml
 
 from collections import deque
 
@@ -77,6 +78,11 @@ general_install_options = {
         "help": "overwrite existing files",
         "flag_value": True,
     },
+    "no_cache": {
+        "long": "no-cache",
+        "help": "do not use the download cache",
+        "flag_value": True,
+    },
 }
 
 
@@ -134,6 +140,7 @@ def install(
     bgzip,
     annotation,
     force,
+    no_cache,
     **kwargs
 ):
     """Install genome NAME from provider PROVIDER in directory GENOME_DIR."""
@@ -148,10 +155,59 @@ def install(
         bgzip=bgzip,
         annotation=annotation,
         force=force,
+        no_cache=no_cache,
         **kwargs
     )
 
 
+@click.command("install-many", short_help="install multiple genomes")
+@click.argument("manifest", type=click.File())
+@click.option("-g", "--genome_dir", help="genome directory", default=None)
+@click.option(
+    "-d", "--downloads", help="simultaneous downloads (default: 4)", default=4
+)
+@click.option(
+    "-p",
+    "--processes",
+    help="genomes that are indexed at the same time (default: 1)",
+    default=1,
+)
+@click.option("-f", "--force", help="overwrite existing files", flag_value=True)
+@click.option("--no-cache", help="do not use the download cache", flag_value=True)
+def install_many(manifest, genome_dir, downloads, processes, force, no_cache):
+    """Install all genomes in MANIFEST.
+
+    The manifest is a YAML file with a list of genomes. Each genome has a
+    name, a provider and optionally other install options. Options at the
+    top level apply to all genomes:
+
+    \b
+    genome_dir: ~/genomes
+    annotation: true
+    genomes:
+      - name: hg38
+        provider: UCSC
+      - name: GRCz11
+        provider: Ensembl
+        version: 98
+    """
+    data = yaml.safe_load(manifest)
+    defaults = {}
+    if isinstance(data, dict):
+        defaults = data
+        data = defaults.pop("genomes", [])
+    genomes = [dict(defaults, **genome) for genome in data]
+
+    genomepy.functions.install_many(
+        genomes,
+        genome_dir=genome_dir,
+        downloads=downloads,
+        processes=processes,
+        force=force,
+        no_cache=no_cache,
+    )
+
+
 @click.command("genomes", short_help="list available genomes")
 @click.option("-p", "--provider", help="provider")
 def genomes(provider=None):
@@ -188,6 +244,7 @@ def config(command):
 
 cli.add_command(search)
 cli.add_command(install)
+cli.add_command(install_many)
 cli.add_command(genomes)
 cli.add_command(providers)
 cli.add_command(plugin)
@@ -0,0 +1,1092 @@
+"""Download files over HTTP(S), FTP or from the local filesystem."""
+import bisect
+import fcntl
+import hashlib
+import io
+import json
+import norns
+import os
+import re
+import requests
+import shutil
+import subprocess as sp
+import sys
+import threading
+import time
+
+from appdirs import user_cache_dir
+from contextlib import contextmanager
+from http.client import HTTPException, IncompleteRead
+from socket import timeout
+from urllib.error import HTTPError, URLError
+from urllib.parse import urlsplit
+from urllib.request import Request, pathname2url, url2pathname, urlopen
+
+from genomepy.exceptions import ChecksumError
+
+config = norns.config("genomepy", default="cfg/default.yaml")
+
+# errors after which an interrupted download is resumed
+DOWNLOAD_ERRORS = (
+    ConnectionError,
+    HTTPException,
+    timeout,
+    URLError,
+    requests.ConnectionError,
+    requests.Timeout,
+)
+RETRIES = 3
+
+BUFSIZE = 1024 * 1024
+# the progress in the sidecar is updated after every CHECKPOINT bytes
+CHECKPOINT = 64 * 1024 * 1024
+# files are split in segments of at least MIN_SEGMENT bytes
+MIN_SEGMENT = 16 * 1024 * 1024
+# socket timeout (seconds), unless request_timeout is configured
+TIMEOUT = 60
+# pooled connections per host in the shared session
+POOLSIZE = 10
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_session():
+    """
+    Return the HTTP session that is shared by all (metadata) requests.
+
+    The session pools connections per host and keeps them alive, so
+    repeated small requests do not pay for a new TCP/TLS handshake.
+    """
+    global _session
+    with _session_lock:
+        if _session is None:
+            session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(
+                pool_connections=POOLSIZE, pool_maxsize=POOLSIZE, max_retries=RETRIES
+            )
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            _session = session
+        return _session
+
+
+def _reset_session():
+    """Do not share pooled connections with a forked process."""
+    global _session, _session_lock
+    _session = None
+    _session_lock = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_session)
+
+
+def request_timeout():
+    """Return the timeout (seconds) of HTTP requests."""
+    return config.get("request_timeout", TIMEOUT)
+
+
+def mirror_url(mirror, url):
+    """
+    Return the location of a url in a local mirror.
+
+    The mirror has the same layout as the upstream servers, with one
+    directory per host (as created by `wget --mirror`). Query strings and
+    trailing slashes are removed, so a REST request such as
+    http://rest.ensembl.org/info/divisions? is stored as the file
+    rest.ensembl.org/info/divisions.
+
+    Parameters
+    ----------
+    mirror : str
+        Mirror directory or file:// url.
+
+    url : str
+        Upstream url.
+
+    Returns
+    -------
+    file:// url
+    """
+    if mirror.startswith("file:"):
+        mirror = url2pathname(urlsplit(mirror).path)
+    parts = urlsplit(url)
+    path = os.path.join(os.path.expanduser(mirror), parts.netloc, parts.path.strip("/"))
+    return "file://" + pathname2url(os.path.abspath(path))
+
+
+def _local_path(url):
+    """Return the path of a file:// url, or None for other urls."""
+    if url.startswith("file:"):
+        return url2pathname(urlsplit(url).path)
+    return None
+
+
+def read_url(url):
+    """
+    Return the content of a (small) url.
+
+    The content of a local directory is its list of files.
+    """
+    path = _local_path(url)
+    if path is not None and os.path.isdir(path):
+        return "\n".join(sorted(os.listdir(path))).encode()
+    if url.startswith("http"):
+        r = get_session().get(url, timeout=request_timeout())
+        r.raise_for_status()
+        return r.content
+    with urlopen(url, timeout=request_timeout()) as response:
+        return response.read()
+
+
+def url_exists(url):
+    """
+    Return True if the url exists.
+
+    HTTP(S) urls are checked with a HEAD request, so the file itself is not
+    downloaded.
+    """
+    path = _local_path(url)
+    if path is not None:
+        return os.path.exists(path)
+    try:
+        if url.startswith("http"):
+            r = get_session().head(url, allow_redirects=True, timeout=request_timeout())
+            return r.status_code == 200
+        with urlopen(url, timeout=request_timeout()):
+            return True
+    except (OSError, ValueError):
+        # not a url, or the url can not be opened
+        return False
+
+
+class BsdSum(object):
+    """
+    BSD checksum, as computed by `sum` and published by Ensembl.
+
+    The algorithm is sequential and too slow in Python for a genome, so the
+    data are piped to `sum` while they are read.
+    """
+
+    name = "sum"
+
+    def __init__(self):
+        self._proc = sp.Popen(["sum"], stdin=sp.PIPE, stdout=sp.PIPE)
+        self._digest = None
+
+    def update(self, data):
+        self._proc.stdin.write(data)
+
+    def hexdigest(self):
+        """Return checksum and number of 1 kB blocks, like `sum`."""
+        if self._digest is None:
+            out, _ = self._proc.communicate()
+            self._digest = " ".join(str(int(x)) for x in out.split()[:2])
+        return self._digest
+
+    def close(self):
+        """Stop `sum` if the checksum is not computed (e.g. after an error)."""
+        if self._digest is None:
+            self._proc.kill()
+            self._proc.communicate()
+
+
+class Checksum(object):
+    """
+    Checksum of a download, computed while the data are downloaded.
+
+    Parameters
+    ----------
+    algorithm : str , optional
+        "sum" (BSD checksum) or a hashlib algorithm, such as "md5".
+
+    expected : str , optional
+        Published checksum. If specified, the download is verified.
+    """
+
+    def __init__(self, algorithm="md5", expected=None):
+        self.algorithm = algorithm
+        self.expected = expected
+        self.value = None
+
+    def new(self):
+        """Return a new hash object."""
+        if self.algorithm == "sum":
+            return BsdSum()
+        return hashlib.new(self.algorithm)
+
+    def verify(self, value):
+        """Store the checksum of the download and compare it to the expected one."""
+        self.value = value
+        if self.expected is not None and value != self.expected:
+            raise ChecksumError(
+                "{} checksum {} does not match the published {}".format(
+                    self.algorithm, value, self.expected
+                )
+            )
+
+    def __str__(self):
+        status = "verified" if self.expected is not None else "not published"
+        return "{} {} ({})".format(self.algorithm, self.value, status)
+
+
+def upstream_checksum(url, checksum_file, algorithm="md5"):
+    """
+    Return the published checksum of a url.
+
+    Parameters
+    ----------
+    url : str
+        Url of the file.
+
+    checksum_file : str
+        File with the checksums of all files in the same directory as the url,
+        such as CHECKSUMS (Ensembl) or md5checksums.txt (NCBI).
+
+    algorithm : str , optional
+        Algorithm of the checksums in checksum_file.
+
+    Returns
+    -------
+    Checksum
+        If no checksum is published, only the algorithm is set.
+    """
+    checksum = Checksum(algorithm)
+    base, fname = url.split("?")[0].rsplit("/", 1)
+    try:
+        lines = read_url(base + "/" + checksum_file).decode().splitlines()
+    except OSError:
+        return checksum
+
+    for line in lines:
+        vals = line.split()
+        if len(vals) > 1 and os.path.basename(vals[-1]) == fname:
+            vals = vals[:-1]
+            if algorithm == "sum":
+                vals = [str(int(x)) for x in vals]
+            checksum.expected = " ".join(vals)
+            break
+    return checksum
+
+
+class HashingReader(io.RawIOBase):
+    """Update a hash object with all data read from a binary file object."""
+
+    def __init__(self, fileobj, hasher):
+        self.fileobj = fileobj
+        self.hasher = hasher
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        n = self.fileobj.readinto(b)
+        self.hasher.update(memoryview(b)[:n])
+        return n
+
+
+def partial_filename(url, dirname):
+    """Return the name of the partial file for a download."""
+    fname = os.path.basename(url.split("?")[0]) or "download"
+    url_hash = hashlib.sha1(url.encode()).hexdigest()[:10]
+    return os.path.join(dirname, ".{}.{}.part".format(fname, url_hash))
+
+
+def remove_partial(fname):
+    """Remove a partial file and its sidecar."""
+    for f in [fname, fname + ".json"]:
+        if os.path.exists(f):
+            os.unlink(f)
+
+
+class ResumableDownload(io.RawIOBase):
+    """
+    Read a url, while storing the downloaded bytes in a partial file.
+
+    A sidecar (partial file + .json) records the url, the validator
+    (ETag/Last-Modified) and the number of bytes that were saved. When a
+    previous download of the same url was interrupted, the saved bytes are
+    read first and the download continues with a Range request. The download
+    restarts from zero if the validator has changed or the server does not
+    support ranges.
+
+    Parameters
+    ----------
+    url : str
+        Url to download.
+
+    fname : str
+        Name of the partial file.
+    """
+
+    def __init__(self, url, fname):
+        self.url = url
+        self.fname = fname
+        self.sidecar = fname + ".json"
+        self.response = None
+        self.local = None
+        self.out = None
+
+        state = {}
+        if os.path.exists(self.sidecar) and os.path.exists(fname):
+            with open(self.sidecar) as f:
+                state = json.load(f)
+        offset = 0
+        if state.get("url") == url:
+            offset = min(state.get("offset", 0), os.path.getsize(fname))
+        validator = state.get("etag") or state.get("last_modified")
+
+        headers = {}
+        if offset > 0 and validator and url.startswith("http"):
+            headers = {"Range": "bytes={}-".format(offset), "If-Range": validator}
+        try:
+            self.response = urlopen(
+                Request(url, headers=headers), timeout=request_timeout()
+            )
+        except HTTPError as e:
+            if e.code != 416 or not headers:
+                raise
+            # the range starts at the end of the file
+            m = re.match(r"bytes \*/(\d+)", e.headers.get("Content-Range", ""))
+            e.close()
+            if m and int(m.group(1)) == offset:
+                self.response = None
+            else:
+                self.response = urlopen(url, timeout=request_timeout())
+
+        if self.response is None:
+            # the saved bytes are the complete file
+            sys.stderr.write("Download complete, reading saved file\n")
+            self.etag = state.get("etag")
+            self.last_modified = state.get("last_modified")
+            self.out = open(fname, "r+b")
+            self.local = open(fname, "rb")
+            self.size = offset
+            self.saved = offset
+        else:
+            self._open_response(offset, validator)
+        offset = self.saved
+        self.out.truncate(offset)
+        self.out.seek(offset)
+
+        self.offset = offset
+        self.checkpoint = offset
+        self._write_sidecar()
+
+    def _open_response(self, offset, validator):
+        """Resume at offset if the server honours the range, otherwise restart."""
+        info = self.response.info()
+        self.etag = info.get("ETag")
+        self.last_modified = info.get("Last-Modified")
+        content_range = info.get("Content-Range", "")
+        m = re.match(r"bytes (\d+)-\d+/(\d+)", content_range)
+        if (
+            self.response.getcode() == 206
+            and m
+            and int(m.group(1)) == offset
+            and validator in [self.etag, self.last_modified]
+        ):
+            sys.stderr.write("Resuming download at byte {}\n".format(offset))
+            self.out = open(self.fname, "r+b")
+            self.local = open(self.fname, "rb")
+            self.size = int(m.group(2))
+        else:
+            offset = 0
+            self.out = open(self.fname, "wb")
+            length = info.get("Content-Length")
+            self.size = int(length) if length else None
+        # bytes that were downloaded before (and are read first)
+        self.saved = offset
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        if self.local:
+            n = min(len(b), self.saved - self.local.tell())
+            if n > 0:
+                return self.local.readinto(memoryview(b)[:n])
+            self.local.close()
+            self.local = None
+        if self.response is None:
+            return 0
+
+        data = self.response.read(len(b))
+        n = len(data)
+        if n == 0 and self.size is not None and self.offset < self.size:
+            raise IncompleteRead(b"", self.size - self.offset)
+        b[:n] = data
+        if n:
+            self.out.write(data)
+            self.offset += n
+            if self.offset - self.checkpoint >= CHECKPOINT:
+                self._write_sidecar()
+        return n
+
+    def _write_sidecar(self):
+        self.out.flush()
+        self.checkpoint = self.offset
+        state = {
+            "url": self.url,
+            "etag": self.etag,
+            "last_modified": self.last_modified,
+            "offset": self.offset,
+        }
+        with open(self.sidecar, "w") as f:
+            json.dump(state, f)
+
+    def close(self):
+        if not self.closed:
+            if self.out:
+                self._write_sidecar()
+                self.out.close()
+            if self.local:
+                self.local.close()
+            if self.response:
+                self.response.close()
+        super(ResumableDownload, self).close()
+
+
+class SegmentedDownload(io.RawIOBase):
+    """
+    Read a url, while downloading it in parallel segments to a partial file.
+
+    The file is split into byte ranges that are downloaded concurrently,
+    each over its own connection. The data are read in order, as soon as
+    they are available. Like ResumableDownload, the progress of each
+    segment is recorded in a sidecar, so an interrupted download can be
+    resumed.
+
+    Parameters
+    ----------
+    url : str
+        Url to download. The server has to support ranges.
+
+    fname : str
+        Name of the partial file.
+
+    size : int
+        Size of the download in bytes.
+
+    etag : str
+        ETag of the url.
+
+    last_modified : str
+        Last-Modified date of the url.
+
+    connections : int
+        Number of segments.
+    """
+
+    def __init__(self, url, fname, size, etag, last_modified, connections):
+        self.url = url
+        self.fname = fname
+        self.sidecar = fname + ".json"
+        self.size = size
+        self.etag = etag
+        self.last_modified = last_modified
+        self.validator = etag or last_modified
+        self.pos = 0
+        self.error = None
+        self.stopped = False
+        self.cond = threading.Condition()
+
+        state = {}
+        if os.path.exists(self.sidecar) and os.path.exists(fname):
+            with open(self.sidecar) as f:
+                state = json.load(f)
+        if (
+            state.get("url") == url
+            and state.get("size") == size
+            and state.get("etag") == etag
+            and state.get("last_modified") == last_modified
+            and "segments" in state
+        ):
+            self.segments = state["segments"]
+            done = sum(s[2] for s in self.segments)
+            sys.stderr.write("Resuming download at {} bytes\n".format(done))
+        else:
+            n = max(1, min(connections, size // MIN_SEGMENT))
+            bounds = [size * i // n for i in range(n + 1)]
+            self.segments = [[bounds[i], bounds[i + 1], 0] for i in range(n)]
+        self.starts = [s[0] for s in self.segments]
+
+        self.fd = os.open(fname, os.O_RDWR | os.O_CREAT)
+        os.ftruncate(self.fd, size)
+        self.checkpoint = 0
+        self._write_sidecar()
+
+        self.threads = [
+            threading.Thread(target=self._fetch, args=(i,), daemon=True)
+            for i in range(len(self.segments))
+        ]
+        for thread in self.threads:
+            thread.start()
+
+    def _fetch(self, i):
+        """Download segment i."""
+        start, end, done = self.segments[i]
+        resumed = done
+        t0 = time.time()
+        try:
+            if start + done < end:
+                headers = {
+                    "Range": "bytes={}-{}".format(start + done, end - 1),
+                    "If-Range": self.validator,
+                }
+                with urlopen(
+                    Request(self.url, headers=headers), timeout=request_timeout()
+                ) as r:
+                    if r.getcode() != 206:
+                        raise HTTPException("range request was not honoured")
+                    while start + done < end and not self.stopped:
+                        data = r.read(min(BUFSIZE, end - start - done))
+                        if not data:
+                            raise IncompleteRead(b"", end - start - done)
+                        os.pwrite(self.fd, data, start + done)
+                        done += len(data)
+                        with self.cond:
+                            self.segments[i][2] = done
+                            self.cond.notify_all()
+                            self.checkpoint += len(data)
+                            if self.checkpoint >= CHECKPOINT:
+                                self._write_sidecar()
+
+                if not self.stopped:
+                    mb = (done - resumed) / 1e6
+                    secs = max(time.time() - t0, 1e-3)
+                    sys.stderr.write(
+                        "segment {}: {:.1f} MB in {:.1f}s ({:.1f} MB/s)\n".format(
+                            i + 1, mb, secs, mb / secs
+                        )
+                    )
+        except Exception as e:
+            with self.cond:
+                self.error = e
+                self.cond.notify_all()
+
+    def _write_sidecar(self):
+        self.checkpoint = 0
+        state = {
+            "url": self.url,
+            "etag": self.etag,
+            "last_modified": self.last_modified,
+            "size": self.size,
+            "segments": self.segments,
+        }
+        with open(self.sidecar, "w") as f:
+            json.dump(state, f)
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        if self.pos >= self.size:
+            return 0
+
+        i = bisect.bisect(self.starts, self.pos) - 1
+        with self.cond:
+            while True:
+                available = self.segments[i][0] + self.segments[i][2]
+                if available > self.pos or self.error:
+                    break
+                self.cond.wait()
+            if available <= self.pos:
+                raise self.error
+
+        n = min(len(b), available - self.pos)
+        data = os.pread(self.fd, n, self.pos)
+        b[: len(data)] = data
+        self.pos += len(data)
+        return len(data)
+
+    def close(self):
+        if not self.closed:
+            self.stopped = True
+            for thread in self.threads:
+                thread.join()
+            with self.cond:
+                self._write_sidecar()
+            os.close(self.fd)
+        super(SegmentedDownload, self).close()
+
+
+def _probe_ranges(url):
+    """
+    Check if a url can be downloaded in ranges.
+
+    Returns
+    -------
+    tuple (size, etag, last_modified) or None if ranges are not supported.
+    """
+    if not url.startswith("http"):
+        return None
+    # a server without range support sends the complete file: do not read it
+    r = get_session().get(
+        url, headers={"Range": "bytes=0-0"}, stream=True, timeout=request_timeout()
+    )
+    r.close()
+    m = re.match(r"bytes 0-0/(\d+)", r.headers.get("Content-Range", ""))
+    if r.status_code != 206 or not m:
+        return None
+    return int(m.group(1)), r.headers.get("ETag"), r.headers.get("Last-Modified")
+
+
+def open_download(url, partial, connections=None):
+    """
+    Open a url for (resumable) reading.
+
+    The download is split in segments that are downloaded in parallel if
+    the server supports ranges, otherwise a single stream is used.
+
+    Parameters
+    ----------
+    url : str
+        Url to download.
+
+    partial : str
+        Name of the partial file that stores the downloaded data.
+
+    connections : int , optional
+        Maximum number of parallel connections. If not specified, the
+        setting from the configuration file will be used (default 4).
+
+    Returns
+    -------
+    binary file object
+    """
+    if connections is None:
+        connections = config.get("connections", 4)
+
+    probe = None
+    if connections > 1:
+        probe = _probe_ranges(url)
+
+    if probe and probe[0] >= 2 * MIN_SEGMENT and (probe[1] or probe[2]):
+        size, etag, last_modified = probe
+        raw = SegmentedDownload(url, partial, size, etag, last_modified, connections)
+    else:
+        raw = ResumableDownload(url, partial)
+    return io.BufferedReader(raw, BUFSIZE)
+
+
+class DownloadCache(object):
+    """
+    Content-addressed cache of downloaded files.
+
+    Files are stored under a key based on the url and the validator
+    (ETag/Last-Modified) of the download. An index maps each url to its
+    most recent file and its validator, so a cached file can be revalidated
+    with the server before it is used (see _download). When the cache
+    exceeds its size limit, the least recently used files are removed.
+
+    Parameters
+    ----------
+    cache_dir : str
+        Cache directory.
+
+    size_limit : int
+        Maximum size of the cache in bytes.
+    """
+
+    def __init__(self, cache_dir, size_limit):
+        self.cache_dir = os.path.expanduser(cache_dir)
+        self.size_limit = size_limit
+        self.partial_dir = os.path.join(self.cache_dir, "partial")
+        self.index_file = os.path.join(self.cache_dir, "index.json")
+        for dirname in [self.cache_dir, self.partial_dir]:
+            if not os.path.exists(dirname):
+                os.makedirs(dirname, exist_ok=True)
+
+    @staticmethod
+    def key(url, etag=None, last_modified=None):
+        """Return the key of a download."""
+        validator = etag or last_modified or ""
+        return hashlib.sha256("{}\n{}".format(url, validator).encode()).hexdigest()
+
+    def filename(self, key):
+        """Return the filename of a cached file."""
+        return os.path.join(self.cache_dir, key[:2], key)
+
+    @contextmanager
+    def lock(self, name="index"):
+        """Hold an exclusive lock, shared between processes."""
+        with open(os.path.join(self.cache_dir, ".{}.lock".format(name)), "w") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _read_index(self):
+        if not os.path.exists(self.index_file):
+            return {}
+        with open(self.index_file) as f:
+            return json.load(f)
+
+    def _write_index(self, index):
+        tmp = self.index_file + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(index, f)
+        os.replace(tmp, self.index_file)
+
+    def get(self, url, max_age=None):
+        """
+        Return the cached file of a url, or None if it is not cached.
+
+        Parameters
+        ----------
+        url : str
+            Url of the download.
+
+        max_age : float , optional
+            Files without a validator can not be revalidated, these expire
+            after max_age seconds.
+        """
+        now = time.time()
+        with self.lock():
+            index = self._read_index()
+            entries = [
+                (entry["used"], key)
+                for key, entry in index.items()
+                if entry["url"] == url
+                and os.path.exists(self.filename(key))
+                and (
+                    max_age is None
+                    or entry["etag"]
+                    or entry["last_modified"]
+                    or now - entry.get("added", 0) <= max_age
+                )
+            ]
+            if not entries:
+                return None
+            key = max(entries)[1]
+            index[key]["used"] = now
+            self._write_index(index)
+        return self.filename(key)
+
+    def validators(self, fname):
+        """Return the ETag and Last-Modified of a cached file."""
+        with self.lock():
+            entry = self._read_index().get(os.path.basename(fname), {})
+        return entry.get("etag"), entry.get("last_modified")
+
+    def add(self, url, fname, etag=None, last_modified=None):
+        """
+        Move a downloaded file into the cache.
+
+        Returns
+        -------
+        filename of the cached file, or None if it does not fit in the cache
+        (the file is not moved).
+        """
+        size = os.path.getsize(fname)
+        if size > self.size_limit:
+            return None
+
+        key = self.key(url, etag, last_modified)
+        cached = self.filename(key)
+        os.makedirs(os.path.dirname(cached), exist_ok=True)
+        with self.lock():
+            os.replace(fname, cached)
+            index = self._read_index()
+            # older versions of the url are no longer used
+            for old in [k for k, e in index.items() if e["url"] == url and k != key]:
+                self._remove(index, old)
+            index[key] = {
+                "url": url,
+                "etag": etag,
+                "last_modified": last_modified,
+                "size": size,
+                "added": time.time(),
+                "used": time.time(),
+            }
+            self._evict(index)
+            self._write_index(index)
+        return cached
+
+    def remove(self, url):
+        """Remove the cached files of a url."""
+        with self.lock():
+            index = self._read_index()
+            for key in [k for k, e in index.items() if e["url"] == url]:
+                self._remove(index, key)
+            self._write_index(index)
+
+    def _remove(self, index, key):
+        fname = self.filename(key)
+        if os.path.exists(fname):
+            os.unlink(fname)
+        del index[key]
+
+    def _evict(self, index):
+        """Remove the least recently used files until the cache fits its limit."""
+        total = sum(entry["size"] for entry in index.values())
+        for _, key in sorted((entry["used"], key) for key, entry in index.items()):
+            if total <= self.size_limit:
+                break
+            total -= index[key]["size"]
+            self._remove(index, key)
+
+
+_cache_options = threading.local()
+
+
+@contextmanager
+def cache_options(enabled=True, refresh=False):
+    """
+    Change how the downloads of this thread use the download cache.
+
+    Parameters
+    ----------
+    enabled : bool , optional
+        Set to False to neither use nor fill the cache.
+
+    refresh : bool , optional
+        Set to True to download cached files again (the new download
+        replaces the cached file).
+    """
+    old = getattr(_cache_options, "value", None)
+    _cache_options.value = (enabled, refresh)
+    try:
+        yield
+    finally:
+        _cache_options.value = old
+
+
+def _cache_mode():
+    """Return (enabled, refresh) of the download cache in this thread."""
+    return getattr(_cache_options, "value", None) or (True, False)
+
+
+def get_cache(url):
+    """
+    Return the download cache for a url.
+
+    The cache directory and its maximum size (in GB) are set in the
+    configuration file with download_cache_dir and download_cache_size.
+
+    Returns
+    -------
+    DownloadCache instance, or None if the url is not cached.
+    """
+    size = config.get("download_cache_size", 10)
+    enabled, _ = _cache_mode()
+    if not size or not enabled or url.startswith("file:"):
+        return None
+    cache_dir = config.get(
+        "download_cache_dir", os.path.join(user_cache_dir("genomepy"), "downloads")
+    )
+    return DownloadCache(cache_dir, int(size * 1024 ** 3))
+
+
+def _unchanged(url, etag, last_modified):
+    """
+    Check if a cached download is still up to date.
+
+    HTTP(S) downloads are revalidated with a conditional HEAD request.
+    Other downloads have no validator, these expire from the cache instead.
+    """
+    if not url.startswith("http") or not (etag or last_modified):
+        return True
+    headers = {"Accept-Encoding": "identity"}
+    if etag:
+        headers["If-None-Match"] = etag
+    if last_modified:
+        headers["If-Modified-Since"] = last_modified
+    try:
+        r = get_session().head(
+            url, headers=headers, allow_redirects=True, timeout=request_timeout()
+        )
+    except requests.RequestException:
+        # the server can not be reached, use the cached file
+        return True
+    if r.status_code != 200:
+        # not modified (304), or the url is no longer available
+        return True
+    if etag:
+        return r.headers.get("ETag") == etag
+    return r.headers.get("Last-Modified") == last_modified
+
+
+def _retry(url, process, partial, retries):
+    """
+    Download and process a url, resume the download if it is interrupted.
+
+    Returns
+    -------
+    tuple (return value of process, ETag, Last-Modified)
+    """
+    for attempt in range(retries + 1):
+        try:
+            with open_download(url, partial) as f:
+                ret = process(f)
+                # make sure the download is complete
+                while f.read(BUFSIZE):
+                    pass
+                return ret, f.raw.etag, f.raw.last_modified
+        except HTTPError:
+            raise
+        except DOWNLOAD_ERRORS as e:
+            if attempt == retries:
+                raise
+            sys.stderr.write("Download interrupted ({}), resuming...\n".format(e))
+
+
+def _download(url, process, dirname, retries):
+    """
+    Download and process a url, or process the cached file if available.
+
+    Returns
+    -------
+    tuple (return value of process, downloaded file, True if the file is cached)
+    """
+    # files in a local mirror are read in place
+    path = _local_path(url)
+    if path and os.path.isfile(path):
+        with open(path, "rb") as f:
+            return process(f), path, True
+
+    cache = get_cache(url)
+    if cache is None:
+        partial = partial_filename(url, dirname)
+        ret, _, _ = _retry(url, process, partial, retries)
+        return ret, partial, False
+
+    # only one process downloads a url at the same time
+    with cache.lock(cache.key(url)):
+        fname = None
+        _, refresh = _cache_mode()
+        if not refresh:
+            max_age = config.get("download_cache_days", 7) * 24 * 3600
+            fname = cache.get(url, max_age=max_age)
+        if fname and not _unchanged(url, *cache.validators(fname)):
+            sys.stderr.write("{} has changed, downloading again\n".format(url))
+            fname = None
+        if fname:
+            sys.stderr.write("Using cached download of {}\n".format(url))
+            with open(fname, "rb") as f:
+                return process(f), fname, True
+
+        partial = partial_filename(url, cache.partial_dir)
+        ret, etag, last_modified = _retry(url, process, partial, retries)
+        fname = cache.add(url, partial, etag, last_modified)
+        if fname is None:
+            # too large for the cache
+            return ret, partial, False
+        remove_partial(partial)
+        return ret, fname, True
+
+
+def _verified(process, checksum):
+    """Wrap process to compute and verify the checksum of the data."""
+
+    def verified(f):
+        hasher = checksum.new()
+        try:
+            with io.BufferedReader(HashingReader(f, hasher), BUFSIZE) as g:
+                ret = process(g)
+                # the checksum covers the complete file
+                while g.read(BUFSIZE):
+                    pass
+            checksum.verify(hasher.hexdigest())
+        finally:
+            if isinstance(hasher, BsdSum):
+                hasher.close()
+        return ret
+
+    return verified
+
+
+def _download_checked(url, process, dirname, retries, checksum):
+    """
+    Download and process a url, and verify the checksum.
+
+    A download that does not match the published checksum is removed
+    (from the download cache) and downloaded again.
+    """
+    if checksum is None:
+        return _download(url, process, dirname, retries)
+
+    process = _verified(process, checksum)
+    for attempt in range(retries + 1):
+        try:
+            return _download(url, process, dirname, retries)
+        except ChecksumError as e:
+            if attempt == retries or _local_path(url):
+                raise
+            cache = get_cache(url)
+            if cache is not None:
+                cache.remove(url)
+                remove_partial(partial_filename(url, cache.partial_dir))
+            remove_partial(partial_filename(url, dirname))
+            sys.stderr.write("{}, downloading again...\n".format(e))
+
+
+def download_file(url, fname, retries=RETRIES, checksum=None):
+    """
+    Download a url to a file.
+
+    Parameters
+    ----------
+    url : str
+        Url to download.
+
+    fname : str
+        Output filename.
+
+    retries : int , optional
+        Number of times an interrupted download is resumed.
+
+    checksum : Checksum , optional
+        If specified, the checksum of the download is computed and verified.
+    """
+    dirname = os.path.dirname(os.path.abspath(fname))
+    _, downloaded, cached = _download_checked(
+        url, lambda f: None, dirname, retries, checksum
+    )
+    if cached:
+        shutil.copyfile(downloaded, fname)
+    else:
+        # the partial file may be in the download cache, on another disk
+        shutil.move(downloaded, fname)
+        remove_partial(downloaded)
+
+
+def download_stream(url, process, dirname, retries=RETRIES, checksum=None):
+    """
+    Download a url and process the data while it is downloaded.
+
+    Downloads are kept in the download cache, and a cached url is
+    processed without using the network. An interrupted download is
+    resumed and the data are processed again from the start.
+
+    Parameters
+    ----------
+    url : str
+        Url to download.
+
+    process : function
+        Function that takes a binary file object (the download) as argument.
+
+    dirname : str
+        Directory for the partial download, if the url is not cached.
+
+    retries : int , optional
+        Number of times an interrupted download is resumed.
+
+    checksum : Checksum , optional
+        If specified, the checksum is computed while the data are processed.
+        A download that does not match the published checksum is retried.
+
+    Returns
+    -------
+    the return value of process
+    """
+    ret, downloaded, cached = _download_checked(
+        url, process, dirname, retries, checksum
+    )
+    if not cached:
+        remove_partial(downloaded)
+    return ret
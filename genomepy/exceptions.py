@@ -6,3 +6,10 @@ class GenomeDownloadError(Exception):
     """Error while downloading genome."""
 
     pass
+
+
+class ChecksumError(GenomeDownloadError):
+
+    """Downloaded file does not match the published checksum."""
+
+    pass
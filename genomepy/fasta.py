@@ -0,0 +1,525 @@
+"""Streaming FASTA processing.
+
+During installation a genome is passed through a pipeline of stages. The
+downloaded stream is decompressed in-process and turned into an iterator of
+header lines and sequence blocks (bytes). Each stage takes such an iterator
+and returns a new one, so header renaming, masking and filtering can be
+chained and the result is written to disk only once. Sequences are
+processed in large blocks, so masking runs at close to memory speed.
+
+FastaReader provides random access to many regions of an indexed file.
+"""
+import gzip
+import mmap
+import os
+import re
+import string
+import tarfile
+
+import numpy as np
+
+from functools import partial
+from pyfaidx import FetchError
+from genomepy.bgzf import BgzfReader, BgzfWriter, is_bgzf
+
+# size of the blocks that are read and written
+BLOCKSIZE = 4 * 1024 * 1024
+# regions that are closer than this (in bytes) are read at once
+MERGE_DISTANCE = 64 * 1024
+
+_UNMASK = bytes.maketrans(
+    string.ascii_lowercase.encode(), string.ascii_uppercase.encode()
+)
+_HARD_MASK = bytes.maketrans(b"actg", b"NNNN")
+
+
+def read_fasta(fileobj, fname, size=BLOCKSIZE):
+    """Yield the headers and sequences of a (compressed) FASTA stream.
+
+    Headers are yielded as separate lines, sequences in large blocks (of
+    multiple lines). Stages can therefore rewrite headers and transform
+    sequences with a single bytes operation per block, instead of per line.
+
+    Parameters
+    ----------
+    fileobj : file object
+        Binary stream, e.g. an HTTP response. Does not need to be seekable.
+
+    fname : str
+        Filename or url of the stream, used to determine the compression
+        (.tar.gz, .gz or uncompressed).
+
+    size : int , optional
+        Maximum size of the sequence blocks.
+
+    Yields
+    ------
+    header line or sequence block : bytes
+    """
+    header = b""
+    block = b"\n"
+    for block in read_blocks(fileobj, fname, size):
+        pos = 0
+        if header:
+            # complete the header that started in the previous block
+            end = block.find(b"\n")
+            if end == -1:
+                header += block
+                continue
+            yield header + block[: end + 1]
+            header = b""
+            pos = end + 1
+
+        while True:
+            start = block.find(b">", pos)
+            if start == -1:
+                if pos == 0:
+                    yield block
+                elif pos < len(block):
+                    yield block[pos:]
+                break
+            if start > pos:
+                yield block[pos:start]
+            end = block.find(b"\n", start)
+            if end == -1:
+                header = block[start:]
+                break
+            yield block[start : end + 1]
+            pos = end + 1
+
+    if header:
+        yield header + b"\n"
+    elif not block.endswith(b"\n"):
+        # the last line of the file has no newline
+        yield b"\n"
+
+
+def read_blocks(fileobj, fname, size=BLOCKSIZE):
+    """Yield the content of a (compressed) FASTA stream in large blocks.
+
+    Use instead of read_fasta when the sequences are not processed, so the
+    data are copied in large binary blocks instead of line by line.
+    The members of a tar archive are streamed directly from the archive,
+    in archive order.
+
+    Parameters
+    ----------
+    fileobj : file object
+        Binary stream, e.g. an HTTP response. Does not need to be seekable.
+
+    fname : str
+        Filename or url of the stream, used to determine the compression
+        (.tar.gz, .gz or uncompressed).
+
+    size : int , optional
+        Block size.
+
+    Yields
+    ------
+    block : bytes
+    """
+    if fname.endswith(".tar.gz"):
+        with tarfile.open(fileobj=fileobj, mode="r|gz") as tar:
+            for member in tar:
+                if not member.isfile():
+                    continue
+                f = tar.extractfile(member)
+                block = b"\n"
+                for block in iter(partial(f.read, size), b""):
+                    yield block
+                # do not merge the last line with the next member
+                if not block.endswith(b"\n"):
+                    yield b"\n"
+    else:
+        if fname.endswith(".gz"):
+            fileobj = gzip.GzipFile(fileobj=fileobj)
+        for block in iter(partial(fileobj.read, size), b""):
+            yield block
+
+
+def rename_headers(lines, mapping):
+    """Replace sequence names.
+
+    The original header is kept as the description of the new header.
+
+    Parameters
+    ----------
+    lines : iterable
+        FASTA headers and sequences (bytes), see read_fasta.
+
+    mapping : dict
+        Original sequence names as keys, new names as values.
+        Sequences not in the mapping keep their name.
+    """
+    for line in lines:
+        if line.startswith(b">"):
+            desc = line.strip()[1:].decode()
+            name = desc.split(" ")[0]
+            line = ">{} {}\n".format(mapping.get(name, name), desc).encode()
+        yield line
+
+
+def mask_sequences(lines, mask="soft"):
+    """Change the masking of a soft-masked genome.
+
+    Parameters
+    ----------
+    lines : iterable
+        FASTA headers and sequences (bytes), see read_fasta.
+
+    mask : str , optional
+        'soft' keeps the sequence as is, 'hard' replaces soft-masked
+        nucleotides with N and all other values unmask the sequence.
+    """
+    if mask == "soft":
+        return lines
+    table = _HARD_MASK if mask == "hard" else _UNMASK
+    return (line if line.startswith(b">") else line.translate(table) for line in lines)
+
+
+def filter_sequences(lines, regex=".*", invert_match=False, excluded=None):
+    """Select sequences based on a regex.
+
+    Uses the same selection as filter_fasta: the regex is searched in the
+    sequence name (the first word of the header).
+
+    Parameters
+    ----------
+    lines : iterable
+        FASTA headers and sequences (bytes), see read_fasta.
+
+    regex : str, optional
+        Regular expression used for selecting sequences.
+
+    invert_match : bool, optional
+        If set to True, select all sequence *not* matching regex.
+
+    excluded : list, optional
+        If specified, the names of the sequences that were not selected
+        are appended to this list.
+    """
+    search = re.compile(regex).search
+    keep = True
+    kept = 0
+    for line in lines:
+        if line.startswith(b">"):
+            name = (line[1:].split() or [b""])[0].decode()
+            keep = bool(search(name)) != invert_match
+            if keep:
+                kept += 1
+            elif excluded is not None:
+                excluded.append(name)
+        if keep:
+            yield line
+
+    if kept == 0:
+        raise ValueError("No sequences left after filtering!")
+
+
+def read_fai(fname):
+    """Read a .fai index.
+
+    Parameters
+    ----------
+    fname : str
+        Filename of the index.
+
+    Returns
+    -------
+    list of [name, length, offset, bases per line, bytes per line]
+    """
+    records = []
+    with open(fname) as f:
+        for line in f:
+            vals = line.rstrip("\n").split("\t")
+            records.append([vals[0]] + [int(x) for x in vals[1:5]])
+    return records
+
+
+def record_end(length, offset, linebases, linewidth):
+    """Return the end offset of a sequence (including newlines) in a FASTA file."""
+    if linebases == 0:
+        return offset
+    return offset + length + -(-length // linebases) * (linewidth - linebases)
+
+
+class FaiIndex(object):
+    """
+    Build a samtools .fai index from FASTA headers and sequence blocks.
+
+    Feed all data that is written to the FASTA file to add(), in order. The
+    index is only valid if all lines of a sequence have the same length
+    (except the last one). Otherwise valid is False, and the index should
+    be created from the file instead (e.g. by pyfaidx).
+    """
+
+    def __init__(self):
+        # name, length, offset, bases per line, bytes per line
+        self.records = []
+        self.valid = True
+        self._offset = 0
+        self._col = 0
+        self._short = False
+
+    def add(self, data):
+        if data.startswith(b">"):
+            self._finish()
+            name = (data[1:].split() or [b""])[0].decode()
+            self.records.append([name, 0, self._offset + len(data), 0, 0])
+            if data.find(b"\n") != len(data) - 1:
+                # not a single, complete header line
+                self.valid = False
+        elif self.records:
+            self._add_sequence(data)
+        elif data.strip():
+            # sequence without a header
+            self.valid = False
+        self._offset += len(data)
+
+    def _add_sequence(self, data):
+        if not self.valid:
+            return
+        if b">" in data or b"\r" in data:
+            self.valid = False
+            return
+
+        rec = self.records[-1]
+        parts = data.split(b"\n")
+        rec[1] += len(data) - len(parts) + 1
+        if len(parts) == 1:
+            self._col += len(data)
+            return
+        lengths = [self._col + len(parts[0])]
+        lengths.extend(map(len, parts[1:-1]))
+        self._col = len(parts[-1])
+        self._check(rec, lengths)
+
+    def _check(self, rec, lengths):
+        """Check the length of complete lines."""
+        if rec[3] == 0:
+            rec[3] = lengths[0]
+            rec[4] = lengths[0] + 1
+        if self._short or min(lengths) == 0:
+            # lines after a shorter line, or empty lines
+            self.valid = False
+        elif lengths[:-1].count(rec[3]) != len(lengths) - 1 or lengths[-1] > rec[3]:
+            self.valid = False
+        elif lengths[-1] < rec[3]:
+            # only the last line of a sequence can be shorter
+            self._short = True
+
+    def _finish(self):
+        """Finish the current sequence."""
+        if self.records and self._col:
+            # last line without a newline
+            self._check(self.records[-1], [self._col])
+        self._col = 0
+        self._short = False
+
+    def write(self, fname):
+        """Write the index, returns False if the index is not valid."""
+        self._finish()
+        if not self.valid:
+            return False
+        with open(fname, "w") as f:
+            for rec in self.records:
+                f.write("\t".join(str(x) for x in rec) + "\n")
+        return True
+
+
+def write_fasta(lines, fname, bgzip=False, index=True):
+    """Write FASTA headers and sequences to a file.
+
+    The .fai index (and the .gzi index for bgzipped files) is created
+    while writing, so the file does not have to be read again for indexing.
+
+    Parameters
+    ----------
+    lines : iterable
+        FASTA headers and sequences (bytes), see read_fasta.
+
+    fname : str
+        Output filename.
+
+    bgzip : bool, optional
+        If set to True the output is compressed with bgzip.
+
+    index : bool, optional
+        If set to False, no index files are written.
+    """
+    if bgzip:
+        out = BgzfWriter(fname)
+    else:
+        out = open(fname, "wb")
+
+    fai = FaiIndex()
+    with out:
+        buf = []
+        size = 0
+        for line in lines:
+            fai.add(line)
+            if not buf and len(line) >= BLOCKSIZE:
+                # large blocks are written without copying
+                out.write(line)
+                continue
+            buf.append(line)
+            size += len(line)
+            if size >= BLOCKSIZE:
+                out.write(b"".join(buf))
+                buf = []
+                size = 0
+        out.write(b"".join(buf))
+
+    # indexes are written after the FASTA file, so they are not outdated
+    if index:
+        if bgzip:
+            out.write_gzi()
+        fai.write(fname + ".fai")
+
+
+def bgzip_fasta(fname):
+    """Compress a FASTA file with bgzip (with .fai and .gzi index).
+
+    The uncompressed file is removed.
+
+    Parameters
+    ----------
+    fname : str
+        FASTA filename, the output is fname + ".gz"
+    """
+    with open(fname, "rb") as f:
+        write_fasta(read_fasta(f, fname), fname + ".gz", bgzip=True)
+    os.unlink(fname)
+    if os.path.exists(fname + ".fai"):
+        os.unlink(fname + ".fai")
+
+
+class FastaReader(object):
+    """
+    Random access to the sequences of a (bgzipped) FASTA file.
+
+    Sequences are read directly from the file using the .fai index; a
+    memory map for uncompressed files, block-wise decompression for
+    bgzipped files. Coordinates are 0-based, end exclusive. As in pyfaidx,
+    regions that extend past the end of a sequence are truncated.
+
+    Parameters
+    ----------
+    fname : str
+        Filename of the FASTA file, with a .fai index.
+
+    cache_size, read_ahead : int , optional
+        Size of the block cache and number of blocks to read ahead, for
+        bgzipped files (see BgzfReader).
+    """
+
+    def __init__(self, fname, cache_size=0, read_ahead=0):
+        self.fname = fname
+        self.records = {rec[0]: rec[1:] for rec in read_fai(fname + ".fai")}
+        self._mmap = None
+        if is_bgzf(fname):
+            self._reader = BgzfReader(fname, cache_size, read_ahead)
+        else:
+            self._reader = open(fname, "rb")
+            if os.path.getsize(fname) > 0:
+                self._mmap = mmap.mmap(
+                    self._reader.fileno(), 0, access=mmap.ACCESS_READ
+                )
+
+    def _read(self, start, length):
+        if self._mmap is None:
+            return self._reader.read(start, length)
+        return self._mmap[start : start + length]
+
+    def fetch(self, name, start, end):
+        """Return the sequence of a single region."""
+        # the same as fetch_many, without the overhead of arrays
+        try:
+            length, offset, linebases, linewidth = self.records[name]
+        except KeyError:
+            raise FetchError(
+                "Requested rname {0} does not exist! "
+                "Please check your FASTA file.".format(name)
+            )
+        if start < 0:
+            raise FetchError("Requested start coordinate must be greater than 1.")
+        end = min(end, length)
+        if end <= start:
+            return ""
+        linebases = max(linebases, 1)
+        bstart = offset + start // linebases * linewidth + start % linebases
+        last = end - 1
+        bend = offset + last // linebases * linewidth + last % linebases + 1
+        return self._read(bstart, bend - bstart).translate(None, b"\r\n").decode()
+
+    def fetch_many(self, names, starts, ends):
+        """
+        Return the sequences of many regions.
+
+        The regions are read in the order of the file, and regions that are
+        close to each other are read at once, so the file is read
+        sequentially.
+
+        Parameters
+        ----------
+        names : list
+            Sequence names.
+
+        starts, ends : list or numpy.ndarray
+            0-based start and (exclusive) end positions.
+
+        Returns
+        -------
+        list of str
+            Sequences in the order of the regions.
+        """
+        try:
+            info = np.array([self.records[name] for name in names], np.int64)
+        except KeyError as e:
+            raise FetchError(
+                "Requested rname {0} does not exist! "
+                "Please check your FASTA file.".format(e.args[0])
+            )
+        if len(info) == 0:
+            return []
+        length, offset, linebases, linewidth = info.T
+        starts = np.asarray(starts, np.int64)
+        ends = np.minimum(np.asarray(ends, np.int64), length)
+        if (starts < 0).any():
+            raise FetchError("Requested start coordinate must be greater than 1.")
+        starts = np.minimum(starts, ends)
+
+        linebases = np.maximum(linebases, 1)
+        bstart = offset + starts // linebases * linewidth + starts % linebases
+        last = ends - 1
+        bend = offset + last // linebases * linewidth + last % linebases + 1
+        bend = np.where(ends > starts, bend, bstart)
+
+        # group regions that are (nearly) adjacent in the file
+        order = np.argsort(bstart, kind="stable")
+        sorted_end = np.maximum.accumulate(bend[order])
+        new = np.ones(len(order), bool)
+        new[1:] = bstart[order][1:] > sorted_end[:-1] + MERGE_DISTANCE
+        groups = np.split(order, np.flatnonzero(new)[1:])
+
+        seqs = [None] * len(starts)
+        bstart, bend = bstart.tolist(), bend.tolist()
+        for group in groups:
+            group = group.tolist()
+            start = bstart[group[0]]
+            data = self._read(start, max(bend[i] for i in group) - start)
+            for i in group:
+                seq = data[bstart[i] - start : bend[i] - start]
+                seqs[i] = seq.translate(None, b"\r\n").decode()
+        return seqs
+
+    def close(self):
+        if self._mmap is not None:
+            self._mmap.close()
+        self._reader.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
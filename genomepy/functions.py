@@ -1,17 +1,38 @@
 """Module-level functions."""
-import bisect
+import asyncio
 import os
 import glob
 import norns
-import random
+import queue
 import re
+import sys
+import threading
+import time
+
+import numpy as np
 
 from appdirs import user_config_dir
 from collections.abc import Iterable
-from pyfaidx import Fasta, Sequence
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import partial
+from pyfaidx import Fasta, FetchError, Sequence
 from genomepy.provider import ProviderBase
 from genomepy.plugin import get_active_plugins, init_plugins
-from genomepy.utils import generate_gap_bed, get_localname
+from genomepy.bgzf import is_bgzf
+from genomepy.download import cache_options
+from genomepy.fasta import FastaReader
+from genomepy.gaps import GapIndex, find_gaps
+from genomepy.regions import (
+    extract_sequences,
+    read_bed,
+    read_regions,
+    write_transcriptome,
+)
+from genomepy.seqarray import SeqArray, write_seqarray
+from genomepy.shared import SharedGenome
+from genomepy.stats import genome_files
+from genomepy.twobit import TwoBitReader
+from genomepy.utils import generate_gap_bed, get_localname, is_outdated
 
 config = norns.config("genomepy", default="cfg/default.yaml")
 
@@ -35,29 +56,161 @@ def manage_config(cmd, *args):
         print("Created config file {}".format(fname))
 
 
-def list_available_genomes(provider=None):
+# marks the end of the results of a provider
+_DONE = object()
+# providers that do not finish within PROVIDER_TIMEOUT seconds are skipped
+PROVIDER_TIMEOUT = 300
+
+
+def _providers(provider=None, exclude=()):
+    """Return the provider instances to query."""
+    if provider:
+        return [ProviderBase.create(provider)]
+    return [
+        ProviderBase.create(p)
+        for p in ProviderBase.list_providers()
+        if p not in exclude
+    ]
+
+
+def _query_providers(providers, method, args, put):
+    """
+    Query all providers at the same time, each in its own thread.
+
+    Each result is passed to put as a (provider, row) tuple. A provider puts
+    _DONE when it is finished, or the exception it raised.
+    """
+
+    def query(p):
+        try:
+            for row in getattr(p, method)(*args):
+                put((p, row))
+        except Exception as e:
+            put((p, e))
+        else:
+            put((p, _DONE))
+
+    for p in providers:
+        # daemon threads, so a provider that hangs does not block exit
+        threading.Thread(target=query, args=(p,), daemon=True).start()
+
+
+def _timeout(timeout):
+    """Return the provider timeout (seconds), None waits indefinitely."""
+    if timeout is None:
+        timeout = config.get("provider_timeout", PROVIDER_TIMEOUT)
+    return timeout or None
+
+
+def _remaining(deadline):
+    if deadline is None:
+        return None
+    return max(deadline - time.time(), 0)
+
+
+def _timed_out(running):
+    for p in running:
+        sys.stderr.write("Provider {} timed out, skipping...\n".format(p.name))
+
+
+def _concurrent(providers, method, args, timeout=None):
+    """Yield (provider, row) tuples as soon as any provider returns them."""
+    timeout = _timeout(timeout)
+    deadline = time.time() + timeout if timeout else None
+    results = queue.Queue()
+    _query_providers(providers, method, args, results.put)
+
+    running = set(providers)
+    while running:
+        try:
+            p, row = results.get(timeout=_remaining(deadline))
+        except queue.Empty:
+            _timed_out(running)
+            return
+        if row is _DONE:
+            running.remove(p)
+        elif isinstance(row, Exception):
+            raise row
+        else:
+            yield p, row
+
+
+async def _concurrent_async(providers, method, args, timeout=None):
+    """Asynchronously yield (provider, row) tuples."""
+    timeout = _timeout(timeout)
+    deadline = time.time() + timeout if timeout else None
+    loop = asyncio.get_event_loop()
+    results = asyncio.Queue()
+    _query_providers(
+        providers,
+        method,
+        args,
+        lambda item: loop.call_soon_threadsafe(results.put_nowait, item),
+    )
+
+    running = set(providers)
+    while running:
+        try:
+            p, row = await asyncio.wait_for(results.get(), _remaining(deadline))
+        except asyncio.TimeoutError:
+            _timed_out(running)
+            return
+        if row is _DONE:
+            running.remove(p)
+        elif isinstance(row, Exception):
+            raise row
+        else:
+            yield p, row
+
+
+def list_available_genomes(provider=None, timeout=None):
     """
     List all available genomes.
 
+    All providers are queried at the same time, and genomes are returned
+    as soon as a provider lists them.
+
     Parameters
     ----------
     provider : str, optional
         List genomes from specific provider. Genomes from all
         providers will be returned if not specified.
 
+    timeout : float, optional
+        Skip providers that do not finish within this number of seconds.
+        By default `provider_timeout` from the config file is used
+        (default 300, 0 waits indefinitely).
+
     Returns
     -------
     list with genome names
     """
-    if provider:
-        providers = [ProviderBase.create(provider)]
-    else:
-        # if provider is not specified search all providers
-        providers = [ProviderBase.create(p) for p in ProviderBase.list_providers()]
+    providers = _providers(provider, exclude=["url"])
+    for p, row in _concurrent(providers, "list_available_genomes", (), timeout):
+        yield [p.name] + list(row)
 
-    for p in providers:
-        for row in p.list_available_genomes():
-            yield [p.name] + list(row)
+
+async def list_available_genomes_async(provider=None, timeout=None):
+    """
+    List all available genomes, asynchronous version of list_available_genomes.
+
+    Parameters
+    ----------
+    provider : str, optional
+        List genomes from specific provider. Genomes from all
+        providers will be returned if not specified.
+
+    timeout : float, optional
+        Skip providers that do not finish within this number of seconds.
+
+    Yields
+    ------
+    list with genome names
+    """
+    providers = _providers(provider, exclude=["url"])
+    rows = _concurrent_async(providers, "list_available_genomes", (), timeout)
+    async for p, row in rows:
+        yield [p.name] + list(row)
 
 
 def list_available_providers():
@@ -111,13 +264,13 @@ def list_installed_genomes(genome_dir=None):
     ]
 
 
-def search(term, provider=None):
+def search(term, provider=None, timeout=None):
     """
     Search for a genome.
 
      If provider is specified, search only that specific provider, else
-     search all providers. Both the name and description are used for the
-     search. Search term is case-insensitive.
+     search all providers (at the same time). Both the name and description
+     are used for the search. Search term is case-insensitive.
 
     Parameters
     ----------
@@ -127,21 +280,50 @@ def search(term, provider=None):
     provider : str , optional
         Provider name
 
+    timeout : float, optional
+        Skip providers that do not finish within this number of seconds.
+        By default `provider_timeout` from the config file is used
+        (default 300, 0 waits indefinitely).
+
     Yields
     ------
     tuple
         genome information (name/identfier and description)
     """
-    if provider:
-        providers = [ProviderBase.create(provider)]
-    else:
-        # if provider is not specified search all providers (except direct url)
-        providers = [
-            ProviderBase.create(p) for p in ProviderBase.list_providers() if p != "url"
-        ]
-    for p in providers:
-        for row in p.search(term):
-            yield [x.encode("latin-1") for x in [p.name] + list(row)]
+    # if provider is not specified search all providers (except direct url)
+    providers = _providers(provider, exclude=["url"])
+    for p, row in _concurrent(providers, "search", (term,), timeout):
+        yield [x.encode("latin-1") for x in [p.name] + list(row)]
+
+
+async def search_async(term, provider=None, timeout=None):
+    """
+    Search for a genome, asynchronous version of search.
+
+    Results are yielded as soon as any provider returns them:
+
+    >>> async for row in search_async("zebrafish"):
+    ...     print(row)
+
+    Parameters
+    ----------
+    term : str
+        Search term, case-insensitive.
+
+    provider : str , optional
+        Provider name
+
+    timeout : float, optional
+        Skip providers that do not finish within this number of seconds.
+
+    Yields
+    ------
+    tuple
+        genome information (name/identfier and description)
+    """
+    providers = _providers(provider, exclude=["url"])
+    async for p, row in _concurrent_async(providers, "search", (term,), timeout):
+        yield [x.encode("latin-1") for x in [p.name] + list(row)]
 
 
 def install_genome(
@@ -155,6 +337,7 @@ def install_genome(
     bgzip=None,
     annotation=False,
     force=False,
+    no_cache=False,
     **kwargs
 ):
     """
@@ -191,7 +374,11 @@ def install_genome(
         If set to True, download gene annotation in BED and GTF format.
 
     force : bool , optional
-        Set to True to overwrite existing files.
+        Set to True to overwrite existing files. Cached downloads are
+        downloaded again.
+
+    no_cache : bool , optional
+        Set to True to neither use nor fill the download cache.
 
     kwargs : dict, optional
         Provider specific options.
@@ -203,41 +390,88 @@ def install_genome(
         version : int, optional
             Ensembl only: Specify release version. Default is latest.
     """
+    genome_dir = _genome_dir(genome_dir)
+    localname = _download_genome(
+        name,
+        provider,
+        genome_dir,
+        localname=localname,
+        mask=mask,
+        regex=regex,
+        invert_match=invert_match,
+        bgzip=bgzip,
+        annotation=annotation,
+        force=force,
+        no_cache=no_cache,
+        **kwargs
+    )
+    _post_process(localname, genome_dir, force=force)
+
+    generate_env()
+
+
+def _genome_dir(genome_dir=None):
     if not genome_dir:
         genome_dir = config.get("genome_dir", None)
     if not genome_dir:
         raise norns.exceptions.ConfigError("Please provide or configure a genome_dir")
+    return os.path.expanduser(genome_dir)
 
-    genome_dir = os.path.expanduser(genome_dir)
+
+def _download_genome(
+    name,
+    provider,
+    genome_dir,
+    localname=None,
+    mask="soft",
+    regex=None,
+    invert_match=False,
+    bgzip=None,
+    annotation=False,
+    force=False,
+    no_cache=False,
+    **kwargs
+):
+    """Download (and process) the genome and annotation, returns the local name."""
     localname = get_localname(name, localname)
     out_dir = os.path.join(genome_dir, localname)
 
-    # Check if genome already exists, or if downloading is forced
-    no_genome_found = not any(
-        os.path.exists(fname) for fname in glob_ext_files(out_dir, "fa")
-    )
-    if no_genome_found or force:
-        # Download genome from provider
-        p = ProviderBase.create(provider)
-        p.download_genome(
-            name,
-            genome_dir,
-            mask=mask,
-            regex=regex,
-            invert_match=invert_match,
-            localname=localname,
-            bgzip=bgzip,
-            **kwargs
+    # force downloads the files again, also if they are cached
+    with cache_options(enabled=not no_cache, refresh=force):
+        # Check if genome already exists, or if downloading is forced
+        no_genome_found = not any(
+            os.path.exists(fname) for fname in glob_ext_files(out_dir, "fa")
         )
+        if no_genome_found or force:
+            # Download genome from provider
+            p = ProviderBase.create(provider)
+            p.download_genome(
+                name,
+                genome_dir,
+                mask=mask,
+                regex=regex,
+                invert_match=invert_match,
+                localname=localname,
+                bgzip=bgzip,
+                **kwargs
+            )
 
-    # If annotation is requested, check if annotation already exists, or if downloading is forced
-    no_annotation_found = not any(
-        os.path.exists(fname) for fname in glob_ext_files(out_dir, "gtf")
-    )
-    if annotation and (no_annotation_found or force):
-        # Download annotation from provider
-        p = ProviderBase.create(provider)
-        p.download_annotation(name, genome_dir, localname=localname, **kwargs)
+        # If annotation is requested, check if annotation already exists, or if
+        # downloading is forced
+        no_annotation_found = not any(
+            os.path.exists(fname) for fname in glob_ext_files(out_dir, "gtf")
+        )
+        if annotation and (no_annotation_found or force):
+            # Download annotation from provider
+            p = ProviderBase.create(provider)
+            p.download_annotation(name, genome_dir, localname=localname, **kwargs)
+
+    return localname
+
+
+def _post_process(localname, genome_dir, force=False):
+    """Index the genome, run the plugins and generate the gap file."""
+    out_dir = os.path.join(genome_dir, localname)
 
     # generates a Fasta object and the index file
     g = Genome(localname, genome_dir=genome_dir)
@@ -246,13 +480,86 @@ def install_genome(
     for plugin in get_active_plugins():
         plugin.after_genome_download(g, force)
 
-    # Generate gap file if not found or if generation is forced
+    # Generate gap file if not found, outdated or if generation is forced. It
+    # is generated during the download, unless the genome was not downloaded.
     gap_file = os.path.join(out_dir, localname + ".gaps.bed")
-    if not os.path.exists(gap_file) or force:
-        generate_gap_bed(glob_ext_files(out_dir, "fa")[0], gap_file)
+    fname = glob_ext_files(out_dir, "fa")[0]
+    if force or is_outdated(gap_file, fname):
+        generate_gap_bed(fname, gap_file)
+
+
+def install_many(
+    genomes, genome_dir=None, downloads=4, processes=1, force=False, no_cache=False
+):
+    """
+    Install multiple genomes.
+
+    Downloads run in one pool and the post-processing (indexing, plugins
+    such as aligner indexes and gap files) in another, so genomes are
+    downloaded while the indexes of other genomes are built.
+
+    Parameters
+    ----------
+    genomes : list of dicts
+        Genomes to install. Each genome has a name and a provider, and
+        optionally any of the other options of install_genome, e.g.
+        [{"name": "hg38", "provider": "UCSC", "annotation": True}]
+
+    genome_dir : str , optional
+        Where to store the fasta files, used for genomes that do not
+        specify a genome_dir.
+
+    downloads : int , optional
+        Number of simultaneous downloads.
+
+    processes : int , optional
+        Number of genomes that are post-processed at the same time. Index
+        builds can use a lot of memory.
+
+    force : bool , optional
+        Set to True to overwrite existing files, used for genomes that do
+        not specify force.
+
+    no_cache : bool , optional
+        Set to True to not use the download cache, used for genomes that do
+        not specify no_cache.
+    """
+    options = []
+    for genome in genomes:
+        genome = dict(genome)
+        genome.setdefault("force", force)
+        genome.setdefault("no_cache", no_cache)
+        genome["genome_dir"] = _genome_dir(genome.get("genome_dir", genome_dir))
+        options.append(genome)
+
+    failed = []
+    with ThreadPoolExecutor(downloads) as network, ThreadPoolExecutor(processes) as cpu:
+        jobs = {network.submit(_download_genome, **opts): opts for opts in options}
+        post = {}
+        for job in as_completed(jobs):
+            opts = jobs[job]
+            try:
+                localname = job.result()
+            except Exception as e:
+                sys.stderr.write("Could not install {}: {}\n".format(opts["name"], e))
+                failed.append(opts["name"])
+                continue
+            args = (localname, opts["genome_dir"], opts["force"])
+            post[cpu.submit(_post_process, *args)] = opts
+
+        for job in as_completed(post):
+            try:
+                job.result()
+            except Exception as e:
+                name = post[job]["name"]
+                sys.stderr.write("Could not process {}: {}\n".format(name, e))
+                failed.append(name)
 
     generate_env()
 
+    if failed:
+        raise Exception("Failed to install: {}".format(", ".join(failed)))
+
 
 def get_track_type(track):
     region_p = re.compile(r"^(.+):(\d+)-(\d+)$")
@@ -266,24 +573,6 @@ def get_track_type(track):
     return "bed"
 
 
-def _weighted_selection(l, n):
-    """
-        Selects  n random elements from a list of (weight, item) tuples.
-        Based on code snippet by Nick Johnson
-    """
-    cuml = []
-    items = []
-    total_weight = 0.0
-    for weight, item in l:
-        total_weight += weight
-        cuml.append(total_weight)
-        items.append(item)
-
-    return [
-        items[bisect.bisect(cuml, random.random() * total_weight)] for _ in range(n)
-    ]
-
-
 def generate_exports():
     """Print export commands for setting environment variables.
     """
@@ -336,11 +625,185 @@ def glob_ext_files(dirname, ext="fa"):
     return [fname for fname in fnames if fname.endswith(ext) or fname.endswith("gz")]
 
 
-class Genome(Fasta):
+# cached Genome instances, see _GenomeRegistry
+_genomes = {}
+# genome names and FASTA files per genome_dir, see _genome_lookup
+_genome_dirs = {}
+_registry_lock = threading.RLock()
+
+
+def _genome_lookup(genome_dir):
+    """
+    Return the genomes in genome_dir, as a dict of genome name to FASTA files.
+
+    The directory is listed once, and again only when its modification
+    time changes (a genome was added or removed). The values are
+    [modification time, FASTA files] of the genome directories.
+    """
+    mtime = os.stat(genome_dir).st_mtime_ns
+    lookup = _genome_dirs.get(genome_dir)
+    if lookup is None or lookup[0] != mtime:
+        genomes = {}
+        with os.scandir(genome_dir) as entries:
+            for entry in entries:
+                if entry.is_dir():
+                    genomes[entry.name] = [None, []]
+        lookup = (mtime, genomes)
+        _genome_dirs[genome_dir] = lookup
+    return lookup[1]
+
+
+def _genome_fnames(genome_dir, name):
+    """Return the FASTA files of a genome, using the genome_dir lookup."""
+    dirname = os.path.join(genome_dir, name)
+    if os.sep in name or (os.altsep and os.altsep in name):
+        return glob_ext_files(dirname)
+
+    genome = _genome_lookup(genome_dir).get(name)
+    if genome is None:
+        return []
+    # only the genome directory is checked for changes, with a single stat
+    mtime = os.stat(dirname).st_mtime_ns
+    if genome[0] != mtime:
+        genome[:] = [mtime, glob_ext_files(dirname)]
+    return genome[1]
+
+
+def _find_genome(name, genome_dir=None):
+    """
+    Return the FASTA filename and name of a genome.
+
+    Parameters
+    ----------
+    name : str
+        FASTA filename, directory with a single FASTA file (if genome_dir is
+        specified) or the name of a genome in genome_dir.
+
+    genome_dir : str , optional
+        Genome installation directory, by default the configured genome_dir.
+
+    Returns
+    -------
+    tuple
+        Filename and name.
+    """
+    if os.path.isfile(name):
+        return name, os.path.basename(name)
+
+    if os.path.isdir(name) and genome_dir is not None:
+        fnames = glob_ext_files(name)
+        if len(fnames) == 1:
+            return fnames[0], os.path.basename(fnames[0])
+
+    if not genome_dir:
+        genome_dir = config.get("genome_dir", None)
+    if not genome_dir:
+        raise norns.exceptions.ConfigError("Please provide or configure a genome_dir")
+    genome_dir = os.path.expanduser(genome_dir)
+
+    if not os.path.exists(genome_dir):
+        raise FileNotFoundError("genome_dir {} does not exist".format(genome_dir))
+
+    fnames = _genome_fnames(genome_dir, name.replace(".gz", ""))
+    if len(fnames) == 0:
+        raise FileNotFoundError(
+            "no *.fa files found in genome_dir {}".format(
+                os.path.join(genome_dir, name)
+            )
+        )
+    elif len(fnames) > 1:
+        fname = os.path.join(genome_dir, name, "{}.fa".format(name))
+        if fname not in fnames:
+            fname += ".gz"
+            if fname not in fnames:
+                raise Exception(
+                    "More than one FASTA file found, no {}.fa!".format(name)
+                )
+    else:
+        fname = fnames[0]
+    return fname, name
+
+
+def _restore_genome(key, version, fname):
+    """
+    Return the Genome of a pickled instance, see Genome.__reduce__.
+
+    The cached instance of this process is used if it has the same version
+    (modification time and size of the files). Otherwise a new instance is
+    cached, which opens the genome when it is first used.
+    """
+    with _registry_lock:
+        cached = _genomes.get(key)
+        if cached is not None and cached[1:] == (version, os.getpid()):
+            cached[0]._users += 1
+            return cached[0]
+        cls, _, name, backend = key
+        genome = cls.__new__(cls)
+        genome.__dict__.update(
+            _lazy=(fname, name, backend), _key=key, _version=version, _users=1
+        )
+        _genomes[key] = (genome, version, os.getpid())
+        return genome
+
+
+class _GenomeRegistry(type):
+    """
+    Metaclass that returns cached Genome instances.
+
+    Instances are shared by all threads of a process. They are keyed by the
+    class, the resolved path, the name and the backend of the genome, and
+    replaced when the modification time or size of the FASTA (or .2bit) file
+    changes, when the instance was closed, or in a forked process. Each call
+    adds a user, see Genome.close().
+    """
+
+    def __call__(cls, name, genome_dir=None, backend="fasta"):
+        fname, genome_name = _find_genome(name, genome_dir)
+        files = [fname]
+        if backend == "2bit":
+            files.append(genome_files(fname)["twobit"])
+        # the instance is replaced when one of the files changes
+        stats = [os.stat(f) for f in files if os.path.exists(f)]
+        version = [(s.st_mtime_ns, s.st_size) for s in stats]
+        key = (cls, os.path.realpath(fname), genome_name, backend)
+        with _registry_lock:
+            cached = _genomes.get(key)
+            # open files are not shared with forked processes
+            if cached is not None and cached[1:] == (version, os.getpid()):
+                genome = cached[0]
+                if not getattr(genome.faidx.file, "closed", False):
+                    genome._users += 1
+                    return genome
+            genome = super(_GenomeRegistry, cls).__call__(name, genome_dir, backend)
+            genome._key = key
+            genome._version = version
+            genome._users = 1
+            _genomes[key] = (genome, version, os.getpid())
+        return genome
+
+    def clear_cache(cls):
+        """Remove all cached Genome instances and genome_dir lookups."""
+        with _registry_lock:
+            _genomes.clear()
+            _genome_dirs.clear()
+
+
+class Genome(Fasta, metaclass=_GenomeRegistry):
     """
     Get pyfaidx Fasta object of genome
 
-    Also generates an index file of the genome
+    Also generates an index file of the genome. Genome instances are cached
+    per process: creating a Genome for the same (unchanged) FASTA file
+    returns the same instance. Use Genome.clear_cache() to remove all cached
+    instances.
+
+    As the instance is shared, close() (or the end of a with block) only
+    closes the files when every caller that created the Genome has closed
+    it. A closed genome is opened again by the next Genome() call.
+
+    A Genome is pickled as its path, name, backend and the version of its
+    files, so it can be sent to worker processes cheaply. In a worker, the
+    cached instance is used, or the genome is opened when first used.
 
     Parameters
     ----------
@@ -350,174 +813,311 @@ class Genome(Fasta):
     genome_dir : str
         Genome installation directory
 
+    backend : str , optional
+        "fasta" (default) reads sequences from the FASTA file, "2bit" from
+        the .2bit file created by the twobit plugin (see genomepy.twobit).
+        The .2bit file stores nucleotides other than A, C, G and T as N.
+
     Returns
     -------
     pyfaidx.Fasta object
     """
 
-    def __init__(self, name, genome_dir=None):
-
-        try:
-            # generates the Fasta object and the index file
-            super(Genome, self).__init__(name)
-            self.name = os.path.basename(name)
-        except Exception:
-            if (
-                os.path.isdir(name)
-                and len(glob_ext_files(name)) == 1
-                and genome_dir is not None
-            ):
-                fname = glob_ext_files(name)[0]
-                name = os.path.basename(fname)
-            else:
-                if not genome_dir:
-                    genome_dir = config.get("genome_dir", None)
-                if not genome_dir:
-                    raise norns.exceptions.ConfigError(
-                        "Please provide or configure a genome_dir"
-                    )
-                genome_dir = os.path.expanduser(genome_dir)
-
-                if not os.path.exists(genome_dir):
-                    raise FileNotFoundError(
-                        "genome_dir {} does not exist".format(genome_dir)
-                    )
-
-                fnames = glob_ext_files(
-                    os.path.join(genome_dir, name.replace(".gz", ""))
+    def __init__(self, name, genome_dir=None, backend="fasta"):
+        fname, self.name = _find_genome(name, genome_dir)
+        # generates the Fasta object and the index file
+        super(Genome, self).__init__(fname)
+
+        self._gap_index = None
+        self._seqarray = None
+        self._props = None
+        self._twobit = None
+        self._bgzf = None
+        if backend == "fasta" and is_bgzf(fname):
+            # decompressed blocks are cached, see BgzfReader
+            self._bgzf = FastaReader(
+                fname,
+                cache_size=int(config.get("bgzf_cache_size", 64) * 1024 * 1024),
+                read_ahead=config.get("bgzf_read_ahead", 0),
+            )
+        if backend == "2bit":
+            twobit = genome_files(fname)["twobit"]
+            if not os.path.exists(twobit):
+                raise FileNotFoundError(
+                    "{} not found, activate the twobit plugin and install the "
+                    "genome again".format(twobit)
                 )
-                if len(fnames) == 0:
-                    raise FileNotFoundError(
-                        "no *.fa files found in genome_dir {}".format(
-                            os.path.join(genome_dir, name)
-                        )
-                    )
-                elif len(fnames) > 1:
-                    fname = os.path.join(genome_dir, name, "{}.fa".format(name))
-                    if fname not in fnames:
-                        fname += ".gz"
-                        if fname not in fnames:
-                            raise Exception(
-                                "More than one FASTA file found, no {}.fa!".format(name)
-                            )
-                else:
-                    fname = fnames[0]
-
-            # generates the Fasta object and the index file
-            super(Genome, self).__init__(fname)
-            self.name = name
-
-        self._gap_sizes = None
-        self.props = {}
-
-        for plugin in get_active_plugins():
-            self.props[plugin.name()] = plugin.get_properties(self)
-
-    def _bed_to_seqs(self, track, stranded=False, extend_up=0, extend_down=0):
-        BUFSIZE = 10000
-        with open(track) as fin:
-            lines = fin.readlines(BUFSIZE)
-            while lines:
-                for line in lines:
-                    if line.startswith("#") or line.startswith("track"):
-                        continue
-
-                    vals = line.strip().split("\t")
-                    try:
-                        start, end = int(vals[1]), int(vals[2])
-                    except ValueError:
-                        raise
-
-                    rc = False
-                    if stranded:
-                        try:
-                            rc = vals[5] == "-"
-                        except IndexError:
-                            pass
-
-                    starts = [start]
-                    ends = [end]
-
-                    chrom = vals[0]
-
-                    # BED12
-                    if len(vals) == 12:
-                        starts = [int(x) for x in vals[11].split(",")[:-1]]
-                        sizes = [int(x) for x in vals[10].split(",")[:-1]]
-                        starts = [start + x for x in starts]
-                        ends = [start + size for start, size in zip(starts, sizes)]
-                    name = "{}:{}-{}".format(chrom, start, end)
-                    try:
-                        name = " ".join((name, vals[3]))
-                    except Exception:
-                        pass
-
-                    starts = [start + 1 for start in starts]
-
-                    # extend
-                    if extend_up:
-                        if rc:
-                            ends[-1] += extend_up
-                        else:
-                            starts[0] -= extend_up
-                    if extend_down:
-                        if rc:
-                            starts[0] -= extend_down
-                        else:
-                            ends[-1] += extend_down
-
-                    intervals = zip(starts, ends)
-                    seq = self.get_spliced_seq(chrom, intervals, rc)
-                    yield Sequence(name, seq.seq)
-
-                lines = fin.readlines(BUFSIZE)
-
-    def _region_to_seqs(self, track, extend_up=0, extend_down=0):
-        BUFSIZE = 10000
-        if isinstance(track, list):
-            for name in track:
-                chrom, coords = name.split(":")
-                start, end = [int(c) for c in coords.split("-")]
-                start += 1
-                start -= extend_up
-                end += extend_down
-                seq = self.get_seq(chrom, start, end)
-                yield Sequence(name, seq.seq)
+            self._twobit = TwoBitReader(twobit)
+        elif backend != "fasta":
+            raise ValueError("unknown backend {}".format(backend))
+
+    def __reduce__(self):
+        # only the path, name, backend and version of the files are pickled
+        return _restore_genome, (self._key, self._version, self.filename)
+
+    def __getattr__(self, attr):
+        # an unpickled Genome is opened when first used, see _restore_genome
+        if attr.startswith("__") or "_lazy" not in self.__dict__:
+            raise AttributeError(attr)
+        with _registry_lock:
+            lazy = self.__dict__.get("_lazy")
+            if lazy == "opening":
+                # an attribute that is not set (yet) while opening
+                raise AttributeError(attr)
+            if lazy is not None:
+                self.__dict__["_lazy"] = "opening"
+                try:
+                    fname, name, backend = lazy
+                    self.__init__(fname, backend=backend)
+                    self.name = name
+                except BaseException:
+                    self.__dict__["_lazy"] = lazy
+                    raise
+                del self.__dict__["_lazy"]
+        return getattr(self, attr)
+
+    def get_seq(self, name, start, end, rc=False):
+        """Return a sequence by record name and interval [start, end].
+
+        Coordinates are 1-based, closed interval. If rc is set, the reverse
+        complement is returned. Sequences of bgzipped genomes are read with
+        a cache of decompressed blocks, with the 2bit backend sequences are
+        read from the .2bit file.
+        """
+        if self._twobit is None and self._bgzf is None:
+            return super(Genome, self).get_seq(name, start, end, rc=rc)
+        if name not in self.faidx.index:
+            raise FetchError(
+                "Requested rname {0} does not exist! "
+                "Please check your FASTA file.".format(name)
+            )
+        if start < 1:
+            raise FetchError("Requested start coordinate must be greater than 1.")
+        if self._twobit is not None:
+            seq = self._twobit.fetch(name, start - 1, end)
         else:
-            with open(track) as fin:
-                lines = fin.readlines(BUFSIZE)
-                while lines:
-                    for line in lines:
-                        name = line.strip()
-                        chrom, coords = name.split(":")
-                        start, end = [int(c) for c in coords.split("-")]
-                        start += 1
-                        start -= extend_up
-                        end += extend_down
-                        seq = self.get_seq(chrom, start, end)
-                        yield Sequence(name, seq.seq)
-
-                    lines = fin.readlines(BUFSIZE)
+            seq = self._bgzf.fetch(name, start - 1, end)
+        seq = self.faidx.format_seq(seq, name, start, end)
+        if rc:
+            return -seq
+        return seq
 
-    def track2fasta(
-        self, track, fastafile=None, stranded=False, extend_up=0, extend_down=0
-    ):
-        track_type = get_track_type(track)
-        if track_type == "interval":
-            seqqer = self._region_to_seqs(
-                track, extend_up=extend_up, extend_down=extend_down
-            )
+    def cache_info(self):
+        """Return the statistics of the block cache of a bgzipped genome.
+
+        Returns
+        -------
+        dict or None
+            The number of "hits" and "misses" (blocks) and the number of
+            "blocks" and the "size" (bytes) of the cache. None if the genome
+            is not bgzipped.
+        """
+        if self._bgzf is None:
+            return None
+        return self._bgzf._reader.cache_info()
+
+    def close(self):
+        """Stop using the genome, the files are closed when all users are done."""
+        with _registry_lock:
+            self._users = max(self._users - 1, 0)
+            if self._users > 0 or "_lazy" in self.__dict__:
+                # still in use, or never opened
+                return
+        if self._twobit is not None:
+            self._twobit.close()
+        if self._bgzf is not None:
+            self._bgzf.close()
+        # Fasta.close() calls __exit__()
+        super(Genome, self).__exit__()
+
+    def __exit__(self, *args):
+        self.close()
+
+    @property
+    def props(self):
+        """Properties of the active plugins, computed when first accessed."""
+        if self._props is None:
+            self._props = {
+                plugin.name(): plugin.get_properties(self)
+                for plugin in get_active_plugins()
+            }
+        return self._props
+
+    def _track_seqs(self, track, stranded, extend_up, extend_down, processes):
+        """Yield the names and sequences (str) of the regions in a track."""
+        if get_track_type(track) == "interval":
+            parse = partial(read_regions, extend_up=extend_up, extend_down=extend_down)
         else:
-            seqqer = self._bed_to_seqs(
-                track, stranded=stranded, extend_up=extend_up, extend_down=extend_down
+            parse = partial(
+                read_bed,
+                stranded=stranded,
+                extend_up=extend_up,
+                extend_down=extend_down,
             )
+        return extract_sequences(self.filename, track, parse, processes)
+
+    def track2seqs(
+        self, track, stranded=False, extend_up=0, extend_down=0, processes=None
+    ):
+        """Yield the sequences of the regions in a track.
+
+        Regions are processed in batches by multiple processes, and read in
+        the order of the genome file. Sequences are returned in the order of
+        the track, while only a few batches are kept in memory.
+
+        Parameters
+        ----------
+        track : str or list
+            BED file, file with regions (chrom:start-end) or list of regions.
+
+        stranded : bool , optional
+            Reverse complement regions on the - strand (BED files only).
+
+        extend_up, extend_down : int , optional
+            Extend the regions upstream and downstream.
 
+        processes : int , optional
+            Number of processes, by default the number of cores.
+
+        Yields
+        ------
+        sequence : pyfaidx.Sequence
+        """
+        seqs = self._track_seqs(track, stranded, extend_up, extend_down, processes)
+        for name, seq in seqs:
+            yield Sequence(name, seq)
+
+    def track2fasta(
+        self,
+        track,
+        fastafile=None,
+        stranded=False,
+        extend_up=0,
+        extend_down=0,
+        processes=None,
+    ):
+        """Return the sequences of the regions in a track, or save them.
+
+        Parameters
+        ----------
+        track : str or list
+            BED file, file with regions (chrom:start-end) or list of regions.
+
+        fastafile : str , optional
+            Write the sequences to this FASTA file, instead of returning them.
+            The file is written while the sequences are extracted.
+
+        stranded : bool , optional
+            Reverse complement regions on the - strand (BED files only).
+
+        extend_up, extend_down : int , optional
+            Extend the regions upstream and downstream.
+
+        processes : int , optional
+            Number of processes, by default the number of cores.
+
+        Returns
+        -------
+        list of pyfaidx.Sequence
+            If fastafile is not specified. Use track2seqs to iterate over the
+            sequences instead.
+        """
         if fastafile:
+            seqs = self._track_seqs(track, stranded, extend_up, extend_down, processes)
             with open(fastafile, "w") as fout:
-                for seq in seqqer:
-                    fout.write("{}\n".format(seq.__repr__()))
+                for name, seq in seqs:
+                    fout.write(">{}\n{}\n".format(name, seq))
         else:
-            return [seq for seq in seqqer]
+            return list(
+                self.track2seqs(track, stranded, extend_up, extend_down, processes)
+            )
+
+    def transcriptome(self, fastafile, annotation=None, processes=None):
+        """Write the sequences of all transcripts of the genome annotation.
+
+        Parameters
+        ----------
+        fastafile : str
+            Output FASTA file. A .fai index is created as well.
+
+        annotation : str , optional
+            BED12 file with the transcripts, by default the annotation of
+            the genome (<name>.annotation.bed.gz).
+
+        processes : int , optional
+            Number of processes, by default the number of cores.
+        """
+        if annotation is None:
+            base = re.sub(r"\.gz$", "", self.filename)
+            annotation = os.path.splitext(base)[0] + ".annotation.bed.gz"
+        write_transcriptome(self.filename, annotation, fastafile, processes)
+
+    def gap_index(self):
+        """Return the gap index of the genome.
+
+        The index can be used to count the gap nucleotides in intervals and
+        to check if intervals overlap a gap, without reading the sequence.
+
+        Returns
+        -------
+        gap_index : GapIndex
+        """
+        if self._gap_index is None:
+            gap_file = genome_files(self.filename)["gaps"]
+
+            # generate gap file if not found (it is generated during install)
+            if is_outdated(gap_file, self.filename):
+                generate_gap_bed(self.filename, gap_file)
+            self._gap_index = GapIndex.load(gap_file)
+        return self._gap_index
+
+    def array(self, chrom, start=None, end=None):
+        """Return the sequence of a region as a read-only numpy array.
+
+        The array is a view of a memory-mapped file with the sequences
+        without newlines (created by the seqarray plugin, or when first
+        needed), so the sequence is not decoded or copied.
+
+        Parameters
+        ----------
+        chrom : str
+            Chromosome name.
+
+        start, end : int , optional
+            0-based start and (exclusive) end position, by default the
+            whole chromosome.
+
+        Returns
+        -------
+        numpy.ndarray
+            Sequence (uint8, ASCII).
+        """
+        if self._seqarray is None:
+            fname = genome_files(self.filename)["seqarray"]
+            if is_outdated(fname, self.filename):
+                write_seqarray(self.filename, fname)
+            self._seqarray = SeqArray(fname)
+        return self._seqarray.array(chrom, start, end)
+
+    def share(self, chroms=None):
+        """Publish the sequences in shared memory, for worker processes.
+
+        The sequences are stored once, without newlines, in a shared memory
+        segment. The returned SharedGenome can be passed to worker processes
+        (or attached by name with genomepy.shared.attach), where the
+        sequences are read as numpy arrays without copies. The segment is
+        removed when the SharedGenome is closed. Requires Python 3.8.
+
+        Parameters
+        ----------
+        chroms : list , optional
+            Names of the sequences, by default all sequences.
+
+        Returns
+        -------
+        SharedGenome
+        """
+        return SharedGenome.publish(self.filename, chroms)
 
     def gap_sizes(self):
         """Return gap sizes per chromosome.
@@ -528,24 +1128,17 @@ class Genome(Fasta):
             a dictionary with chromosomes as key and the total number of
             Ns as values
         """
-        if not self._gap_sizes:
-            gap_file = self.props["gaps"]["gaps"]
-
-            # generate gap file if not found
-            if not os.path.exists(gap_file):
-                generate_gap_bed(self.filename, gap_file)
+        return self.gap_index().gap_sizes()
 
-            self._gap_sizes = {}
-            with open(gap_file) as f:
-                for line in f:
-                    chrom, start, end = line.strip().split("\t")
-                    start, end = int(start), int(end)
-                    self._gap_sizes[chrom] = self._gap_sizes.get(chrom, 0) + end - start
-        return self._gap_sizes
-
-    def get_random_sequences(self, n=10, length=200, chroms=None, max_n=0.1):
+    def get_random_sequences(
+        self, n=10, length=200, chroms=None, max_n=0.1, seed=None, exclude=None
+    ):
         """Return random genomic sequences.
 
+        All positions are drawn at once. Windows with too many Ns, or that
+        overlap an excluded region, are rejected with the gap index, so the
+        sequence is never read.
+
         Parameters
         ----------
         n : int , optional
@@ -558,7 +1151,14 @@ class Genome(Fasta):
             Return sequences only from these chromosomes.
 
         max_n : float , optional
-            Maximum fraction of Ns.
+            Maximum fraction of Ns (gaps, uppercase N).
+
+        seed : int , optional
+            Seed of the random number generator, for reproducible sequences.
+
+        exclude : str , optional
+            BED file with regions (such as a blacklist) that the sequences
+            should not overlap.
 
         Returns
         -------
@@ -571,43 +1171,56 @@ class Genome(Fasta):
             chroms = self.keys()
 
         try:
-            gap_sizes = self.gap_sizes()
-        except Exception:
-            gap_sizes = {}
-        sizes = dict(
-            [(chrom, len(self[chrom]) - gap_sizes.get(chrom, 0)) for chrom in chroms]
-        )
-
-        lengths = [
-            (sizes[x], x)
-            for x in chroms
-            if sizes[x] / len(self[x]) > 0.1 and sizes[x] > 10 * length
+            gap_index = self.gap_index()
+        except OSError as e:
+            # the gap index can not be saved, e.g. in a read-only genome_dir
+            sys.stderr.write("Could not save the gap index: {}\n".format(e))
+            gap_index = GapIndex.from_gaps(find_gaps(self.filename))
+        gap_sizes = gap_index.gap_sizes()
+
+        # chromosomes are selected with a probability relative to their
+        # size without gaps, small or mostly-gap chromosomes are skipped
+        chroms = [
+            chrom
+            for chrom in chroms
+            if len(self[chrom]) - gap_sizes.get(chrom, 0)
+            > max(10 * length, 0.1 * len(self[chrom]))
+        ]
+        if len(chroms) == 0:
+            raise ValueError("No chromosomes larger than {}".format(10 * length))
+        lengths = np.array([len(self[chrom]) for chrom in chroms], np.int64)
+        weights = lengths - [gap_sizes.get(chrom, 0) for chrom in chroms]
+        offsets = np.concatenate([[0], np.cumsum(lengths)[:-1]])
+
+        # gaps and excluded regions of all chromosomes in one coordinate system
+        gaps = gap_index.concatenate(chroms, offsets)
+        excluded = None
+        if exclude:
+            excluded = GapIndex.from_bed(exclude).concatenate(chroms, offsets)
+
+        rng = np.random.default_rng(seed)
+        found = []
+        todo = n
+        for _ in range(retries):
+            if todo <= 0:
+                break
+            idx = rng.choice(len(chroms), size=todo, p=weights / weights.sum())
+            starts = (rng.random(todo) * (lengths[idx] - length + 1)).astype(np.int64)
+            pos = offsets[idx] + starts
+            ok = gaps.count_n("", pos, pos + length) <= cutoff
+            if excluded is not None:
+                ok &= ~excluded.overlaps("", pos, pos + length)
+            found.append((idx[ok], starts[ok]))
+            todo -= int(ok.sum())
+        if todo > 0:
+            raise ValueError("Failed to find suitable non-N sequences")
+
+        idx = np.concatenate([i for i, _ in found])[:n]
+        starts = np.concatenate([s for _, s in found])[:n]
+        return [
+            [chroms[i], start, start + length]
+            for i, start in zip(idx.tolist(), starts.tolist())
         ]
-        chroms = _weighted_selection(lengths, n)
-        coords = []
-
-        count = {}
-        for chrom in chroms:
-            if chrom in count:
-                count[chrom] += 1
-            else:
-                count[chrom] = 1
-
-        for chrom in chroms:
-            for _ in range(retries):
-                start = int(random.random() * (sizes[chrom] - length))
-                end = start + length
-                count_n = self[chrom][start:end].seq.upper().count("N")
-                if count_n <= cutoff:
-                    break
-            if count_n > cutoff:
-                raise ValueError(
-                    "Failed to find suitable non-N sequence for {}".format(chrom)
-                )
-
-            coords.append([chrom, start, end])
-
-        return coords
 
 
 def manage_plugins(command, plugin_names=None):
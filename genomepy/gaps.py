@@ -0,0 +1,455 @@
+"""Gap detection.
+
+Gaps (runs of N) are detected with numpy, directly on the bytes of the
+FASTA file. Using the .fai index, the sequence lines of a chromosome are
+read in large chunks (memory-mapped for uncompressed files, decompressed
+per BGZF block for bgzipped files), newlines are removed by reshaping the
+chunk to lines and the runs are found with a vectorized comparison. Runs
+that span multiple chunks are joined. Chromosomes are processed in parallel.
+"""
+import os
+
+import numpy as np
+
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from pyfaidx import Fasta
+
+from genomepy.bgzf import BgzfReader, is_bgzf
+from genomepy.fasta import BLOCKSIZE, read_fai
+
+# (approximate) size of the chunks that are scanned
+CHUNK_SIZE = BLOCKSIZE
+# minimum number of nucleotides per parallel task
+TASK_SIZE = 64 * 1024 * 1024
+
+_N = ord("N")
+
+
+def find_runs(seq, pos=0, run_start=None):
+    """
+    Find the runs of N in a chunk of sequence.
+
+    Parameters
+    ----------
+    seq : numpy.ndarray
+        Sequence (uint8), without newlines.
+
+    pos : int , optional
+        Position of the chunk in the chromosome.
+
+    run_start : int , optional
+        Start of a run at the end of the previous chunk.
+
+    Returns
+    -------
+    starts, ends : numpy.ndarray
+        Start and end positions of the runs that end in this chunk.
+
+    run_start : int or None
+        Start of a run that continues after this chunk.
+    """
+    return find_mask_runs(seq == _N, pos, run_start)
+
+
+def find_mask_runs(mask, pos=0, run_start=None):
+    """
+    Find the runs of True in a chunk of a boolean mask, see find_runs.
+
+    Parameters
+    ----------
+    mask : numpy.ndarray
+        Boolean array.
+
+    pos : int , optional
+        Position of the chunk in the chromosome.
+
+    run_start : int , optional
+        Start of a run at the end of the previous chunk.
+
+    Returns
+    -------
+    starts, ends : numpy.ndarray
+        Start and end positions of the runs that end in this chunk.
+
+    run_start : int or None
+        Start of a run that continues after this chunk.
+    """
+    if len(mask) == 0:
+        return np.empty(0, np.int64), np.empty(0, np.int64), run_start
+
+    is_run = mask.view(np.int8)
+    change = np.diff(is_run, prepend=np.int8(0), append=np.int8(0))
+    starts = np.flatnonzero(change == 1) + pos
+    ends = np.flatnonzero(change == -1) + pos
+
+    if run_start is not None:
+        if is_run[0]:
+            starts[0] = run_start
+        else:
+            starts = np.concatenate([[run_start], starts])
+            ends = np.concatenate([[pos], ends])
+    run_start = None
+    if is_run[-1]:
+        run_start = int(starts[-1])
+        starts, ends = starts[:-1], ends[:-1]
+    return starts, ends, run_start
+
+
+@contextmanager
+def byte_reader(fname):
+    """
+    Open a (bgzipped) file for random access.
+
+    Yields a function read(start, length) that returns the uncompressed
+    bytes as a numpy array (uint8). Uncompressed files are memory-mapped.
+    """
+    if is_bgzf(fname):
+        with BgzfReader(fname) as reader:
+            yield lambda start, length: np.frombuffer(
+                reader.read(start, length), np.uint8
+            )
+    else:
+        data = np.memmap(fname, np.uint8, "r") if os.path.getsize(fname) else None
+        yield lambda start, length: data[start : start + length]
+
+
+def sequence_chunks(read, length, offset, linebases, linewidth):
+    """
+    Yield the sequence of a chromosome in chunks, without newlines.
+
+    Parameters
+    ----------
+    read : function
+        Function that reads bytes from the FASTA file, see byte_reader.
+
+    length, offset, linebases, linewidth : int
+        The .fai record of the chromosome.
+
+    Yields
+    ------
+    numpy.ndarray
+        Sequence (uint8) of about CHUNK_SIZE nucleotides.
+    """
+    if linebases == 0:
+        return
+    nlines = max(1, CHUNK_SIZE // linewidth)
+    full = length // linebases
+    for line in range(0, full, nlines):
+        n = min(nlines, full - line)
+        chunk = read(offset + line * linewidth, n * linewidth)
+        if len(chunk) < n * linewidth:
+            # the last line of the file has no newline
+            pad = np.full(n * linewidth - len(chunk), ord("\n"), np.uint8)
+            chunk = np.concatenate([chunk, pad])
+        yield chunk.reshape(n, linewidth)[:, :linebases].ravel()
+
+    rest = length - full * linebases
+    if rest:
+        yield read(offset + full * linewidth, rest)
+
+
+def _find_gaps(fname, records):
+    """Return the gaps of the chromosomes in the .fai records."""
+    result = []
+    with byte_reader(fname) as read:
+        for name, length, offset, linebases, linewidth in records:
+            starts, ends = [np.empty(0, np.int64)], [np.empty(0, np.int64)]
+            pos = 0
+            run_start = None
+            for seq in sequence_chunks(read, length, offset, linebases, linewidth):
+                s, e, run_start = find_runs(seq, pos, run_start)
+                starts.append(s)
+                ends.append(e)
+                pos += len(seq)
+            if run_start is not None:
+                starts.append(np.array([run_start]))
+                ends.append(np.array([pos]))
+            result.append((name, np.concatenate(starts), np.concatenate(ends)))
+    return result
+
+
+def find_gaps(fname, processes=None):
+    """
+    Find the gaps (runs of N) in a (bgzipped) FASTA file.
+
+    Parameters
+    ----------
+    fname : str
+        Filename of the FASTA file. The .fai index is created if needed.
+
+    processes : int , optional
+        Number of processes, by default the number of cores.
+
+    Yields
+    ------
+    tuple
+        Chromosome name, numpy arrays of gap starts and ends (0-based,
+        end exclusive), in the order of the FASTA file.
+    """
+    # (re)creates the index if it does not exist or is outdated
+    Fasta(fname).close()
+    records = read_fai(fname + ".fai")
+    if processes is None:
+        processes = os.cpu_count() or 1
+
+    # group small chromosomes, so each task has a reasonable size
+    tasks = [[]]
+    size = 0
+    for rec in records:
+        if size >= TASK_SIZE:
+            tasks.append([])
+            size = 0
+        tasks[-1].append(rec)
+        size += rec[1]
+
+    if processes == 1 or len(tasks) == 1:
+        for task in tasks:
+            yield from _find_gaps(fname, task)
+        return
+
+    with ProcessPoolExecutor(min(processes, len(tasks))) as pool:
+        for result in pool.map(_find_gaps, [fname] * len(tasks), tasks):
+            yield from result
+
+
+def _index_files(fname):
+    """Return the filenames of the gap index of a gap BED file."""
+    base = fname[:-4] if fname.endswith(".bed") else fname
+    return base + ".npy", base + ".chroms.npy"
+
+
+class GapIndex(object):
+    """
+    Sorted, binary index of the gaps in a genome.
+
+    The gaps are stored in a .npy sidecar of the gap BED file, which is
+    memory-mapped, so opening the index does not parse the BED file. Gaps
+    are looked up by bisection. A cumulative gap length is stored per gap,
+    so the number of gap nucleotides in an interval takes two lookups,
+    regardless of the number of gaps.
+
+    Use GapIndex.load() to open (and if needed create) the index.
+
+    Parameters
+    ----------
+    gaps : numpy.ndarray
+        Array of shape (3, n): gap starts, gap ends and the cumulative gap
+        length before each gap (per chromosome). Gaps are grouped by
+        chromosome and sorted by position.
+
+    chroms : numpy.ndarray
+        Structured array with the chromosome "name" and the "first" and
+        "last" column of its gaps.
+    """
+
+    def __init__(self, gaps, chroms):
+        self._gaps = gaps
+        self._chroms = chroms
+        self._rows = None
+
+    @classmethod
+    def from_gaps(cls, gaps):
+        """
+        Create an index from gap locations.
+
+        Overlapping intervals are merged, so any set of regions (such as a
+        blacklist) can be indexed.
+
+        Parameters
+        ----------
+        gaps : iterable
+            Tuples of chromosome name, gap starts and gap ends, as yielded
+            by find_gaps.
+        """
+        names, rows, columns = [], [], []
+        n = 0
+        for name, starts, ends in gaps:
+            if len(starts) == 0:
+                continue
+            order = np.argsort(starts, kind="stable")
+            starts = np.asarray(starts, np.int64)[order]
+            ends = np.maximum.accumulate(np.asarray(ends, np.int64)[order])
+            # an interval that starts before the end of the previous ones
+            # is merged with them
+            new = np.concatenate([[True], starts[1:] > ends[:-1]])
+            starts = starts[new]
+            ends = ends[np.concatenate([new[1:], [True]])]
+            before = np.concatenate([[0], np.cumsum(ends - starts)[:-1]])
+            columns.append(np.vstack([starts, ends, before]))
+            names.append(name)
+            rows.append((n, n + len(starts)))
+            n += len(starts)
+
+        width = max([len(name) for name in names] + [1])
+        chroms = np.array(
+            [(name, first, last) for name, (first, last) in zip(names, rows)],
+            dtype=[("name", "U{}".format(width)), ("first", "i8"), ("last", "i8")],
+        )
+        if columns:
+            gaps = np.hstack(columns)
+        else:
+            gaps = np.empty((3, 0), np.int64)
+        return cls(gaps, chroms)
+
+    @classmethod
+    def from_bed(cls, fname):
+        """Create an index from a gap (or any other) BED file."""
+        gaps = {}
+        with open(fname) as f:
+            for line in f:
+                if line.startswith(("#", "track", "browser")) or not line.strip():
+                    continue
+                chrom, start, end = line.rstrip("\n").split("\t")[:3]
+                gaps.setdefault(chrom, ([], []))
+                gaps[chrom][0].append(int(start))
+                gaps[chrom][1].append(int(end))
+        return cls.from_gaps(
+            (chrom, np.array(starts), np.array(ends))
+            for chrom, (starts, ends) in gaps.items()
+        )
+
+    @classmethod
+    def load(cls, fname):
+        """
+        Open the index of a gap BED file.
+
+        The index is created if it does not exist, or if it is older than
+        the BED file.
+
+        Parameters
+        ----------
+        fname : str
+            Filename of the gap BED file (as created by generate_gap_bed).
+        """
+        gap_file, chrom_file = _index_files(fname)
+        if not all(
+            os.path.exists(f) and os.path.getmtime(f) >= os.path.getmtime(fname)
+            for f in [gap_file, chrom_file]
+        ):
+            cls.from_bed(fname).save(fname)
+        return cls(np.load(gap_file, mmap_mode="r"), np.load(chrom_file))
+
+    def concatenate(self, chroms, offsets):
+        """
+        Return an index of chromosomes placed after each other.
+
+        The gaps of all chromosomes are on a single coordinate system, so
+        intervals on different chromosomes can be queried at once (as the
+        chromosome with name "").
+
+        Parameters
+        ----------
+        chroms : list
+            Chromosome names.
+
+        offsets : list
+            Position of each chromosome in the concatenated coordinates.
+        """
+        starts, ends = [np.empty(0, np.int64)], [np.empty(0, np.int64)]
+        for chrom, offset in zip(chroms, offsets):
+            chrom_starts, chrom_ends = self.gaps(chrom)
+            starts.append(chrom_starts + offset)
+            ends.append(chrom_ends + offset)
+        return GapIndex.from_gaps([("", np.concatenate(starts), np.concatenate(ends))])
+
+    def save(self, fname):
+        """
+        Save the index as the sidecar of a gap BED file.
+
+        Parameters
+        ----------
+        fname : str
+            Filename of the gap BED file.
+        """
+        gap_file, chrom_file = _index_files(fname)
+        np.save(gap_file, np.ascontiguousarray(self._gaps))
+        np.save(chrom_file, self._chroms)
+
+    def _columns(self, chrom):
+        """Return the starts, ends and cumulative lengths of a chromosome."""
+        if self._rows is None:
+            self._rows = {
+                name: (first, last) for name, first, last in self._chroms.tolist()
+            }
+        first, last = self._rows.get(chrom, (0, 0))
+        return self._gaps[:, first:last]
+
+    def chroms(self):
+        """Return the names of the chromosomes with gaps."""
+        return self._chroms["name"].tolist()
+
+    def gaps(self, chrom):
+        """
+        Return the gaps of a chromosome.
+
+        Returns
+        -------
+        starts, ends : numpy.ndarray
+        """
+        starts, ends, _ = self._columns(chrom)
+        return starts, ends
+
+    def gap_sizes(self):
+        """Return a dictionary with the total gap size per chromosome."""
+        starts, ends, before = self._gaps
+        last = self._chroms["last"] - 1
+        sizes = before[last] + ends[last] - starts[last]
+        return dict(zip(self.chroms(), sizes.tolist()))
+
+    def count_n(self, chrom, start, end):
+        """
+        Return the number of gap nucleotides in (an array of) intervals.
+
+        Parameters
+        ----------
+        chrom : str
+            Chromosome name.
+
+        start, end : int or numpy.ndarray
+            0-based start and (exclusive) end of the interval(s).
+
+        Returns
+        -------
+        int or numpy.ndarray
+        """
+        starts, ends, before = self._columns(chrom)
+        start, end = np.asarray(start), np.asarray(end)
+        if len(starts) == 0:
+            return np.zeros_like(start) if start.ndim else 0
+
+        # gaps first up to last overlap the interval
+        first = np.searchsorted(ends, start, side="right")
+        last = np.searchsorted(starts, end, side="left") - 1
+        overlap = (last >= first) & (end > start)
+        first = np.minimum(first, len(starts) - 1)
+        last = np.maximum(last, 0)
+        total = before[last] + ends[last] - starts[last] - before[first]
+        # the first and last gap can extend outside of the interval
+        total -= np.maximum(start - starts[first], 0)
+        total -= np.maximum(ends[last] - end, 0)
+        total = np.where(overlap, total, 0)
+        return total if total.ndim else int(total)
+
+    def overlaps(self, chrom, start, end):
+        """
+        Return True if (an array of) intervals overlap a gap.
+
+        Parameters
+        ----------
+        chrom : str
+            Chromosome name.
+
+        start, end : int or numpy.ndarray
+            0-based start and (exclusive) end of the interval(s).
+
+        Returns
+        -------
+        bool or numpy.ndarray
+        """
+        starts, ends, _ = self._columns(chrom)
+        start, end = np.asarray(start), np.asarray(end)
+        first = np.searchsorted(ends, start, side="right")
+        last = np.searchsorted(starts, end, side="left") - 1
+        result = (last >= first) & (end > start)
+        return result if result.ndim else bool(result)
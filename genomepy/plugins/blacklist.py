@@ -1,7 +1,7 @@
 import os.path
 import re
 import sys
-from urllib.request import urlopen
+from genomepy.download import download_file
 from genomepy.plugin import Plugin
 
 
@@ -30,9 +30,7 @@ class BlacklistPlugin(Plugin):
                 return
             try:
                 sys.stderr.write("Downloading blacklist {}\n".format(link))
-                response = urlopen(link)
-                with open(fname, "wb") as bed:
-                    bed.write(response.read())
+                download_file(link, fname)
             except Exception as e:
                 sys.stderr.write(e)
                 sys.stderr.write(
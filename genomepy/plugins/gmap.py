@@ -3,6 +3,7 @@ import re
 import subprocess as sp
 from shutil import move, rmtree
 from tempfile import TemporaryDirectory
+from genomepy.fasta import bgzip_fasta
 from genomepy.plugin import Plugin
 from genomepy.utils import cmd_ok, run_index_cmd
 
@@ -41,12 +42,7 @@ class GmapPlugin(Plugin):
                 move(src, index_dir)
 
             if bgzip:
-                ret = sp.check_call(["bgzip", fname])
-                if ret != 0:
-                    raise Exception(
-                        "Error bgzipping genome {}. ".format(fname)
-                        + "Is tabix installed?"
-                    )
+                bgzip_fasta(fname)
 
     def get_properties(self, genome):
         props = {
@@ -0,0 +1,15 @@
+from genomepy.plugin import Plugin
+from genomepy.seqarray import write_seqarray
+from genomepy.stats import genome_files
+from genomepy.utils import is_outdated
+
+
+class SeqarrayPlugin(Plugin):
+    def after_genome_download(self, genome, force=False):
+        fname = self.get_properties(genome)["seqarray"]
+        if force or is_outdated(fname, genome.filename):
+            write_seqarray(genome.filename, fname)
+
+    def get_properties(self, genome):
+        props = {"seqarray": genome_files(genome.filename)["seqarray"]}
+        return props
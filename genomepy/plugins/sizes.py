@@ -1,5 +1,6 @@
-import os.path
 from genomepy.plugin import Plugin
+from genomepy.stats import genome_files
+from genomepy.utils import is_outdated
 
 
 class SizesPlugin(Plugin):
@@ -7,11 +8,12 @@ class SizesPlugin(Plugin):
         props = self.get_properties(genome)
         fname = props["sizes"]
 
-        if not os.path.exists(fname) or force:
+        # the sizes are written during install, while the genome is written
+        if force or is_outdated(fname, genome.filename):
             with open(fname, "w") as f:
                 for seqname in genome.keys():
                     f.write("{}\t{}\n".format(seqname, len(genome[seqname])))
 
     def get_properties(self, genome):
-        props = {"sizes": genome.filename.replace(".gz", "") + ".sizes"}
+        props = {"sizes": genome_files(genome.filename)["sizes"]}
         return props
@@ -2,6 +2,7 @@ import os
 import re
 import subprocess as sp
 from shutil import rmtree
+from genomepy.fasta import bgzip_fasta
 from genomepy.plugin import Plugin
 from genomepy.utils import mkdir_p, cmd_ok, run_index_cmd
 
@@ -38,12 +39,7 @@ class StarPlugin(Plugin):
 
             # Rezip genome if it was bgzipped
             if bgzip:
-                ret = sp.check_call(["bgzip", fname])
-                if ret != 0:
-                    raise Exception(
-                        "Error bgzipping genome {}. ".format(fname)
-                        + "Is tabix installed?"
-                    )
+                bgzip_fasta(fname)
 
     def get_properties(self, genome):
         props = {
@@ -0,0 +1,29 @@
+import os.path
+from shutil import rmtree
+from genomepy.plugin import Plugin
+from genomepy.utils import mkdir_p
+
+
+class TranscriptomePlugin(Plugin):
+    def after_genome_download(self, genome, force=False):
+        props = self.get_properties(genome)
+        if not os.path.exists(props["annotation"]):
+            return
+
+        index_dir = props["index_dir"]
+        if force:
+            # Start from scratch
+            rmtree(index_dir, ignore_errors=True)
+        mkdir_p(index_dir)
+
+        if not os.path.exists(props["fasta"]):
+            genome.transcriptome(props["fasta"], annotation=props["annotation"])
+
+    def get_properties(self, genome):
+        dirname = os.path.dirname(genome.filename)
+        props = {
+            "annotation": os.path.join(dirname, genome.name + ".annotation.bed.gz"),
+            "index_dir": os.path.join(dirname, "index", "transcriptome"),
+            "fasta": os.path.join(dirname, "index", "transcriptome", "transcripts.fa"),
+        }
+        return props
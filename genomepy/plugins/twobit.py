@@ -0,0 +1,15 @@
+from genomepy.plugin import Plugin
+from genomepy.stats import genome_files
+from genomepy.twobit import write_twobit
+from genomepy.utils import is_outdated
+
+
+class TwobitPlugin(Plugin):
+    def after_genome_download(self, genome, force=False):
+        fname = self.get_properties(genome)["twobit"]
+        if force or is_outdated(fname, genome.filename):
+            write_twobit(genome.filename, fname)
+
+    def get_properties(self, genome):
+        props = {"twobit": genome_files(genome.filename)["twobit"]}
+        return props
@@ -1,5 +1,6 @@
 """Genome providers."""
 import sys
+import json
 import requests
 import re
 import os
@@ -8,18 +9,35 @@ import time
 import gzip
 import xmltodict
 import shutil
-import tarfile
 import subprocess as sp
 
-from psutil import virtual_memory
-from tempfile import NamedTemporaryFile, TemporaryDirectory
-from urllib.request import urlopen, urlretrieve, urlcleanup, URLError
+from functools import partial
+from tempfile import TemporaryDirectory
+from urllib.request import urlcleanup
 from bucketcache import Bucket
-from pyfaidx import Fasta
 from appdirs import user_cache_dir
 
 from genomepy import exceptions
-from genomepy.utils import filter_fasta, get_localname
+from genomepy.download import (
+    Checksum,
+    download_file,
+    download_stream,
+    get_session,
+    mirror_url,
+    read_url,
+    request_timeout,
+    upstream_checksum,
+    url_exists,
+)
+from genomepy.fasta import (
+    read_fasta,
+    rename_headers,
+    mask_sequences,
+    filter_sequences,
+    write_fasta,
+)
+from genomepy.stats import GenomeStats, genome_files
+from genomepy.utils import get_localname
 from genomepy.__about__ import __version__
 
 my_cache_dir = os.path.join(user_cache_dir("genomepy"), __version__)
@@ -48,6 +66,11 @@ class ProviderBase(object):
 
     _providers = {}
     name = None
+    # local mirror of the provider, see LocalProvider
+    mirror = None
+    # file with published checksums, next to the downloads
+    checksum_file = None
+    checksum_algorithm = "md5"
 
     @classmethod
     def create(cls, name):
@@ -88,22 +111,22 @@ class ProviderBase(object):
     def __hash__(self):
         return hash(str(self.__class__))
 
+    def _url(self, url):
+        """Return the url, or its location in the local mirror."""
+        if self.mirror:
+            return mirror_url(self.mirror, url)
+        return url
+
+    def _checksum(self, url):
+        """Return the published checksum of a download (if any)."""
+        if self.checksum_file is None:
+            return Checksum()
+        return upstream_checksum(url, self.checksum_file, self.checksum_algorithm)
+
     def tar_to_bigfile(self, fname, outfile):
         """Convert tar of multiple FASTAs to one file."""
-        fnames = []
-        with TemporaryDirectory() as tmpdir:
-            # Extract files to temporary directory
-            with tarfile.open(fname) as tar:
-                tar.extractall(path=tmpdir)
-            for root, _, files in os.walk(tmpdir):
-                fnames += [os.path.join(root, fname) for fname in files]
-
-            # Concatenate
-            with open(outfile, "w") as out:
-                for infile in fnames:
-                    for line in open(infile):
-                        out.write(line)
-                    os.unlink(infile)
+        with open(fname, "rb") as f:
+            write_fasta(read_fasta(f, ".tar.gz"), outfile)
 
     def list_install_options(self):
         """List provider specific install options"""
@@ -159,65 +182,60 @@ class ProviderBase(object):
         if not os.path.exists(os.path.join(genome_dir, myname)):
             os.makedirs(os.path.join(genome_dir, myname))
 
+        if bgzip is None:
+            bgzip = config.get("bgzip", False)
+
+        # processing stages (e.g. masking), applied while streaming
+        stages = self._process_stages(name, mask)
+        not_included = []
+        if regex:
+            stages.append(
+                partial(
+                    filter_sequences,
+                    regex=regex,
+                    invert_match=invert_match,
+                    excluded=not_included,
+                )
+            )
+
         sys.stderr.write("Downloading genome from {}...\n".format(link))
 
         # download to tmp dir. Move genome on completion.
         # tmp dir is in genome_dir to prevent moving the genome between disks
         with TemporaryDirectory(dir=os.path.join(genome_dir, myname)) as tmpdir:
             fname = os.path.join(tmpdir, myname + ".fa")
-
-            # actual download
-            urlcleanup()
-            with urlopen(link) as response:
-                # check available memory vs file size.
-                available_memory = int(virtual_memory().available)
-                file_size = int(response.info()["Content-Length"])
-                # download file in chunks if >75% of memory would be used
-                cutoff = int(available_memory * 0.75)
-                chunk_size = None if file_size < cutoff else cutoff
-                with open(fname, "wb") as f_out:
-                    shutil.copyfileobj(response, f_out, chunk_size)
-
-            # unzip genome
-            if link.endswith("tar.gz"):
-                self.tar_to_bigfile(fname, fname)
-            elif link.endswith(".gz"):
-                # gunzip will only work with files ending with ".gz"
-                os.rename(fname, fname + ".gz")
-                ret = sp.check_call(["gunzip", "-f", fname])
-                if ret != 0:
-                    raise Exception("Error gunzipping genome {}".format(fname))
-
-            # process genome (e.g. masking)
-            if hasattr(self, "_post_process_download"):
-                self._post_process_download(name, localname, tmpdir, mask)
-
-            if regex:
-                os.rename(fname, fname + "_to_regex")
-                infa = fname + "_to_regex"
-                outfa = fname
-                filter_fasta(infa, outfa, regex=regex, v=invert_match, force=True)
-
-                not_included = [
-                    k for k in Fasta(infa).keys() if k not in Fasta(outfa).keys()
-                ]
-
-            # bgzip genome if requested
-            if bgzip is None:
-                bgzip = config.get("bgzip", False)
-
             if bgzip:
-                ret = sp.check_call(["bgzip", "-f", fname])
-                if ret != 0:
-                    raise Exception(
-                        "Error bgzipping {}. ".format(fname) + "Is tabix installed?"
-                    )
                 fname += ".gz"
 
-            # transfer the genome from the tmpdir to the genome_dir
-            src = fname
+            def process(response):
+                # process runs again when a download is resumed or retried
+                del not_included[:]
+                lines = read_fasta(response, link)
+                for stage in stages:
+                    lines = stage(lines)
+                # sizes, gaps and composition are collected while writing
+                stats = GenomeStats()
+                write_fasta(stats.scan(lines), fname, bgzip=bgzip)
+                stats.write(fname)
+
+            # download, unzip, process, (b)gzip and checksum in a single pass.
+            # the partial download is kept, so an interrupted download resumes.
+            urlcleanup()
+            checksum = self._checksum(link)
+            download_stream(
+                link, process, os.path.join(genome_dir, myname), checksum=checksum
+            )
+
+            # transfer the genome, its indexes and stats from the tmpdir to the
+            # genome_dir. The genome is moved first, so the other files are newer.
             dst = os.path.join(genome_dir, myname, os.path.basename(fname))
-            shutil.move(src, dst)
+            for ext in ["", ".fai", ".gzi"]:
+                if os.path.exists(fname + ext):
+                    shutil.move(fname + ext, dst + ext)
+            dst_files = genome_files(dst)
+            for key, src in genome_files(fname).items():
+                if os.path.exists(src):
+                    shutil.move(src, dst_files[key])
 
         sys.stderr.write("name: {}\n".format(dbname))
         sys.stderr.write("local name: {}\n".format(myname))
@@ -230,6 +248,7 @@ class ProviderBase(object):
             f.write("original name: {}\n".format(dbname))
             f.write("original filename: {}\n".format(os.path.split(link)[-1]))
             f.write("url: {}\n".format(link))
+            f.write("checksum: {}\n".format(checksum))
             f.write("mask: {}\n".format(mask))
             f.write("date: {}\n".format(time.strftime("%Y-%m-%d %H:%M:%S")))
             if regex:
@@ -258,6 +277,27 @@ class ProviderBase(object):
         """
         raise NotImplementedError()
 
+    def _process_stages(self, name, mask="soft"):
+        """
+        Return the provider specific processing stages of a genome.
+
+        Each stage is a function that takes an iterator of FASTA lines (bytes)
+        and returns a new iterator of lines.
+
+        Parameters
+        ----------
+        name : str
+            Genome name
+
+        mask: str , optional
+            Masking, soft, hard or none (all other strings)
+
+        Returns
+        -------
+        list of stages
+        """
+        return []
+
 
 register_provider = ProviderBase.register_provider
 
@@ -273,19 +313,29 @@ class EnsemblProvider(ProviderBase):
     """
 
     rest_url = "http://rest.ensembl.org/"
+    checksum_file = "CHECKSUMS"
+    checksum_algorithm = "sum"
 
     def __init__(self):
         self.genomes = None
         self.version = None
 
-    @cached(method=True)
     def request_json(self, ext):
         """Make a REST request and return as json."""
         if self.rest_url.endswith("/") and ext.startswith("/"):
             ext = ext[1:]
 
-        r = requests.get(
-            self.rest_url + ext, headers={"Content-Type": "application/json"}
+        return self._request_json(self._url(self.rest_url + ext))
+
+    @cached(method=True)
+    def _request_json(self, url):
+        if not url.startswith("http"):
+            return json.loads(read_url(url).decode())
+
+        r = get_session().get(
+            url,
+            headers={"Content-Type": "application/json"},
+            timeout=request_timeout(),
         )
 
         if not r.ok:
@@ -401,9 +451,8 @@ class EnsemblProvider(ProviderBase):
         """Retrieve current version from Ensembl FTP.
         """
         print("README", ftp_site)
-        with urlopen(ftp_site + "/current_README") as response:
-            p = re.compile(r"Ensembl (Genomes|Release) (\d+)")
-            m = p.search(response.read().decode())
+        p = re.compile(r"Ensembl (Genomes|Release) (\d+)")
+        m = p.search(read_url(self._url(ftp_site + "/current_README")).decode())
         if m:
             version = m.group(2)
             sys.stderr.write("Using version {}\n".format(version))
@@ -469,15 +518,9 @@ class EnsemblProvider(ProviderBase):
             return asm_url
 
         # first try the (much smaller) primary assembly, otherwise use the toplevel assembly
-        try:
-            if kwargs.get("toplevel", False):
-                raise URLError("skipping primary assembly check")
-            asm_url = get_url("primary_assembly")
-            with urlopen(asm_url):
-                None
-
-        except URLError:
-            asm_url = get_url()
+        asm_url = self._url(get_url("primary_assembly"))
+        if kwargs.get("toplevel", False) or not url_exists(asm_url):
+            asm_url = self._url(get_url())
 
         return self.safe(genome_info["assembly_name"]), asm_url
 
@@ -533,6 +576,7 @@ class EnsemblProvider(ProviderBase):
             safe_name,
             version,
         )
+        ftp_link = self._url(ftp_link)
 
         out_dir = os.path.join(genome_dir, localname)
         if not os.path.exists(out_dir):
@@ -543,10 +587,9 @@ class EnsemblProvider(ProviderBase):
             try:
                 # actual download
                 sys.stderr.write("Using {}\n".format(ftp_link))
-                with urlopen(ftp_link) as response:
-                    gtf_file = os.path.join(tmpdir, localname + ".annotation.gtf.gz")
-                    with open(gtf_file, "wb") as f:
-                        f.write(response.read())
+                gtf_file = os.path.join(tmpdir, localname + ".annotation.gtf.gz")
+                checksum = self._checksum(ftp_link)
+                download_file(ftp_link, gtf_file, checksum=checksum)
 
                 bed_file = gtf_file.replace("gtf.gz", "bed")
                 cmd = (
@@ -564,6 +607,7 @@ class EnsemblProvider(ProviderBase):
                 readme = os.path.join(out_dir, "README.txt")
                 with open(readme, "a") as f:
                     f.write("annotation url: {}\n".format(ftp_link))
+                    f.write("annotation checksum: {}\n".format(checksum))
 
             except Exception:
                 sys.stderr.write("\nCould not download {}\n".format(ftp_link))
@@ -585,6 +629,7 @@ class UcscProvider(ProviderBase):
     alt_ucsc_url = base_url + "/{0}/bigZips/{0}.fa.gz"
     alt_ucsc_url_masked = base_url + "/{0}/bigZips/{0}.fa.masked.gz"
     das_url = "http://genome.ucsc.edu/cgi-bin/das/dsn"
+    checksum_file = "md5sum.txt"
 
     def __init__(self):
         self.genomes = []
@@ -597,14 +642,13 @@ class UcscProvider(ProviderBase):
         -------
         genomes : list
         """
-        self.genomes = self._get_genomes()
+        self.genomes = self._get_genomes(self._url(self.das_url))
 
         return self.genomes
 
     @cached(method=True)
-    def _get_genomes(self):
-        with urlopen(self.das_url) as response:
-            d = xmltodict.parse(response.read())
+    def _get_genomes(self, das_url):
+        d = xmltodict.parse(read_url(das_url))
         genomes = []
         for genome in d["DASDSN"]["DSN"]:
             genomes.append([genome["SOURCE"]["@id"], genome["DESCRIPTION"]])
@@ -655,17 +699,15 @@ class UcscProvider(ProviderBase):
             urls = [self.ucsc_url_masked, self.alt_ucsc_url_masked]
 
         for genome_url in urls:
-            remote = genome_url.format(name)
-            ret = requests.head(remote)
-
-            if ret.status_code == 200:
+            remote = self._url(genome_url.format(name))
+            if url_exists(remote):
                 return name, remote
 
         raise exceptions.GenomeDownloadError(
             "Could not download genome {} from UCSC".format(name)
         )
 
-    def _post_process_download(self, name, localname, out_dir, mask="soft"):
+    def _process_stages(self, name, mask="soft"):
         """
         Unmask a softmasked genome if required
 
@@ -674,33 +716,13 @@ class UcscProvider(ProviderBase):
         name : str
             UCSC genome name
 
-        out_dir : str
-            Output directory
+        mask: str , optional
+            Masking, soft, hard or none (all other strings)
         """
         if mask not in ["hard", "soft"]:
-            localname = get_localname(name, localname)
-
-            # Check of the original genome fasta exists
-            fa = os.path.join(out_dir, "{}.fa".format(localname))
-            if not os.path.exists(fa):
-                raise Exception("Genome fasta file not found, {}".format(fa))
-
             sys.stderr.write("UCSC genomes are softmasked by default. Unmasking...\n")
-
-            # Use a tmp file and replace the names
-            new_fa = os.path.join(
-                out_dir, localname, ".process.{}.fa".format(localname)
-            )
-            with open(fa) as old:
-                with open(new_fa, "w") as new:
-                    for line in old:
-                        if not line.startswith(">"):
-                            new.write(line.upper())
-                        else:
-                            new.write(line)
-
-            # Rename tmp file to real genome file
-            shutil.move(new_fa, fa)
+            return [partial(mask_sequences, mask=mask)]
+        return []
 
     def download_annotation(self, name, genome_dir, localname=None, **kwargs):
         """
@@ -723,20 +745,18 @@ class UcscProvider(ProviderBase):
         ANNOS = ["knownGene.txt.gz", "ensGene.txt.gz", "refGene.txt.gz"]
         pred = "genePredToBed"
 
-        tmp = NamedTemporaryFile(delete=False, suffix=".gz")
-
         anno = []
         p = re.compile(r"\w+.Gene.txt.gz")
-        with urlopen(UCSC_GENE_URL.format(name)) as f:
-            for line in f.readlines():
-                m = p.search(line.decode())
-                if m:
-                    anno.append(m.group(0))
+        listing = read_url(self._url(UCSC_GENE_URL.format(name)))
+        for line in listing.splitlines():
+            m = p.search(line.decode())
+            if m:
+                anno.append(m.group(0))
 
         url = ""
         for a in ANNOS:
             if a in anno:
-                url = UCSC_GENE_URL.format(name) + a
+                url = self._url(UCSC_GENE_URL.format(name) + a)
                 break
 
         out_dir = os.path.join(genome_dir, localname)
@@ -749,9 +769,11 @@ class UcscProvider(ProviderBase):
                 if url == "":
                     raise Exception
                 sys.stderr.write("Using {}\n".format(url))
-                urlretrieve(url, tmp.name)
+                txt_file = os.path.join(tmpdir, os.path.basename(url))
+                checksum = self._checksum(url)
+                download_file(url, txt_file, checksum=checksum)
 
-                with gzip.open(tmp.name) as f:
+                with gzip.open(txt_file) as f:
                     cols = f.readline().decode(errors="ignore").split("\t")
 
                 start_col = 1
@@ -765,7 +787,7 @@ class UcscProvider(ProviderBase):
                 bed_file = os.path.join(tmpdir, localname + ".annotation.bed")
                 cmd = "zcat {} | cut -f{}-{} | {} /dev/stdin {} && gzip -f {}"
                 sp.call(
-                    cmd.format(tmp.name, start_col, end_col, pred, bed_file, bed_file),
+                    cmd.format(txt_file, start_col, end_col, pred, bed_file, bed_file),
                     shell=True,
                 )
 
@@ -787,6 +809,7 @@ class UcscProvider(ProviderBase):
                 readme = os.path.join(genome_dir, localname, "README.txt")
                 with open(readme, "a") as f:
                     f.write("annotation url: {}\n".format(url))
+                    f.write("annotation checksum: {}\n".format(checksum))
 
             except Exception:
                 sys.stderr.write("No annotation found!")
@@ -802,13 +825,17 @@ class NCBIProvider(ProviderBase):
     """
 
     assembly_url = "https://ftp.ncbi.nlm.nih.gov/genomes/ASSEMBLY_REPORTS/"
+    checksum_file = "md5checksums.txt"
 
     def __init__(self):
         self.genomes = None
 
-    @cached(method=True)
     def _get_genomes(self):
         """Parse genomes from assembly summary txt files."""
+        return self._parse_summaries(self._url(self.assembly_url))
+
+    @cached(method=True)
+    def _parse_summaries(self, assembly_url):
         genomes = []
 
         names = [
@@ -823,8 +850,9 @@ class NCBIProvider(ProviderBase):
         seen = {}
         for fname in names:
             urlcleanup()
-            with urlopen(os.path.join(self.assembly_url, fname)) as response:
-                lines = response.read().decode("utf-8").splitlines()
+            lines = (
+                read_url(os.path.join(assembly_url, fname)).decode("utf-8").splitlines()
+            )
             header = lines[1].strip("# ").split("\t")
             for line in lines[2:]:
                 vals = line.strip("# ").split("\t")
@@ -916,20 +944,20 @@ class NCBIProvider(ProviderBase):
                 url = genome["ftp_path"]
                 url = url.replace("ftp://", "https://")
                 url += "/" + url.split("/")[-1] + "_genomic.fna.gz"
-                return name, url
+                return name, self._url(url)
         raise exceptions.GenomeDownloadError("Could not download genome from NCBI")
 
-    def _post_process_download(self, name, localname, out_dir, mask="soft"):
+    def _process_stages(self, name, mask="soft"):
         """
-        Replace accessions with sequence names in fasta file.
+        Replace accessions with sequence names and change the masking.
 
         Parameters
         ----------
         name : str
             NCBI genome name
 
-        out_dir : str
-            Output directory
+        mask: str , optional
+            Masking, soft, hard or none (all other strings)
         """
         # Get the FTP url for this specific genome and download
         # the assembly report
@@ -943,42 +971,19 @@ class NCBIProvider(ProviderBase):
         # Create mapping of accessions to names
         tr = {}
         urlcleanup()
-        with urlopen(url) as response:
-            for line in response.read().decode("utf-8").splitlines():
-                if line.startswith("#"):
-                    continue
-                vals = line.strip().split("\t")
-                tr[vals[6]] = vals[0]
+        for line in read_url(self._url(url)).decode("utf-8").splitlines():
+            if line.startswith("#"):
+                continue
+            vals = line.strip().split("\t")
+            tr[vals[6]] = vals[0]
 
-        localname = get_localname(name, localname)
-        # Check of the original genome fasta exists
-        fa = os.path.join(out_dir, "{}.fa".format(localname))
-        if not os.path.exists(fa):
-            raise Exception("Genome fasta file not found, {}".format(fa))
-
-        # Use a tmp file and replace the names
-        new_fa = os.path.join(out_dir, ".process.{}.fa".format(localname))
+        stages = [partial(rename_headers, mapping=tr)]
         if mask != "soft":
             sys.stderr.write(
                 "NCBI genomes are softmasked by default. Changing mask...\n"
             )
-
-        with open(fa) as old:
-            with open(new_fa, "w") as new:
-                for line in old:
-                    if line.startswith(">"):
-                        desc = line.strip()[1:]
-                        name = desc.split(" ")[0]
-                        new.write(">{} {}\n".format(tr.get(name, name), desc))
-                    elif mask == "hard":
-                        new.write(re.sub("[actg]", "N", line))
-                    elif mask not in ["hard", "soft"]:
-                        new.write(line.upper())
-                    else:
-                        new.write(line)
-
-        # Rename tmp file to real genome file
-        shutil.move(new_fa, fa)
+            stages.append(partial(mask_sequences, mask=mask))
+        return stages
 
     def download_annotation(self, name, genome_dir, localname=None, **kwargs):
         """
@@ -1003,6 +1008,7 @@ class NCBIProvider(ProviderBase):
                 url = genome["ftp_path"]
                 url = url.replace("ftp://", "https://")
                 url += "/" + url.split("/")[-1] + "_genomic.gff.gz"
+                url = self._url(url)
 
         out_dir = os.path.join(genome_dir, localname)
         if not os.path.exists(out_dir):
@@ -1014,9 +1020,8 @@ class NCBIProvider(ProviderBase):
                 # actual download
                 sys.stderr.write("Using {}\n".format(url))
                 gff_file = os.path.join(tmpdir, localname + ".annotation.gff.gz")
-                with urlopen(url) as response:
-                    with open(gff_file, "wb") as f:
-                        f.write(response.read())
+                checksum = self._checksum(url)
+                download_file(url, gff_file, checksum=checksum)
 
                 # check gff for genes
                 cmd = "gff3ToGenePred {0} /dev/stdout | wc -l"
@@ -1053,6 +1058,7 @@ class NCBIProvider(ProviderBase):
                 readme = os.path.join(genome_dir, localname, "README.txt")
                 with open(readme, "a") as f:
                     f.write("annotation url: {}\n".format(url))
+                    f.write("annotation checksum: {}\n".format(checksum))
 
             except Exception:
                 sys.stderr.write(
@@ -1085,3 +1091,117 @@ class UrlProvider(ProviderBase):
         tuple (url, url)
         """
         return url, url
+
+
+@register_provider("Local")
+class LocalProvider(ProviderBase):
+    """
+    Local mirror provider.
+
+    Install genomes from a local mirror of UCSC, Ensembl and NCBI, such as
+    a shared mirror on an HPC file system. The mirror has the same layout
+    as the upstream servers (one directory per host) and is configured with
+    `mirror` in the config file. Genomes are processed exactly like genomes
+    that are downloaded from the upstream provider.
+    """
+
+    upstream = ["UCSC", "Ensembl", "NCBI"]
+
+    def __init__(self):
+        self.providers = {}
+        mirror = config.get("mirror", None)
+        if mirror:
+            for name in self.upstream:
+                p = ProviderBase.create(name)
+                p.mirror = mirror
+                self.providers[p.name] = p
+
+    def list_install_options(self):
+        """List provider specific install options"""
+
+        provider_specific_options = {
+            "local_provider": {
+                "long": "provider",
+                "help": "provider of the mirrored genome (UCSC, Ensembl or NCBI)",
+                "default": None,
+            }
+        }
+
+        return provider_specific_options
+
+    def _mirrored(self, method, *args):
+        """Yield results of all providers that are present in the mirror."""
+        for p in self.providers.values():
+            try:
+                for row in getattr(p, method)(*args):
+                    yield row
+            except OSError:
+                # provider is not mirrored
+                continue
+
+    def list_available_genomes(self):
+        """
+        List all genomes in the local mirror.
+
+        Yields
+        ------
+        genomes : list of tuples
+        """
+        return self._mirrored("list_available_genomes")
+
+    def search(self, term):
+        """
+        Search for a genome in the local mirror.
+
+        Parameters
+        ----------
+        term : str
+            Search term, case-insensitive.
+
+        Yields
+        ------
+        tuple
+            genome information (name/identfier and description)
+        """
+        return self._mirrored("search", term)
+
+    def _provider(self, name, local_provider=None, **kwargs):
+        """Return the (mirrored) provider of a genome."""
+        if not self.providers:
+            raise norns.exceptions.ConfigError("Please configure a mirror")
+
+        if local_provider:
+            try:
+                return self.providers[local_provider.lower()]
+            except KeyError:
+                raise Exception("Unknown provider")
+
+        for p in self.providers.values():
+            try:
+                for row in p.list_available_genomes():
+                    if name in [row[0], self.safe(row[0])]:
+                        return p
+            except OSError:
+                continue
+
+        raise exceptions.GenomeDownloadError(
+            "Could not find {} in the local mirror {}".format(
+                name, config.get("mirror")
+            )
+        )
+
+    def safe(self, name):
+        """Replace spaces with undescores."""
+        return name.replace(" ", "_")
+
+    def get_genome_download_link(self, name, mask="soft", **kwargs):
+        p = self._provider(name, **kwargs)
+        return p.get_genome_download_link(name, mask=mask, **kwargs)
+
+    def download_genome(self, name, genome_dir, **kwargs):
+        p = self._provider(name, **kwargs)
+        p.download_genome(name, genome_dir, **kwargs)
+
+    def download_annotation(self, name, genome_dir, **kwargs):
+        p = self._provider(name, **kwargs)
+        p.download_annotation(name, genome_dir, **kwargs)
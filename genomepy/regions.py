@@ -0,0 +1,320 @@
+"""Batch extraction of genomic regions and transcripts.
+
+The lines of a track (a BED file or chrom:start-end regions) are divided
+into batches, which are parsed and extracted by worker processes. The
+regions of a batch are read from the FASTA file in file order (see
+FastaReader.fetch_many). The sequences are returned in the original order,
+while only a limited number of batches is kept in memory.
+
+Transcript sequences are extracted from a BED12 annotation per chromosome,
+with the exons of a chromosome in arrays.
+"""
+import gzip
+import os
+import sys
+
+import numpy as np
+
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from itertools import chain, islice
+from pyfaidx import complement
+
+from genomepy.fasta import FastaReader, write_fasta
+
+# number of regions per batch
+BATCH_SIZE = 100000
+
+_COMPLEMENT = str.maketrans(
+    "ACTGNactgnYRWSKMDVHBXyrwskmdvhbx", "TGACNtgacnRYWSMKHBDVXrywsmkhbdvx"
+)
+
+
+def _lines(track):
+    """Yield the lines of a file, or the items of a list."""
+    if isinstance(track, (list, tuple)):
+        yield from track
+    else:
+        with open(track) as fin:
+            yield from fin
+
+
+def read_bed(track, stranded=False, extend_up=0, extend_down=0):
+    """
+    Yield the regions of a BED file.
+
+    Parameters
+    ----------
+    track : str or list
+        BED filename or list of lines. For BED12 files the sequence of the
+        blocks (exons) is used.
+
+    stranded : bool , optional
+        Use the strand (column 6), regions on the - strand are reverse
+        complemented.
+
+    extend_up, extend_down : int , optional
+        Extend the regions upstream and downstream.
+
+    Yields
+    ------
+    tuple
+        Name, chromosome, list of 0-based starts, list of ends and True if
+        the region is reverse complemented.
+    """
+    for line in _lines(track):
+        if line.startswith("#") or line.startswith("track"):
+            continue
+
+        vals = line.strip().split("\t")
+        start, end = int(vals[1]), int(vals[2])
+
+        rc = False
+        if stranded and len(vals) > 5:
+            rc = vals[5] == "-"
+
+        chrom = vals[0]
+        starts = [start]
+        ends = [end]
+
+        # BED12
+        if len(vals) == 12:
+            starts = [start + int(x) for x in vals[11].split(",")[:-1]]
+            sizes = [int(x) for x in vals[10].split(",")[:-1]]
+            ends = [start + size for start, size in zip(starts, sizes)]
+        name = "{}:{}-{}".format(chrom, start, end)
+        if len(vals) > 3:
+            name = " ".join((name, vals[3]))
+
+        # extend
+        if extend_up:
+            if rc:
+                ends[-1] += extend_up
+            else:
+                starts[0] -= extend_up
+        if extend_down:
+            if rc:
+                starts[0] -= extend_down
+            else:
+                ends[-1] += extend_down
+
+        yield name, chrom, starts, ends, rc
+
+
+def read_regions(track, extend_up=0, extend_down=0):
+    """
+    Yield regions in chrom:start-end format.
+
+    Parameters
+    ----------
+    track : str or list
+        Filename with one region per line, or a list of regions (lines).
+
+    extend_up, extend_down : int , optional
+        Extend the regions upstream and downstream.
+
+    Yields
+    ------
+    tuple
+        Name, chromosome, list of 0-based starts, list of ends and False
+        (as in read_bed).
+    """
+    for line in _lines(track):
+        name = line.strip()
+        chrom, coords = name.split(":")
+        start, end = [int(c) for c in coords.split("-")]
+        yield name, chrom, [start - extend_up], [end + extend_down], False
+
+
+def _extract(fname, lines, parse):
+    """Return the names and sequences of a batch of lines."""
+    batch = list(parse(lines))
+    names, starts, ends = [], [], []
+    for _, chrom, region_starts, region_ends, _ in batch:
+        names.extend([chrom] * len(region_starts))
+        starts.extend(region_starts)
+        ends.extend(region_ends)
+    with FastaReader(fname) as fa:
+        parts = iter(fa.fetch_many(names, starts, ends))
+
+    seqs = []
+    for name, _, region_starts, _, rc in batch:
+        seq = "".join(islice(parts, len(region_starts)))
+        if rc:
+            seq = complement(seq)[::-1]
+        seqs.append((name, seq))
+    return seqs
+
+
+def extract_sequences(fname, track, parse=read_bed, processes=None, batch_size=None):
+    """
+    Extract the sequences of the regions in a track.
+
+    Parameters
+    ----------
+    fname : str
+        Filename of the (bgzipped) FASTA file, with a .fai index.
+
+    track : str or list
+        Filename or list of lines.
+
+    parse : function , optional
+        Function that yields the regions of a list of lines, such as
+        read_bed (default) or read_regions. Use functools.partial to pass
+        options. It is run by the worker processes, so it should be
+        a module-level function.
+
+    processes : int , optional
+        Number of processes, by default the number of cores.
+
+    batch_size : int , optional
+        Number of regions per batch, by default BATCH_SIZE.
+
+    Yields
+    ------
+    tuple
+        Name and sequence, in the order of the track.
+    """
+    lines = _lines(track)
+    size = batch_size or BATCH_SIZE
+    batches = iter(lambda: list(islice(lines, size)), [])
+    for seqs in _imap(partial(_extract, fname, parse=parse), batches, processes):
+        yield from seqs
+
+
+def _imap(func, tasks, processes=None):
+    """
+    Yield func(task) for all tasks, in order, using multiple processes.
+
+    Only 2 tasks per process are submitted ahead, so memory use is bounded
+    for long iterators of tasks.
+    """
+    if processes is None:
+        processes = os.cpu_count() or 1
+    tasks = iter(tasks)
+    first = list(islice(tasks, 2))
+    if processes == 1 or len(first) < 2:
+        # a single task is not worth starting processes
+        for task in chain(first, tasks):
+            yield func(task)
+        return
+
+    with ProcessPoolExecutor(processes) as pool:
+        pending = deque()
+        for task in chain(first, tasks):
+            if len(pending) >= 2 * processes:
+                yield pending.popleft().result()
+            pending.append(pool.submit(func, task))
+        while pending:
+            yield pending.popleft().result()
+
+
+def read_bed12(fname):
+    """
+    Read the transcripts of a (gzipped) BED12 file, grouped by chromosome.
+
+    Parameters
+    ----------
+    fname : str
+        BED12 filename.
+
+    Returns
+    -------
+    dict
+        Chromosome names as keys (in the order of the file). Values are
+        tuples of the transcript names, an array with True for transcripts
+        on the - strand, an array with the number of exons per transcript
+        and arrays with the 0-based exon starts and ends.
+    """
+    chroms = {}
+    with _open(fname) as f:
+        for line in f:
+            if line.startswith(("#", "track", "browser")):
+                continue
+            vals = line.rstrip("\n").split("\t")
+            if len(vals) < 12:
+                raise ValueError("{} is not a BED12 file".format(fname))
+            chrom = chroms.setdefault(vals[0], ([], [], [], [], [], []))
+            chrom[0].append(vals[3])
+            chrom[1].append(vals[5] == "-")
+            chrom[2].append(int(vals[1]))
+            chrom[3].append(int(vals[9]))
+            chrom[4].append(vals[10].rstrip(","))
+            chrom[5].append(vals[11].rstrip(","))
+
+    transcripts = {}
+    for chrom, (names, rc, starts, counts, sizes, offsets) in chroms.items():
+        counts = np.array(counts, np.int64)
+        # all exons of a chromosome are parsed at once
+        sizes = np.array(",".join(sizes).split(","), np.int64)
+        offsets = np.array(",".join(offsets).split(","), np.int64)
+        exon_starts = np.repeat(np.array(starts, np.int64), counts) + offsets
+        transcripts[chrom] = (
+            names,
+            np.array(rc, bool),
+            counts,
+            exon_starts,
+            exon_starts + sizes,
+        )
+    return transcripts
+
+
+def _open(fname):
+    if fname.endswith(".gz"):
+        return gzip.open(fname, "rt")
+    return open(fname)
+
+
+def _transcripts(fname, task, width=60):
+    """Return the FASTA headers and sequences of the transcripts of a chromosome."""
+    chrom, (names, rc, counts, starts, ends) = task
+    with FastaReader(fname) as fa:
+        exons = fa.fetch_many([chrom] * len(starts), starts, ends)
+
+    lines = []
+    bounds = np.concatenate([[0], np.cumsum(counts)]).tolist()
+    for i, name in enumerate(names):
+        seq = "".join(exons[bounds[i] : bounds[i + 1]])
+        if rc[i]:
+            seq = seq.translate(_COMPLEMENT)[::-1]
+        lines.append(">{}\n".format(name).encode())
+        lines.append(
+            "".join(
+                seq[j : j + width] + "\n" for j in range(0, len(seq), width)
+            ).encode()
+        )
+    return lines
+
+
+def write_transcriptome(fname, annotation, outfile, processes=None):
+    """
+    Write the sequences of all transcripts in a BED12 file.
+
+    The exons are extracted per chromosome, with a process per chromosome.
+    The transcripts are written in the order of the chromosomes in the
+    annotation, and a .fai index is created.
+
+    Parameters
+    ----------
+    fname : str
+        Filename of the (bgzipped) FASTA file, with a .fai index.
+
+    annotation : str
+        Filename of the (gzipped) BED12 file.
+
+    outfile : str
+        Output FASTA filename.
+
+    processes : int , optional
+        Number of processes, by default the number of cores.
+    """
+    transcripts = read_bed12(annotation)
+    with FastaReader(fname) as fa:
+        missing = [chrom for chrom in transcripts if chrom not in fa.records]
+    for chrom in missing:
+        sys.stderr.write("Skipping transcripts on {}, not in genome\n".format(chrom))
+        del transcripts[chrom]
+
+    results = _imap(partial(_transcripts, fname), transcripts.items(), processes)
+    write_fasta(chain.from_iterable(results), outfile)
@@ -0,0 +1,109 @@
+"""Sequences as numpy arrays.
+
+The sequences of a genome are stored without headers and newlines in a
+single file (<name>.seq), with a table of the sequence names, offsets and
+lengths (<name>.seq.npy). The file is memory-mapped, so a region of a
+chromosome is a read-only numpy array (uint8) that refers to the page
+cache, without decoding or copying the sequence.
+"""
+import os
+
+import numpy as np
+
+from pyfaidx import Fasta, FetchError
+
+from genomepy.fasta import read_fai
+from genomepy.gaps import byte_reader, sequence_chunks
+
+
+def _index_file(fname):
+    return fname + ".npy"
+
+
+def write_seqarray(fname, outfile):
+    """
+    Write the sequences of a (bgzipped) FASTA file without newlines.
+
+    Parameters
+    ----------
+    fname : str
+        Filename of the (bgzipped) FASTA file.
+
+    outfile : str
+        Output filename, the index is written to outfile + ".npy".
+    """
+    # creates the .fai index, if needed
+    Fasta(fname).close()
+    records = read_fai(fname + ".fai")
+    index = np.zeros(
+        len(records),
+        [
+            ("name", "U{}".format(max([len(rec[0]) for rec in records] + [1]))),
+            ("offset", "i8"),
+            ("length", "i8"),
+        ],
+    )
+
+    # the files are replaced at once, as they may be memory-mapped
+    tmp = outfile + ".tmp"
+    with byte_reader(fname) as read, open(tmp, "wb") as out:
+        for i, (name, length, offset, linebases, linewidth) in enumerate(records):
+            index[i] = (name, out.tell(), length)
+            for seq in sequence_chunks(read, length, offset, linebases, linewidth):
+                out.write(seq.tobytes())
+    with open(_index_file(tmp), "wb") as f:
+        np.save(f, index)
+    os.replace(_index_file(tmp), _index_file(outfile))
+    os.replace(tmp, outfile)
+
+
+class SeqArray(object):
+    """
+    Memory-mapped sequences, see write_seqarray.
+
+    Parameters
+    ----------
+    fname : str
+        Filename of the sequence file.
+    """
+
+    def __init__(self, fname):
+        self.fname = fname
+        index = np.load(_index_file(fname))
+        self.records = {
+            name: (offset, length)
+            for name, offset, length in zip(
+                index["name"].tolist(),
+                index["offset"].tolist(),
+                index["length"].tolist(),
+            )
+        }
+        self._data = np.empty(0, np.uint8)
+        if os.path.getsize(fname) > 0:
+            self._data = np.memmap(fname, np.uint8, "r")
+
+    def array(self, name, start=None, end=None):
+        """
+        Return the sequence of a region as a read-only array.
+
+        Parameters
+        ----------
+        name : str
+            Sequence name.
+
+        start, end : int , optional
+            0-based start and (exclusive) end position, as in a slice.
+
+        Returns
+        -------
+        numpy.ndarray
+            Sequence (uint8, ASCII), a view of the memory-mapped file.
+        """
+        try:
+            offset, length = self.records[name]
+        except KeyError:
+            raise FetchError(
+                "Requested rname {0} does not exist! "
+                "Please check your FASTA file.".format(name)
+            )
+        return self._data[offset : offset + length][start:end]
@@ -0,0 +1,284 @@
+"""Genome sequences in shared memory.
+
+A genome is published once, in a single shared memory segment with the
+sequences without newlines. Worker processes attach to the segment by name
+and read the sequences as numpy arrays that refer to the shared memory, so
+the sequences are not decoded or stored again per process.
+
+The segment starts with the length of a JSON header (8 bytes) and the
+header, with the sequence names, offsets and lengths. Within a process,
+attachments are shared and reference counted: the segment is unmapped
+when the last user closes it. The segment is removed when the publishing
+SharedGenome is closed (or garbage collected), workers that are attached
+at that time can still read it. Requires Python 3.8 or later.
+"""
+import json
+import struct
+import sys
+import threading
+import weakref
+
+import numpy as np
+
+from pyfaidx import Fasta, FetchError
+
+from genomepy.fasta import read_fai
+from genomepy.gaps import byte_reader, sequence_chunks
+
+from multiprocessing import resource_tracker
+
+try:
+    from multiprocessing import shared_memory
+except ImportError:
+    # Python < 3.8
+    shared_memory = None
+
+# alignment of the sequences in the segment
+_ALIGN = 64
+
+# attached segments of this process, name: [SharedGenome, users]
+_attached = {}
+_lock = threading.Lock()
+# segments are attached without the resource tracker
+_tracker_lock = threading.Lock()
+
+
+def _check():
+    if shared_memory is None:
+        raise RuntimeError("shared memory genomes require Python 3.8 or later")
+
+
+if shared_memory is not None:
+
+    class _SharedMemory(shared_memory.SharedMemory):
+        def __init__(self, name=None, create=False, size=0):
+            if create:
+                super().__init__(name, create=True, size=size)
+            elif sys.version_info >= (3, 13):
+                super().__init__(name, track=False)
+            else:
+                # the resource tracker of a process removes the segments that
+                # it tracks when the process exits, so only the publisher may
+                # register the segment
+                with _tracker_lock:
+                    register = resource_tracker.register
+                    resource_tracker.register = _no_register
+                    try:
+                        super().__init__(name)
+                    finally:
+                        resource_tracker.register = register
+
+        def __del__(self):
+            _close(self)
+
+
+class SharedGenome(object):
+    """
+    Genome sequences in shared memory.
+
+    Use SharedGenome.publish() (or Genome.share()) to create a segment, and
+    attach() to use it in other processes. A SharedGenome can be sent to
+    worker processes (it is pickled as the name of the segment, and attached
+    in the worker).
+
+    Attributes
+    ----------
+    name : str
+        Name of the shared memory segment.
+
+    records : dict
+        Sequence names as keys, (offset, length) as values.
+    """
+
+    def __init__(self, shm, owner=False):
+        self._shm = shm
+        self.name = shm.name
+        self.owner = owner
+
+        (size,) = struct.unpack_from("<Q", shm.buf)
+        header = json.loads(bytes(shm.buf[8 : 8 + size]).decode())
+        self.fasta = header["fasta"]
+        self.records = {
+            name: (offset, length) for name, offset, length in header["records"]
+        }
+        self._data = np.frombuffer(shm.buf, np.uint8, offset=header["start"])
+        self._data.flags.writeable = False
+        self._finalizer = None
+        if owner:
+            # the segment is removed when the publisher is no longer used
+            self._finalizer = weakref.finalize(self, _unlink, shm)
+
+    @classmethod
+    def publish(cls, fname, chroms=None):
+        """
+        Publish the sequences of a (bgzipped) FASTA file in shared memory.
+
+        Parameters
+        ----------
+        fname : str
+            Filename of the (bgzipped) FASTA file.
+
+        chroms : list , optional
+            Names of the sequences, by default all sequences.
+
+        Returns
+        -------
+        SharedGenome
+        """
+        _check()
+        # creates the .fai index, if needed
+        Fasta(fname).close()
+        records = read_fai(fname + ".fai")
+        if chroms is not None:
+            records = {rec[0]: rec for rec in records}
+            missing = [name for name in chroms if name not in records]
+            if missing:
+                raise FetchError(
+                    "Requested rname {0} does not exist! "
+                    "Please check your FASTA file.".format(missing[0])
+                )
+            records = [records[name] for name in chroms]
+
+        offsets = np.cumsum([0] + [rec[1] for rec in records]).tolist()
+        index = [[rec[0], offsets[i], rec[1]] for i, rec in enumerate(records)]
+        header = {"fasta": fname, "records": index, "start": 0}
+        # the sequences start after the header (with room for the start value)
+        start = 8 + len(json.dumps(header)) + 32
+        start += -start % _ALIGN
+        header["start"] = start
+        header = json.dumps(header).encode()
+
+        shm = _SharedMemory(create=True, size=max(1, start + offsets[-1]))
+        try:
+            _write(shm, header, start, fname, records, offsets)
+        except BaseException:
+            _unlink(shm)
+            raise
+        return cls(shm, owner=True)
+
+    def keys(self):
+        return self.records.keys()
+
+    def array(self, name, start=None, end=None):
+        """
+        Return the sequence of a region as a read-only array.
+
+        Parameters
+        ----------
+        name : str
+            Sequence name.
+
+        start, end : int , optional
+            0-based start and (exclusive) end position, as in a slice.
+
+        Returns
+        -------
+        numpy.ndarray
+            Sequence (uint8, ASCII), a view of the shared memory.
+        """
+        try:
+            offset, length = self.records[name]
+        except KeyError:
+            raise FetchError(
+                "Requested rname {0} does not exist! "
+                "Please check your FASTA file.".format(name)
+            )
+        return self._data[offset : offset + length][start:end]
+
+    def fetch(self, name, start, end):
+        """Return the sequence of a region (0-based, end exclusive) as a str."""
+        return self.array(name, start, end).tobytes().decode()
+
+    def close(self):
+        """
+        Stop using the segment.
+
+        The publisher removes the segment. In other processes the segment is
+        unmapped when all users of the process have closed it.
+        """
+        if self.owner:
+            self._release()
+            self._finalizer()
+            return
+        with _lock:
+            attached = _attached.get(self.name)
+            if attached is None or attached[0] is not self:
+                return
+            attached[1] -= 1
+            if attached[1] > 0:
+                return
+            del _attached[self.name]
+        self._release()
+        _close(self._shm)
+
+    def _release(self):
+        # the memory can only be unmapped without references to it
+        self._data = None
+
+    def __reduce__(self):
+        return attach, (self.name,)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def _write(shm, header, start, fname, records, offsets):
+    """Write the header and the sequences of the .fai records to a segment."""
+    shm.buf[:8] = struct.pack("<Q", len(header))
+    shm.buf[8 : 8 + len(header)] = header
+    data = np.frombuffer(shm.buf, np.uint8, offset=start)
+    with byte_reader(fname) as read:
+        for rec, pos in zip(records, offsets):
+            for seq in sequence_chunks(read, *rec[1:]):
+                data[pos : pos + len(seq)] = seq
+                pos += len(seq)
+
+
+def attach(name):
+    """
+    Attach to a shared genome.
+
+    All users in a process share the same attachment; close() each
+    SharedGenome that is returned when it is no longer used.
+
+    Parameters
+    ----------
+    name : str
+        Name of the shared memory segment, see SharedGenome.name.
+
+    Returns
+    -------
+    SharedGenome
+    """
+    _check()
+    with _lock:
+        attached = _attached.get(name)
+        if attached is None:
+            attached = [SharedGenome(_SharedMemory(name)), 0]
+            _attached[name] = attached
+        attached[1] += 1
+        return attached[0]
+
+
+def _no_register(name, rtype):
+    pass
+
+
+def _close(shm):
+    try:
+        shm.close()
+    except BufferError:
+        # arrays of the sequences are still used, the memory is unmapped
+        # when the process exits
+        pass
+
+
+def _unlink(shm):
+    _close(shm)
+    try:
+        shm.unlink()
+    except FileNotFoundError:
+        pass
@@ -0,0 +1,160 @@
+"""Genome statistics.
+
+The chromosome sizes, gap locations and sequence composition of a genome
+are collected in a single pass, as a stage of the FASTA pipeline (see
+genomepy.fasta). During installation they are computed while the genome is
+written, so the genome is not read again by the sizes plugin or the gap
+file generation.
+"""
+import os
+
+import numpy as np
+
+from genomepy.gaps import GapIndex, find_runs
+
+_GC = [ord(c) for c in "GCgc"]
+_N = [ord(c) for c in "Nn"]
+_LOWER = list(range(ord("a"), ord("z") + 1))
+_NEWLINE = [ord("\n"), ord("\r")]
+
+
+def genome_files(fname):
+    """
+    Return the filenames of the sizes, gaps and stats files of a genome.
+
+    Parameters
+    ----------
+    fname : str
+        Filename of the (bgzipped) FASTA file.
+
+    Returns
+    -------
+    dict
+        Filenames with "sizes", "gaps", "gap_index", "gap_chroms" (the
+        binary gap index, see GapIndex), "stats", "twobit" (see
+        genomepy.twobit), "seqarray" and "seqarray_index" (see
+        genomepy.seqarray) as keys.
+    """
+    base = fname[:-3] if fname.endswith(".gz") else fname
+    name = os.path.splitext(base)[0]
+    return {
+        "sizes": base + ".sizes",
+        "gaps": name + ".gaps.bed",
+        "gap_index": name + ".gaps.npy",
+        "gap_chroms": name + ".gaps.chroms.npy",
+        "stats": name + ".stats.tsv",
+        "twobit": name + ".2bit",
+        "seqarray": name + ".seq",
+        "seqarray_index": name + ".seq.npy",
+    }
+
+
+class GenomeStats(object):
+    """
+    Collect the sizes, gaps and composition of all sequences of a genome.
+
+    Feed all FASTA headers and sequences to add(), in order, or use scan()
+    as a stage. Gaps are runs of (uppercase) N, the same as generate_gap_bed.
+    """
+
+    def __init__(self):
+        # name, length, GC, N, lowercase, gap starts, gap ends
+        self.records = []
+        self._run_start = None
+
+    def add(self, data):
+        if data.startswith(b">"):
+            self._finish()
+            name = (data[1:].split() or [b""])[0].decode()
+            self.records.append([name, 0, 0, 0, 0, [], []])
+        elif self.records:
+            self._add_sequence(data)
+
+    def _add_sequence(self, data):
+        seq = np.frombuffer(data, np.uint8)
+        counts = np.bincount(seq, minlength=256)
+        length = len(seq) - int(counts[_NEWLINE].sum())
+
+        rec = self.records[-1]
+        if counts[ord("N")]:
+            seq = seq[(seq != _NEWLINE[0]) & (seq != _NEWLINE[1])]
+            starts, ends, self._run_start = find_runs(seq, rec[1], self._run_start)
+            rec[5].append(starts)
+            rec[6].append(ends)
+        elif length and self._run_start is not None:
+            # the gap ended at the end of the previous block
+            rec[5].append(np.array([self._run_start]))
+            rec[6].append(np.array([rec[1]]))
+            self._run_start = None
+        rec[1] += length
+        rec[2] += int(counts[_GC].sum())
+        rec[3] += int(counts[_N].sum())
+        rec[4] += int(counts[_LOWER].sum())
+
+    def _finish(self):
+        """Finish the current sequence."""
+        if self.records and self._run_start is not None:
+            rec = self.records[-1]
+            rec[5].append(np.array([self._run_start]))
+            rec[6].append(np.array([rec[1]]))
+        self._run_start = None
+
+    def scan(self, lines):
+        """
+        Collect the statistics of FASTA headers and sequences that pass.
+
+        Parameters
+        ----------
+        lines : iterable
+            FASTA headers and sequences (bytes), see read_fasta.
+        """
+        for line in lines:
+            self.add(line)
+            yield line
+        self._finish()
+
+    def gaps(self):
+        """Yield the name, gap starts and gap ends of all sequences."""
+        self._finish()
+        for rec in self.records:
+            starts = np.concatenate([np.empty(0, np.int64)] + rec[5])
+            ends = np.concatenate([np.empty(0, np.int64)] + rec[6])
+            yield rec[0], starts, ends
+
+    def write(self, fname):
+        """
+        Write the sizes, gaps (BED and index) and stats files.
+
+        Parameters
+        ----------
+        fname : str
+            Filename of the FASTA file, see genome_files for the output names.
+        """
+        files = genome_files(fname)
+        with open(files["sizes"], "w") as f:
+            for rec in self.records:
+                f.write("{}\t{}\n".format(rec[0], rec[1]))
+
+        gaps = list(self.gaps())
+        with open(files["gaps"], "w") as f:
+            for name, starts, ends in gaps:
+                f.write(
+                    "".join(
+                        "{}\t{}\t{}\n".format(name, start, end)
+                        for start, end in zip(starts.tolist(), ends.tolist())
+                    )
+                )
+        GapIndex.from_gaps(gaps).save(files["gaps"])
+
+        with open(files["stats"], "w") as f:
+            f.write("name\tlength\tGC\tN\tlowercase\n")
+            for name, length, gc, n, lower, _, _ in self.records:
+                f.write(
+                    "{}\t{}\t{:.4f}\t{:.4f}\t{:.4f}\n".format(
+                        name,
+                        length,
+                        gc / (length - n) if length > n else 0,
+                        n / length if length else 0,
+                        lower / length if length else 0,
+                    )
+                )
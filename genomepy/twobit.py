@@ -0,0 +1,262 @@
+"""UCSC .2bit files.
+
+A .2bit file stores the nucleotides of a genome packed in 2 bits (4 per
+byte), with tables of the N blocks and the lowercase (soft-masked) blocks
+of each sequence. The files are written from an indexed (bgzipped) FASTA
+file and are compatible with the UCSC tools (twoBitToFa).
+
+TwoBitReader reads sequences through a memory map: a region is decoded
+from a quarter of the bytes of the FASTA file, with a table lookup. Note
+that all nucleotides other than A, C, G and T (such as IUPAC codes) are
+stored as N.
+"""
+import mmap
+import os
+import shutil
+import struct
+
+import numpy as np
+
+from bisect import bisect_left, bisect_right
+from pyfaidx import Fasta
+
+from genomepy.fasta import read_fai
+from genomepy.gaps import byte_reader, find_mask_runs, sequence_chunks
+
+SIGNATURE = 0x1A412743
+
+# T, C, A, G are 0, 1, 2, 3
+_ENCODE = np.zeros(256, np.uint8)
+for _i, _c in enumerate(b"TCAG"):
+    _ENCODE[_c] = _ENCODE[_c + 32] = _i
+# the 4 nucleotides of each byte value (the first in the high bits), as a
+# single 32-bit value, so a region is decoded with one table lookup per byte
+_DECODE = (
+    np.array(
+        [[b"TCAG"[(i >> shift) & 3] for shift in (6, 4, 2, 0)] for i in range(256)],
+        np.uint8,
+    )
+    .view(np.uint32)
+    .ravel()
+)
+_ACGT = np.zeros(256, bool)
+_ACGT[list(b"ACGTacgt")] = True
+
+
+def _pack(seq):
+    """Pack a sequence (uint8, a multiple of 4 nucleotides) into 2-bit bytes."""
+    codes = _ENCODE[seq].reshape(-1, 4)
+    return (codes[:, 0] << 6) | (codes[:, 1] << 4) | (codes[:, 2] << 2) | codes[:, 3]
+
+
+def _blocks(starts, ends):
+    """Return the counts, starts and sizes of a block table."""
+    starts = np.concatenate([np.empty(0, np.int64)] + starts)
+    ends = np.concatenate([np.empty(0, np.int64)] + ends)
+    return (
+        struct.pack("<I", len(starts))
+        + starts.astype("<u4").tobytes()
+        + (ends - starts).astype("<u4").tobytes()
+    )
+
+
+def _record(read, length, offset, linebases, linewidth):
+    """Return the .2bit record (bytes) of a sequence."""
+    packed = []
+    n_blocks = ([], [])
+    mask_blocks = ([], [])
+    n_start = mask_start = None
+    rest = np.empty(0, np.uint8)
+    pos = 0
+    for seq in sequence_chunks(read, length, offset, linebases, linewidth):
+        s, e, n_start = find_mask_runs(~_ACGT[seq], pos, n_start)
+        n_blocks[0].append(s)
+        n_blocks[1].append(e)
+        s, e, mask_start = find_mask_runs(seq >= ord("a"), pos, mask_start)
+        mask_blocks[0].append(s)
+        mask_blocks[1].append(e)
+        pos += len(seq)
+
+        # pack complete bytes, keep the rest for the next chunk
+        seq = np.concatenate([rest, seq])
+        size = len(seq) - len(seq) % 4
+        packed.append(_pack(seq[:size]))
+        rest = seq[size:]
+
+    if len(rest):
+        packed.append(_pack(np.concatenate([rest, np.zeros(4 - len(rest), np.uint8)])))
+    for start, blocks in ((n_start, n_blocks), (mask_start, mask_blocks)):
+        if start is not None:
+            blocks[0].append(np.array([start]))
+            blocks[1].append(np.array([pos]))
+
+    return b"".join(
+        [
+            struct.pack("<I", pos),
+            _blocks(*n_blocks),
+            _blocks(*mask_blocks),
+            struct.pack("<I", 0),
+        ]
+        + [p.tobytes() for p in packed]
+    )
+
+
+def write_twobit(fname, outfile):
+    """
+    Write a (bgzipped) FASTA file as a .2bit file.
+
+    Sequences are processed one at a time, in chunks, so only the packed
+    sequence of the current sequence is kept in memory. The records are
+    written to a temporary file first, as the index at the start of the
+    file needs their offsets. Files larger than 4 GB are written as
+    version 1 (with 64-bit offsets).
+
+    Parameters
+    ----------
+    fname : str
+        Filename of the (bgzipped) FASTA file.
+
+    outfile : str
+        Output filename.
+    """
+    # creates the .fai index, if needed
+    Fasta(fname).close()
+    records = read_fai(fname + ".fai")
+    offsets = []
+    tmp = outfile + ".records.tmp"
+    try:
+        with byte_reader(fname) as read, open(tmp, "wb") as out:
+            for rec in records:
+                offsets.append(out.tell())
+                out.write(_record(read, *rec[1:]))
+            size = out.tell()
+
+        names = [rec[0].encode() for rec in records]
+        index_size = 16 + sum(1 + len(name) + 4 for name in names)
+        version = 0
+        if index_size + size >= 2 ** 32:
+            version = 1
+            index_size += 4 * len(names)
+
+        # the file is replaced at once, as it may be memory-mapped
+        with open(tmp, "rb") as f, open(outfile + ".tmp", "wb") as out:
+            out.write(struct.pack("<IIII", SIGNATURE, version, len(names), 0))
+            for name, offset in zip(names, offsets):
+                out.write(struct.pack("<B", len(name)) + name)
+                out.write(struct.pack("<Q" if version else "<I", index_size + offset))
+            shutil.copyfileobj(f, out, 16 * 1024 * 1024)
+        os.replace(outfile + ".tmp", outfile)
+    finally:
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+
+
+class TwoBitReader(object):
+    """
+    Random access to the sequences of a .2bit file.
+
+    The file is memory-mapped. The block tables of a sequence are read when
+    the sequence is first accessed. Coordinates are 0-based, end exclusive,
+    regions that extend past the end of a sequence are truncated.
+
+    Parameters
+    ----------
+    fname : str
+        Filename of the .2bit file.
+    """
+
+    def __init__(self, fname):
+        self.fname = fname
+        self._file = open(fname, "rb")
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        signature, version, count, _ = struct.unpack_from("<IIII", self._mmap)
+        self._order = "<"
+        if signature != SIGNATURE:
+            self._order = ">"
+            signature, version, count, _ = struct.unpack_from(">IIII", self._mmap)
+        if signature != SIGNATURE:
+            self.close()
+            raise ValueError("{} is not a .2bit file".format(fname))
+        fmt = self._order + ("Q" if version else "I")
+
+        self.offsets = {}
+        pos = 16
+        for _ in range(count):
+            size = self._mmap[pos]
+            name = self._mmap[pos + 1 : pos + 1 + size].decode()
+            pos += 1 + size
+            self.offsets[name] = struct.unpack_from(fmt, self._mmap, pos)[0]
+            pos += struct.calcsize(fmt)
+        self._records = {}
+
+    def _table(self, pos):
+        """Read a block table, returns the starts, ends and the end position."""
+        (count,) = struct.unpack_from(self._order + "I", self._mmap, pos)
+        dtype = self._order + "u4"
+        values = np.frombuffer(self._mmap, dtype, 2 * count, pos + 4)
+        starts = values[:count].astype(np.int64)
+        ends = starts + values[count:]
+        # lists, as a region overlaps few blocks and bisect is faster
+        return starts.tolist(), ends.tolist(), pos + 4 + 8 * count
+
+    def record(self, name):
+        """Return the length, N blocks, mask blocks and offset of a sequence."""
+        rec = self._records.get(name)
+        if rec is None:
+            pos = self.offsets[name]
+            (length,) = struct.unpack_from(self._order + "I", self._mmap, pos)
+            n_starts, n_ends, pos = self._table(pos + 4)
+            mask_starts, mask_ends, pos = self._table(pos)
+            rec = (length, (n_starts, n_ends), (mask_starts, mask_ends), pos + 4)
+            self._records[name] = rec
+        return rec
+
+    def fetch(self, name, start, end):
+        """
+        Return the sequence of a region.
+
+        Parameters
+        ----------
+        name : str
+            Sequence name.
+
+        start, end : int
+            0-based start and (exclusive) end position.
+
+        Returns
+        -------
+        str
+        """
+        length, n_blocks, mask_blocks, offset = self.record(name)
+        end = min(end, length)
+        if end <= start:
+            return ""
+
+        first = offset + start // 4
+        packed = np.frombuffer(self._mmap, np.uint8, (end + 3) // 4 - start // 4, first)
+        seq = _DECODE[packed].view(np.uint8)[start % 4 : start % 4 + end - start]
+        for s, e in _overlap(n_blocks, start, end):
+            seq[s:e] = ord("N")
+        for s, e in _overlap(mask_blocks, start, end):
+            seq[s:e] += 32
+        return seq.tobytes().decode()
+
+    def close(self):
+        self._mmap.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def _overlap(blocks, start, end):
+    """Yield the parts of the blocks in a region, relative to the start."""
+    starts, ends = blocks
+    first = bisect_right(ends, start)
+    last = bisect_left(starts, end, first)
+    for i in range(first, last):
+        yield max(starts[i], start) - start, min(ends[i], end) - start
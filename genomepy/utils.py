@@ -3,28 +3,43 @@ import errno
 import os
 import re
 import sys
-import urllib.request
 import subprocess as sp
 
 from pyfaidx import Fasta
-
-
-def generate_gap_bed(fname, outname):
+from genomepy.download import url_exists
+from genomepy.fasta import (
+    BLOCKSIZE,
+    filter_sequences,
+    read_fai,
+    read_fasta,
+    record_end,
+    write_fasta,
+)
+from genomepy.gaps import find_gaps
+
+
+def generate_gap_bed(fname, outname, processes=None):
     """ Generate a BED file with gap locations.
 
     Parameters
     ----------
     fname : str
-        Filename of input FASTA file.
+        Filename of input (bgzipped) FASTA file.
 
     outname : str
         Filename of output BED file.
+
+    processes : int , optional
+        Number of processes, by default the number of cores.
     """
-    f = Fasta(fname)
     with open(outname, "w") as bed:
-        for chrom in f.keys():
-            for m in re.finditer(r"N+", f[chrom][:].seq):
-                bed.write("{}\t{}\t{}\n".format(chrom, m.start(0), m.end(0)))
+        for chrom, starts, ends in find_gaps(fname, processes):
+            bed.write(
+                "".join(
+                    "{}\t{}\t{}\n".format(chrom, start, end)
+                    for start, end in zip(starts.tolist(), ends.tolist())
+                )
+            )
 
 
 def filter_fasta(infa, outfa, regex=".*", v=False, force=False):
@@ -65,25 +80,100 @@ def filter_fasta(infa, outfa, regex=".*", v=False, force=False):
                 "{} already exists, set force to True to overwrite".format(outfa)
             )
 
-    filt_function = re.compile(regex).search
-    fa = Fasta(infa, filt_function=filt_function)
-    seqs = fa.keys()
-    if v:
-        original_fa = Fasta(infa)
-        seqs = [s for s in original_fa.keys() if s not in seqs]
-        fa = original_fa
-
-    if len(seqs) == 0:
+    if infa.endswith(".gz"):
+        # compressed sequences are streamed through a filter
+        with open(infa, "rb") as f:
+            lines = filter_sequences(read_fasta(f, infa), regex, invert_match=v)
+            write_fasta(lines, outfa)
+        return Fasta(outfa)
+
+    # make sure the index is up-to-date
+    Fasta(infa).close()
+
+    # the records (header and sequence) to copy, as byte ranges of infa
+    search = re.compile(regex).search
+    selected = []
+    start = 0
+    for name, length, offset, linebases, linewidth in read_fai(infa + ".fai"):
+        end = record_end(length, offset, linebases, linewidth)
+        if bool(search(name)) != v:
+            selected.append((start, end, [name, length, offset, linebases, linewidth]))
+        start = end
+
+    if len(selected) == 0:
         raise ValueError("No sequences left after filtering!")
 
-    with open(outfa, "w") as out:
-        for chrom in seqs:
-            out.write(">{}\n".format(fa[chrom].name))
-            out.write("{}\n".format(fa[chrom][:].seq))
+    # copy the records without reading them into memory
+    size = os.path.getsize(infa)
+    fai = []
+    with open(infa, "rb", buffering=0) as fin, open(outfa, "wb", buffering=0) as out:
+        for start, end, rec in selected:
+            # offsets in the output file
+            rec[2] += out.tell() - start
+            fai.append(rec)
+            copy_range(fin, out, start, min(end, size) - start)
+            if end > size:
+                # the last line of the file has no newline
+                out.write(b"\n")
+
+    with open(outfa + ".fai", "w") as f:
+        for rec in fai:
+            f.write("\t".join(str(x) for x in rec) + "\n")
 
     return Fasta(outfa)
 
 
+def copy_range(fsrc, fdst, start, length):
+    """
+    Copy a byte range of a file to the current position of another file.
+
+    The data are copied by the kernel, with copy_file_range or sendfile if
+    available, otherwise with large buffered reads. Both files should be
+    opened unbuffered.
+
+    Parameters
+    ----------
+    fsrc : file object
+        Source file.
+
+    fdst : file object
+        Destination file.
+
+    start : int
+        Start offset in fsrc.
+
+    length : int
+        Number of bytes to copy.
+    """
+    end = start + length
+    src, dst = fsrc.fileno(), fdst.fileno()
+    for name in ["copy_file_range", "sendfile"]:
+        if not hasattr(os, name):
+            continue
+        try:
+            while start < end:
+                if name == "copy_file_range":
+                    n = os.copy_file_range(src, dst, end - start, start)
+                else:
+                    n = os.sendfile(dst, src, start, end - start)
+                if n == 0:
+                    break
+                start += n
+        except OSError:
+            # not supported for these files
+            continue
+        if start == end:
+            return
+
+    fsrc.seek(start)
+    while start < end:
+        data = fsrc.read(min(BLOCKSIZE, end - start))
+        if not data:
+            break
+        fdst.write(data)
+        start += len(data)
+
+
 def mkdir_p(path):
     """ 'mkdir -p' in Python """
     try:
@@ -95,6 +185,13 @@ def mkdir_p(path):
             raise
 
 
+def is_outdated(fname, source):
+    """Returns True if fname does not exist or is older than source."""
+    if not os.path.exists(fname):
+        return True
+    return os.path.getmtime(fname) < os.path.getmtime(source)
+
+
 def cmd_ok(cmd):
     """Returns True if cmd can be run."""
     try:
@@ -127,9 +224,7 @@ def get_localname(name, localname):
       else: returns name
     """
     if localname is None:
-        try:
-            urllib.request.urlopen(name)
-        except (IOError, ValueError):
+        if not url_exists(name):
             return name.replace(" ", "_")
         else:
             # try to get the name from the url
@@ -28,7 +28,8 @@ requires = [
     "requests",
     "biopython>=1.73",
     "appdirs",
-    "psutil",
+    "pyyaml",
+    "numpy",
 ]
 
 classifiers = [
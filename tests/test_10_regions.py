@@ -0,0 +1,201 @@
+import genomepy
+import genomepy.bgzf
+import genomepy.regions
+import gzip
+import os
+import pytest
+import random
+import shutil
+
+from pyfaidx import Fasta, FetchError
+from tempfile import mkdtemp
+
+from genomepy.fasta import bgzip_fasta
+
+
+def expected_seqs(fname, track, stranded=False, extend_up=0, extend_down=0):
+    """Sequences of a BED file, one region at a time with pyfaidx."""
+    fa = Fasta(fname)
+    seqs = []
+    with open(track) as f:
+        for line in f:
+            vals = line.strip().split("\t")
+            chrom, start, end = vals[0], int(vals[1]), int(vals[2])
+            rc = stranded and len(vals) > 5 and vals[5] == "-"
+            starts, ends = [start], [end]
+            if len(vals) == 12:
+                starts = [start + int(x) for x in vals[11].split(",")[:-1]]
+                sizes = [int(x) for x in vals[10].split(",")[:-1]]
+                ends = [s + size for s, size in zip(starts, sizes)]
+            if rc:
+                starts[0] -= extend_down
+                ends[-1] += extend_up
+            else:
+                starts[0] -= extend_up
+                ends[-1] += extend_down
+            intervals = [(s + 1, e) for s, e in zip(starts, ends)]
+            seq = fa.get_spliced_seq(chrom, intervals, rc).seq
+            name = "{}:{}-{}".format(chrom, start, end)
+            if len(vals) > 3:
+                name += " " + vals[3]
+            seqs.append((name, seq))
+    return seqs
+
+
+@pytest.fixture(scope="module", params=["", ".gz"])
+def genome(request):
+    tmpdir = mkdtemp()
+    fname = os.path.join(tmpdir, "genome.fa")
+    rnd = random.Random(1)
+    with open(fname, "w") as f:
+        for chrom, length in [("chr1", 5000), ("chr2", 3001), ("chr3", 70)]:
+            seq = "".join(rnd.choice("ACGTacgtN") for _ in range(length))
+            f.write(">{}\n".format(chrom))
+            for i in range(0, length, 60):
+                f.write(seq[i : i + 60] + "\n")
+    # uncompressed reference, pyfaidx only truncates regions in plain files
+    ref = os.path.join(tmpdir, "ref.fa")
+    shutil.copyfile(fname, ref)
+    if request.param:
+        bgzip_fasta(fname)
+        fname += request.param
+
+    track = os.path.join(tmpdir, "regions.bed")
+    with open(track, "w") as f:
+        for i in range(500):
+            chrom, length = rnd.choice([("chr1", 5000), ("chr2", 3001), ("chr3", 70)])
+            start = rnd.randint(20, length)
+            end = min(start + rnd.randint(0, 200), length + 10)
+            strand = rnd.choice("+-")
+            f.write("{}\t{}\t{}\tpeak{}\t0\t{}\n".format(chrom, start, end, i, strand))
+        # BED12
+        f.write("chr1\t100\t400\tgene\t0\t-\t100\t400\t0\t2\t50,30,\t0,270,\n")
+    yield fname, ref, track
+    shutil.rmtree(tmpdir)
+
+
+@pytest.mark.parametrize("processes", [1, 2])
+def test_track2fasta(genome, monkeypatch, processes):
+    fname, ref, track = genome
+    # multiple batches, so they are processed in parallel
+    monkeypatch.setattr(genomepy.regions, "BATCH_SIZE", 50)
+    g = genomepy.Genome(fname)
+
+    for stranded, extend_up, extend_down in [(False, 0, 0), (True, 10, 20)]:
+        expected = expected_seqs(ref, track, stranded, extend_up, extend_down)
+        result = g.track2fasta(
+            track,
+            stranded=stranded,
+            extend_up=extend_up,
+            extend_down=extend_down,
+            processes=processes,
+        )
+        assert [(s.name, s.seq) for s in result] == expected
+
+    # write to a file
+    outfa = os.path.join(os.path.dirname(track), "regions.fa")
+    g.track2fasta(track, fastafile=outfa, processes=processes)
+    expected = expected_seqs(ref, track)
+    assert open(outfa).read() == "".join(">{}\n{}\n".format(*s) for s in expected)
+
+
+def test_track2fasta_regions(genome):
+    fname, _, _ = genome
+    g = genomepy.Genome(fname)
+    regions = ["chr1:10-20", "chr2:2990-3010", "chr3:5-70"]
+    result = list(g.track2seqs(regions, extend_up=5, extend_down=5))
+    assert [s.name for s in result] == regions
+    assert result[0].seq == g["chr1"][5:25].seq
+    assert result[1].seq == g["chr2"][2985:3001].seq
+    assert result[2].seq == g["chr3"][0:70].seq
+
+    with pytest.raises(FetchError):
+        list(g.track2seqs(["chr1:10-20", "chr4:10-20"]))
+    with pytest.raises(FetchError):
+        list(g.track2seqs(["chr1:2-20"], extend_up=5))
+
+
+def test_transcriptome(genome):
+    fname, ref, track = genome
+    tmpdir = os.path.dirname(track)
+    annotation = os.path.join(tmpdir, "annotation.bed.gz")
+    transcripts = [
+        ("chr1", 100, 400, "tx1", "+", [50, 30], [0, 270]),
+        ("chr2", 10, 3001, "tx2", "-", [1, 100, 91], [0, 1000, 2900]),
+        ("chr1", 4000, 4100, "tx3", "-", [100], [0]),
+        ("chrUn", 0, 10, "tx4", "+", [10], [0]),
+    ]
+    with gzip.open(annotation, "wt") as f:
+        f.write("track name=genes\n")
+        for chrom, start, end, name, strand, sizes, starts in transcripts:
+            f.write(
+                "{}\t{}\t{}\t{}\t0\t{}\t{}\t{}\t0\t{}\t{},\t{},\n".format(
+                    chrom,
+                    start,
+                    end,
+                    name,
+                    strand,
+                    start,
+                    end,
+                    len(sizes),
+                    ",".join(str(x) for x in sizes),
+                    ",".join(str(x) for x in starts),
+                )
+            )
+
+    outfa = os.path.join(tmpdir, "transcripts.fa")
+    g = genomepy.Genome(fname)
+    g.transcriptome(outfa, annotation=annotation, processes=2)
+
+    fa = Fasta(ref)
+    result = Fasta(outfa)
+    assert list(result.keys()) == ["tx1", "tx3", "tx2"]
+    for chrom, start, _, name, strand, sizes, starts in transcripts[:3]:
+        intervals = [
+            (start + s + 1, start + s + size) for s, size in zip(starts, sizes)
+        ]
+        expected = fa.get_spliced_seq(chrom, intervals, rc=strand == "-").seq
+        assert result[name][:].seq == expected
+    assert os.path.exists(outfa + ".fai")
+
+
+@pytest.mark.parametrize("read_ahead", [0, 2])
+def test_bgzf_cache(monkeypatch, read_ahead):
+    tmpdir = mkdtemp()
+    fname = os.path.join(tmpdir, "genome.fa")
+    rnd = random.Random(3)
+    seq = "".join(rnd.choice("ACGTacgtN") for _ in range(300000))
+    with open(fname, "w") as f:
+        f.write(">chr1\n")
+        for i in range(0, len(seq), 60):
+            f.write(seq[i : i + 60] + "\n")
+    bgzip_fasta(fname)
+    fname += ".gz"
+
+    # random access with a cache of 2 blocks
+    with genomepy.bgzf.BgzfReader(fname) as plain, genomepy.bgzf.BgzfReader(
+        fname, cache_size=2 * 65280, read_ahead=read_ahead
+    ) as cached:
+        assert len(plain.blocks) > 4
+        for _ in range(200):
+            start = rnd.randrange(300000)
+            length = rnd.randrange(200000)
+            assert cached.read(start, length) == plain.read(start, length)
+        info = cached.cache_info()
+        assert info["hits"] > 0
+        assert info["blocks"] <= 3
+        assert info["size"] <= 2 * 65280 or info["blocks"] == 1
+
+    monkeypatch.setitem(genomepy.functions.config.config, "bgzf_read_ahead", read_ahead)
+    g = genomepy.Genome(fname)
+    for _ in range(100):
+        start = rnd.randrange(300000)
+        end = start + rnd.randrange(1000)
+        assert g["chr1"][start:end].seq == seq[start:end]
+    assert g.get_seq("chr1", 299990, 300010).end == 300000
+    assert g.cache_info()["misses"] > 0
+    assert g.cache_info()["hits"] > 0
+    with pytest.raises(FetchError):
+        g.get_seq("chrX", 1, 10)
+    g.close()
+    shutil.rmtree(tmpdir)
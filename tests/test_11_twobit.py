@@ -0,0 +1,80 @@
+import genomepy
+import genomepy.gaps
+import os
+import pytest
+import random
+import shutil
+
+from pyfaidx import Fasta, FetchError
+from tempfile import mkdtemp
+
+from genomepy.fasta import bgzip_fasta
+from genomepy.plugins.twobit import TwobitPlugin
+from genomepy.twobit import TwoBitReader, write_twobit
+
+
+@pytest.fixture(scope="module", params=["", ".gz"])
+def genome(request):
+    tmpdir = mkdtemp()
+    fname = os.path.join(tmpdir, "genome.fa")
+    rnd = random.Random(1)
+    with open(fname, "w") as f:
+        for chrom, length in [("chr1", 5000), ("chr2", 3001), ("chr3", 7), ("chr4", 1)]:
+            seq = "".join(rnd.choice("ACGTacgtNnNNR") for _ in range(length))
+            f.write(">{}\n".format(chrom))
+            for i in range(0, length, 60):
+                f.write(seq[i : i + 60] + "\n")
+    ref = os.path.join(tmpdir, "ref.fa")
+    shutil.copyfile(fname, ref)
+    if request.param:
+        bgzip_fasta(fname)
+        fname += request.param
+    yield fname, Fasta(ref)
+    shutil.rmtree(tmpdir)
+
+
+def twobit_seq(seq):
+    """Sequence as stored in a .2bit file, non-ACGT nucleotides are N."""
+    return "".join(c if c in "ACGTacgtNn" else "N" for c in seq)
+
+
+@pytest.mark.parametrize("chunk_size", [50, 4 * 1024 * 1024])
+def test_twobit(genome, chunk_size, monkeypatch):
+    fname, ref = genome
+    monkeypatch.setattr(genomepy.gaps, "CHUNK_SIZE", chunk_size)
+    twobit = fname + ".2bit"
+    write_twobit(fname, twobit)
+
+    rnd = random.Random(2)
+    with TwoBitReader(twobit) as tb:
+        assert list(tb.offsets) == list(ref.keys())
+        for chrom in ref.keys():
+            seq = twobit_seq(ref[chrom][:].seq)
+            assert tb.fetch(chrom, 0, len(seq) + 10) == seq
+            for _ in range(100):
+                start = rnd.randrange(len(seq))
+                end = rnd.randrange(start, len(seq) + 5)
+                assert tb.fetch(chrom, start, end) == seq[start:end]
+        assert tb.fetch("chr1", 10, 10) == ""
+
+
+def test_genome_twobit(genome):
+    fname, ref = genome
+    with pytest.raises(FileNotFoundError):
+        genomepy.Genome(fname, backend="2bit")
+
+    TwobitPlugin().after_genome_download(genomepy.Genome(fname))
+    g = genomepy.Genome(fname, backend="2bit")
+    assert g is not genomepy.Genome(fname)
+    seq = g["chr2"][100:200]
+    assert (seq.name, seq.start, seq.end) == ("chr2", 101, 200)
+    assert seq.seq == twobit_seq(ref["chr2"][100:200].seq)
+    assert g["chr2"][2990:3010].end == 3001
+    assert g.get_seq("chr1", 11, 20, rc=True).seq == twobit_seq(
+        ref.get_seq("chr1", 11, 20, rc=True).seq
+    )
+    with pytest.raises(FetchError):
+        g.get_seq("chrX", 1, 10)
+
+    with pytest.raises(ValueError):
+        genomepy.Genome(fname, backend="unknown")
@@ -0,0 +1,74 @@
+import genomepy
+import genomepy.gaps
+import numpy as np
+import os
+import pytest
+import random
+import shutil
+
+from pyfaidx import Fasta, FetchError
+from tempfile import mkdtemp
+
+from genomepy.fasta import bgzip_fasta
+from genomepy.plugins.seqarray import SeqarrayPlugin
+from genomepy.seqarray import SeqArray, write_seqarray
+
+
+@pytest.fixture(scope="module", params=["", ".gz"])
+def genome(request):
+    tmpdir = mkdtemp()
+    fname = os.path.join(tmpdir, "genome.fa")
+    rnd = random.Random(1)
+    with open(fname, "w") as f:
+        for chrom, length in [("chr1", 5000), ("chr2", 3001), ("chr3", 7)]:
+            seq = "".join(rnd.choice("ACGTacgtN") for _ in range(length))
+            f.write(">{}\n".format(chrom))
+            for i in range(0, length, 60):
+                f.write(seq[i : i + 60] + "\n")
+    ref = os.path.join(tmpdir, "ref.fa")
+    shutil.copyfile(fname, ref)
+    if request.param:
+        bgzip_fasta(fname)
+        fname += request.param
+    yield fname, Fasta(ref)
+    shutil.rmtree(tmpdir)
+
+
+@pytest.mark.parametrize("chunk_size", [50, 4 * 1024 * 1024])
+def test_seqarray(genome, chunk_size, monkeypatch):
+    fname, ref = genome
+    monkeypatch.setattr(genomepy.gaps, "CHUNK_SIZE", chunk_size)
+    outfile = fname + ".seq"
+    write_seqarray(fname, outfile)
+    assert os.path.getsize(outfile) == sum(len(ref[chrom]) for chrom in ref.keys())
+
+    seqs = SeqArray(outfile)
+    for chrom in ref.keys():
+        seq = ref[chrom][:].seq
+        assert seqs.array(chrom).tobytes().decode() == seq
+        assert seqs.array(chrom, 5, 20).tobytes().decode() == seq[5:20]
+        assert seqs.array(chrom, -3).tobytes().decode() == seq[-3:]
+    with pytest.raises(FetchError):
+        seqs.array("chrX")
+
+
+def test_genome_array(genome):
+    fname, ref = genome
+    g = genomepy.Genome(fname)
+    seqarray = genomepy.functions.genome_files(fname)["seqarray"]
+    if os.path.exists(seqarray):
+        os.unlink(seqarray)
+
+    # created when first needed
+    arr = g.array("chr2", 100, 200)
+    assert os.path.exists(seqarray)
+    assert arr.dtype == np.uint8
+    assert not arr.flags.writeable
+    assert arr.tobytes().decode() == ref["chr2"][100:200].seq
+    assert len(g.array("chr1")) == 5000
+
+    p = SeqarrayPlugin()
+    assert p.get_properties(g)["seqarray"] == seqarray
+    t0 = os.path.getmtime(seqarray)
+    p.after_genome_download(g)
+    assert os.path.getmtime(seqarray) == t0
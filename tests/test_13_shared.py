@@ -0,0 +1,75 @@
+import genomepy
+import genomepy.shared
+import pickle
+import pytest
+import subprocess as sp
+import sys
+import time
+
+from concurrent.futures import ProcessPoolExecutor
+from pyfaidx import Fasta, FetchError
+
+pytestmark = pytest.mark.skipif(
+    sys.version_info < (3, 8), reason="shared memory requires Python 3.8"
+)
+
+
+def worker_seq(args):
+    shared, start = args
+    return shared.fetch("chr1", start, start + 10)
+
+
+def test_share():
+    fname = "tests/data/gap.fa"
+    ref = Fasta(fname)
+    g = genomepy.Genome(fname)
+    with g.share() as shared:
+        assert list(shared.keys()) == list(ref.keys())
+        for chrom in ref.keys():
+            seq = ref[chrom][:].seq
+            assert shared.array(chrom).tobytes().decode() == seq
+            assert shared.fetch(chrom, 2, 9) == seq[2:9]
+        assert not shared.array("chr1").flags.writeable
+        with pytest.raises(FetchError):
+            shared.array("chrX")
+
+        # attachments are shared within a process
+        attached = pickle.loads(pickle.dumps(shared))
+        assert attached is not shared
+        assert genomepy.shared.attach(shared.name) is attached
+        assert attached.fetch("chr1", 0, 10) == ref["chr1"][0:10].seq
+        attached.close()
+        assert shared.name in genomepy.shared._attached
+        attached.close()
+        assert shared.name not in genomepy.shared._attached
+
+        with ProcessPoolExecutor(2) as pool:
+            seqs = list(pool.map(worker_seq, [(shared, i) for i in range(4)]))
+        assert seqs == [ref["chr1"][i : i + 10].seq for i in range(4)]
+
+    # the segment is removed by the publisher
+    with pytest.raises(FileNotFoundError):
+        genomepy.shared.attach(shared.name)
+
+    with g.share(["chr2"]) as shared:
+        assert list(shared.keys()) == ["chr2"]
+        assert shared.fetch("chr2", 0, 100) == ref["chr2"][:].seq
+    with pytest.raises(FetchError):
+        g.share(["chrX"])
+
+
+def test_attach_other_process():
+    fname = "tests/data/gap.fa"
+    ref = Fasta(fname)
+    with genomepy.shared.SharedGenome.publish(fname) as shared:
+        code = "import genomepy.shared as s; print(s.attach({!r}).fetch('chr1', 0, 10))"
+        cmd = [sys.executable, "-c", code.format(shared.name)]
+        for _ in range(2):
+            # an independent process attaches and exits
+            out = sp.check_output(cmd)
+            assert out.decode().strip() == ref["chr1"][0:10].seq
+            # give its resource tracker time to clean up
+            time.sleep(1)
+            attached = genomepy.shared.attach(shared.name)
+            assert attached.fetch("chr1", 0, 10) == ref["chr1"][0:10].seq
+            attached.close()
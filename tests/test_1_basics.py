@@ -1,11 +1,17 @@
+import asyncio
+import os
+import pickle
 import genomepy
 import pytest
+import time
+
+from concurrent.futures import ProcessPoolExecutor
 
 
 def test_basic():
     cfg = genomepy.functions.config
     print(cfg)
-    assert 3 == len(cfg.keys())
+    assert 6 == len(cfg.keys())
 
 
 def test_genome_dir_not_found():
@@ -29,3 +35,135 @@ def test_track_type():
     for track, track_type in tracks:
         result = genomepy.functions.get_track_type(track)
         assert result == track_type
+
+
+class FastProvider(genomepy.provider.ProviderBase):
+    name = "fast"
+
+    def search(self, term):
+        yield ("fast1", term)
+        yield ("fast2", term)
+
+    def list_available_genomes(self):
+        return [("fast1", "")]
+
+
+class SlowProvider(FastProvider):
+    name = "slow"
+
+    def search(self, term):
+        time.sleep(10)
+        yield ("slow1", term)
+
+
+@pytest.fixture
+def providers(monkeypatch):
+    monkeypatch.setattr(
+        genomepy.provider.ProviderBase,
+        "_providers",
+        {"fast": FastProvider, "slow": SlowProvider},
+    )
+
+
+def test_concurrent_search(providers):
+    start = time.time()
+    result = list(genomepy.search("term", timeout=1))
+    assert time.time() - start < 5
+    # the slow provider is skipped
+    assert result == [[b"fast", b"fast1", b"term"], [b"fast", b"fast2", b"term"]]
+
+    result = list(genomepy.list_available_genomes())
+    assert sorted(result) == [["fast", "fast1", ""], ["slow", "fast1", ""]]
+
+
+def test_default_provider_timeout(providers, monkeypatch):
+    monkeypatch.delitem(genomepy.functions.config, "provider_timeout", raising=False)
+    assert genomepy.functions._timeout(None) == genomepy.functions.PROVIDER_TIMEOUT
+
+    monkeypatch.setattr(genomepy.functions, "PROVIDER_TIMEOUT", 1)
+    start = time.time()
+    result = list(genomepy.search("term"))
+    assert time.time() - start < 5
+    assert result == [[b"fast", b"fast1", b"term"], [b"fast", b"fast2", b"term"]]
+
+
+def test_search_async(providers):
+    async def search():
+        return [row async for row in genomepy.search_async("term", timeout=1)]
+
+    start = time.time()
+    result = asyncio.get_event_loop().run_until_complete(search())
+    assert time.time() - start < 5
+    assert result == [[b"fast", b"fast1", b"term"], [b"fast", b"fast2", b"term"]]
+
+
+def test_genome_registry(tmp_path):
+    genome_dir = str(tmp_path)
+    os.mkdir(os.path.join(genome_dir, "small"))
+    fname = os.path.join(genome_dir, "small", "small.fa")
+    with open(fname, "w") as f:
+        f.write(">chr1\nACGTNNACGT\n")
+
+    g = genomepy.Genome("small", genome_dir=genome_dir)
+    assert g.name == "small"
+    assert g._props is None
+    assert "sizes" in g.props
+    assert genomepy.Genome("small", genome_dir=genome_dir) is g
+    assert genomepy.Genome(fname) is not g
+
+    # genomes added after the first lookup are found
+    os.mkdir(os.path.join(genome_dir, "other"))
+    with open(os.path.join(genome_dir, "other", "other.fa"), "w") as f:
+        f.write(">chr1\nACGT\n")
+    assert genomepy.Genome("other", genome_dir=genome_dir)["chr1"][:].seq == "ACGT"
+
+    # a changed file gives a new instance
+    with open(fname, "w") as f:
+        f.write(">chr1\nACGTACGTACGT\n")
+    os.utime(fname, ns=(0, 0))
+    os.unlink(fname + ".fai")
+    g2 = genomepy.Genome("small", genome_dir=genome_dir)
+    assert g2 is not g
+    assert len(g2["chr1"]) == 12
+
+    g2.close()
+    g3 = genomepy.Genome("small", genome_dir=genome_dir)
+    assert g3 is not g2
+
+    # the files are closed when all users have closed the genome
+    with genomepy.Genome("small", genome_dir=genome_dir) as g4:
+        assert g4 is g3
+    assert g3["chr1"][:].seq == "ACGTACGTACGT"
+    g3.close()
+    assert genomepy.Genome("small", genome_dir=genome_dir) is not g3
+
+    genomepy.Genome.clear_cache()
+    assert genomepy.functions._genomes == {}
+
+
+def genome_seq(args):
+    g, start = args
+    return g["chr1"][start : start + 5].seq
+
+
+def test_genome_pickle():
+    fname = "tests/data/gap.fa"
+    g = genomepy.Genome(fname)
+    data = pickle.dumps(g)
+    assert len(data) < 1000
+    assert pickle.loads(data) is g
+
+    # opened when first used
+    genomepy.Genome.clear_cache()
+    g2 = pickle.loads(data)
+    assert g2 is not g
+    assert "_lazy" in g2.__dict__
+    assert g2.name == "gap.fa"
+    assert "_lazy" not in g2.__dict__
+    assert g2["chr1"][0:10].seq == g["chr1"][0:10].seq
+    assert genomepy.Genome(fname) is g2
+    assert pickle.loads(pickle.dumps(g2)) is g2
+
+    with ProcessPoolExecutor(2) as pool:
+        seqs = list(pool.map(genome_seq, [(g2, i) for i in range(4)]))
+    assert seqs == [g2["chr1"][i : i + 5].seq for i in range(4)]
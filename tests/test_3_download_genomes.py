@@ -1,9 +1,16 @@
 import genomepy
+import genomepy.fasta
+import genomepy.stats
+import genomepy.utils
+import gzip
+import io
 import shutil
 import pytest
 import os
+from pyfaidx import Faidx
 from tempfile import mkdtemp
 from platform import system
+import tarfile
 
 travis = "TRAVIS" in os.environ and os.environ["TRAVIS"] == "true"
 linux = system() == "Linux"
@@ -81,3 +88,266 @@ def test_url_genome():
     g = genomepy.Genome("url_test", genome_dir=tmp)
     assert str(g["chrI"][:12]).lower() == "gcctaagcctaa"
     shutil.rmtree(tmp)
+
+
+def test_local_url_genome():
+    """Test the streaming install pipeline on a local gzipped genome."""
+    tmp = mkdtemp()
+    fa = os.path.join(tmp, "local.fa.gz")
+    with gzip.open(fa, "wb") as f:
+        f.write(b">chr1 first\nACGTacgtNN\nacgt\n>chr2\nAAAA\n>scaffold_1\nCCCC\n")
+
+    genomepy.install_genome(
+        "file://" + fa, "url", genome_dir=tmp, mask="hard", regex="chr", bgzip=True,
+    )
+    g = genomepy.Genome("local", genome_dir=tmp)
+    assert g.filename.endswith("local.fa.gz")
+    assert list(g.keys()) == ["chr1", "chr2"]
+    assert str(g["chr1"][:]) == "ACGTacgtNNacgt"
+
+    with open(os.path.join(tmp, "local", "README.txt")) as f:
+        assert "\tscaffold_1\n" in f.read()
+    shutil.rmtree(tmp)
+
+
+def test_local_mirror(monkeypatch):
+    """Install a genome from a local mirror of NCBI."""
+    tmp = mkdtemp()
+    mirror = os.path.join(tmp, "mirror")
+    reports = os.path.join(mirror, "ftp.ncbi.nlm.nih.gov/genomes/ASSEMBLY_REPORTS")
+    ftp_path = "ftp://ftp.ncbi.nlm.nih.gov/genomes/all/GCF/000/001/GCF_000001.1_Test1"
+    asm_dir = os.path.join(mirror, ftp_path[6:])
+    os.makedirs(reports)
+    os.makedirs(asm_dir)
+
+    header = [
+        "assembly_accession",
+        "bioproject",
+        "biosample",
+        "wgs_master",
+        "refseq_category",
+        "taxid",
+        "species_taxid",
+        "organism_name",
+        "infraspecific_name",
+        "isolate",
+        "version_status",
+        "assembly_level",
+        "release_type",
+        "genome_rep",
+        "seq_rel_date",
+        "asm_name",
+        "submitter",
+        "gbrc_paired_asm",
+        "paired_asm_comp",
+        "ftp_path",
+    ]
+    genome = dict(zip(header, [""] * len(header)))
+    genome.update(asm_name="Test1", organism_name="Test organism", ftp_path=ftp_path)
+    for fname in [
+        "assembly_summary_refseq.txt",
+        "assembly_summary_genbank.txt",
+        "assembly_summary_refseq_historical.txt",
+    ]:
+        with open(os.path.join(reports, fname), "w") as f:
+            f.write("# See README\n# {}\n".format("\t".join(header)))
+            if fname.endswith("refseq.txt"):
+                f.write("\t".join(genome[h] for h in header) + "\n")
+
+    with gzip.open(
+        os.path.join(asm_dir, "GCF_000001.1_Test1_genomic.fna.gz"), "wb"
+    ) as f:
+        f.write(b">NC_000001.1 test\nACGTacgt\n")
+    with open(
+        os.path.join(asm_dir, "GCF_000001.1_Test1_assembly_report.txt"), "w"
+    ) as f:
+        f.write("# Sequence-Name\t...\n")
+        f.write("chr1\tassembled-molecule\t1\tChromosome\t\t=\tNC_000001.1\n")
+
+    # nothing is mirrored without a mirror
+    monkeypatch.setitem(genomepy.provider.config, "mirror", None)
+    assert list(genomepy.search("Test1", "local")) == []
+
+    monkeypatch.setitem(genomepy.provider.config, "mirror", mirror)
+    result = list(genomepy.search("Test1", "local"))
+    assert result == [[b"local", b"Test1", b"Test organism; "]]
+
+    genomepy.install_genome("Test1", "local", genome_dir=tmp, mask="hard")
+    g = genomepy.Genome("Test1", genome_dir=tmp)
+    assert list(g.keys()) == ["chr1"]
+    assert str(g["chr1"][:]) == "ACGTNNNN"
+    shutil.rmtree(tmp)
+
+
+def test_install_many():
+    """Install multiple genomes, and continue after a failed install."""
+    tmp = mkdtemp()
+    genomes = []
+    for name in ["first", "second"]:
+        fa = os.path.join(tmp, name + ".fa.gz")
+        with gzip.open(fa, "wb") as f:
+            f.write(b">chr1\nACGTNNNNACGT\n")
+        genomes.append({"name": "file://" + fa, "provider": "url"})
+    genomes.append({"name": "file:///nonexisting/third.fa.gz", "provider": "url"})
+
+    with pytest.raises(Exception, match="third"):
+        genomepy.install_many(genomes, genome_dir=os.path.join(tmp, "genomes"))
+    for name in ["first", "second"]:
+        g = genomepy.Genome(name, genome_dir=os.path.join(tmp, "genomes"))
+        assert str(g["chr1"][:]) == "ACGTNNNNACGT"
+        assert os.path.exists(os.path.join(tmp, "genomes", name, name + ".gaps.bed"))
+        assert os.path.exists(os.path.join(tmp, "genomes", name, name + ".stats.tsv"))
+        assert g.gap_sizes() == {"chr1": 4}
+        assert g.gap_index().count_n("chr1", 0, 6) == 2
+    shutil.rmtree(tmp)
+
+
+def test_read_tar():
+    """Stream the members of a tar archive."""
+    members = [("chr1.fa", b">chr1\nACGT\nAC"), ("chr2.fa", b">chr2\nAAAA\n")]
+    archive = io.BytesIO()
+    with tarfile.open(fileobj=archive, mode="w:gz") as tar:
+        for name, data in members:
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+
+    expected = b">chr1\nACGT\nAC\n>chr2\nAAAA\n"
+    archive.seek(0)
+    blocks = genomepy.fasta.read_blocks(archive, "chromFa.tar.gz", size=3)
+    assert b"".join(blocks) == expected
+    archive.seek(0)
+    lines = list(genomepy.fasta.read_fasta(archive, "chromFa.tar.gz", size=3))
+    assert b"".join(lines) == expected
+    # headers are separate from the sequence blocks
+    assert b">chr1\n" in lines
+    assert b">chr2\n" in lines
+
+
+@pytest.mark.parametrize("bgzip", [False, True])
+def test_write_fasta_index(bgzip):
+    """The .fai and .gzi indexes are the same as those built by pyfaidx."""
+    tmp = mkdtemp()
+    seq = "ACGTacgtNN" * 20000
+    data = "".join(
+        ">{} desc\n{}\n".format(
+            name, "\n".join(seq[i : min(i + 60, n)] for i in range(0, n, 60))
+        )
+        for name, n in [("chr1", 200000), ("chr2", 61), ("chr3", 60)]
+    ).encode()
+    blocks = [data[i : i + 1000] for i in range(0, len(data), 1000)]
+
+    fname = os.path.join(tmp, "written.fa" + (".gz" if bgzip else ""))
+    lines = genomepy.fasta.read_fasta(io.BytesIO(b"".join(blocks)), "written.fa")
+    genomepy.fasta.write_fasta(lines, fname, bgzip=bgzip)
+    with open(fname, "rb") as f:
+        assert (gzip.decompress(f.read()) if bgzip else f.read()) == data
+
+    # let pyfaidx build the indexes of a copy
+    copy = os.path.join(tmp, "copy.fa" + (".gz" if bgzip else ""))
+    shutil.copyfile(fname, copy)
+    assert genomepy.Genome(copy)["chr2"][:].seq == seq[:61]
+    for ext in [".fai", ".gzi"] if bgzip else [".fai"]:
+        with open(fname + ext, "rb") as f1, open(copy + ext, "rb") as f2:
+            assert f1.read() == f2.read()
+    shutil.rmtree(tmp)
+
+
+def test_fai_index():
+    fai = genomepy.fasta.FaiIndex()
+    for data in [b">chr1\n", b"ACG", b"T\nAC", b"GT\nAC\n", b">chr2\n", b"AA"]:
+        fai.add(data)
+    fai._finish()
+    assert fai.valid
+    assert fai.records == [["chr1", 10, 6, 4, 5], ["chr2", 2, 25, 2, 3]]
+
+    # inconsistent line lengths
+    fai = genomepy.fasta.FaiIndex()
+    for data in [b">chr1\n", b"ACGT\nAC\nACGT\n"]:
+        fai.add(data)
+    assert not fai.valid
+
+
+@pytest.mark.parametrize(
+    "data, valid",
+    [
+        (b">r0 d\nACGTACG\nACGTACG\nACG\n>r1\nACGT\nAC\n>r2\nA\n", True),
+        (b">r0\nACGT\nACGT\nACGT\nA\n>r1\nACGTA\nCG\n", True),
+        (b">r0\nACGTACGTACGT\n>r1\n>r2\nAC\nAC\nA", True),
+        # a shorter line that is not the last line
+        (b">r0 d\nCTNCAGT\nNTTNTGN\nCAGNNCG\nGCNTGG\nGGCAGGC\n", False),
+        (b">r0\nACGT\nAC\nACGT\nACGT\n", False),
+        # a longer line, or an empty line
+        (b">r0\nACGT\nACGTA\nAC\n", False),
+        (b">r0\nACGT\n\nACGT\n", False),
+    ],
+)
+def test_fai_index_blocks(data, valid):
+    """The index does not depend on the block size, and matches pyfaidx."""
+    tmp = mkdtemp()
+    fname = os.path.join(tmp, "written.fa")
+    copy = os.path.join(tmp, "copy.fa")
+    for size in range(1, 41):
+        for f in [fname + ".fai", copy + ".fai"]:
+            if os.path.exists(f):
+                os.unlink(f)
+        lines = genomepy.fasta.read_fasta(io.BytesIO(data), fname, size=size)
+        genomepy.fasta.write_fasta(lines, fname)
+        assert os.path.exists(fname + ".fai") == valid
+        if valid:
+            shutil.copyfile(fname, copy)
+            Faidx(copy).close()
+            with open(fname + ".fai") as f1, open(copy + ".fai") as f2:
+                assert f1.read() == f2.read()
+    shutil.rmtree(tmp)
+
+
+def test_genome_stats():
+    data = b">chr1 desc\nNNAC\nGTNN\nNa\n>chr2\nacgt\nNN\n>chr3\n"
+    tmp = mkdtemp()
+    fname = os.path.join(tmp, "test.fa")
+    stats = genomepy.stats.GenomeStats()
+    lines = genomepy.fasta.read_fasta(io.BytesIO(data), fname, size=5)
+    genomepy.fasta.write_fasta(stats.scan(lines), fname)
+    stats.write(fname)
+
+    with open(fname, "rb") as f:
+        assert f.read() == data
+    files = genomepy.stats.genome_files(fname)
+    assert open(files["sizes"]).read() == "chr1\t10\nchr2\t6\nchr3\t0\n"
+    # the same gaps as generate_gap_bed
+    genomepy.utils.generate_gap_bed(fname, os.path.join(tmp, "expected.bed"))
+    expected = open(os.path.join(tmp, "expected.bed")).read()
+    assert (
+        open(files["gaps"]).read() == expected == "chr1\t0\t2\nchr1\t6\t9\nchr2\t4\t6\n"
+    )
+    assert open(files["stats"]).read().splitlines() == [
+        "name\tlength\tGC\tN\tlowercase",
+        "chr1\t10\t0.4000\t0.5000\t0.1000",
+        "chr2\t6\t0.5000\t0.3333\t0.6667",
+        "chr3\t0\t0.0000\t0.0000\t0.0000",
+    ]
+    shutil.rmtree(tmp)
+
+
+def test_process_stages():
+    lines = [b">NC_001 description\n", b"ACGTacgt\n", b">NC_002\n", b"acgn\n"]
+
+    renamed = list(genomepy.fasta.rename_headers(lines, {"NC_001": "chr1"}))
+    assert renamed[0] == b">chr1 NC_001 description\n"
+    assert renamed[2] == b">NC_002 NC_002\n"
+
+    assert list(genomepy.fasta.mask_sequences(lines, "soft")) == lines
+    assert list(genomepy.fasta.mask_sequences(lines, "hard"))[3] == b"NNNn\n"
+    assert list(genomepy.fasta.mask_sequences(lines, "none"))[1] == b"ACGTACGT\n"
+
+    excluded = []
+    filtered = list(
+        genomepy.fasta.filter_sequences(
+            lines, "001", invert_match=True, excluded=excluded
+        )
+    )
+    assert filtered == lines[2:]
+    assert excluded == ["NC_001"]
+    with pytest.raises(ValueError):
+        list(genomepy.fasta.filter_sequences(lines, "chr"))
@@ -149,3 +149,21 @@ def test_regexp_filter():
         assert len(fa.keys()) == match
         fa = genomepy.utils.filter_fasta(fname, tmpfa, regex=regex, v=True, force=True)
         assert len(fa.keys()) == no_match
+
+
+@pytest.mark.parametrize("ext", ["", ".gz"])
+def test_filter_fasta_wrapping(ext):
+    """Records are copied as is, with their description and line wrapping."""
+    tmp = mkdtemp()
+    data = b">chr1 first\nACGTA\nCGTAC\nGT\n>scaffold_1\nAAAAA\n>chr2\nCCCCC\nCC"
+    fname = os.path.join(tmp, "genome.fa" + ext)
+    with open(fname, "wb") as f:
+        f.write(gzip.compress(data) if ext else data)
+
+    outfa = os.path.join(tmp, "filtered.fa")
+    fa = genomepy.utils.filter_fasta(fname, outfa, regex="chr")
+    assert list(fa.keys()) == ["chr1", "chr2"]
+    assert fa["chr2"][:].seq == "CCCCCCC"
+    with open(outfa, "rb") as f:
+        assert f.read() == b">chr1 first\nACGTA\nCGTAC\nGT\n>chr2\nCCCCC\nCC\n"
+    shutil.rmtree(tmp)
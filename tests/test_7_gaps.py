@@ -1,4 +1,15 @@
-from tempfile import NamedTemporaryFile
+import numpy as np
+import os
+import pytest
+import random
+import re
+
+from tempfile import NamedTemporaryFile, mkdtemp
+from shutil import rmtree
+
+import genomepy.gaps
+from genomepy.fasta import bgzip_fasta
+from genomepy.functions import Genome
 from genomepy.utils import generate_gap_bed
 
 
@@ -13,3 +24,129 @@ def test_gaps():
     expect = open(outbed).read()
 
     assert result == expect
+
+
+def regex_gaps(seqs):
+    """Gaps as found by a regular expression on the complete sequence."""
+    return "".join(
+        "{}\t{}\t{}\n".format(name, m.start(0), m.end(0))
+        for name, seq in seqs
+        for m in re.finditer(r"N+", seq)
+    )
+
+
+@pytest.mark.parametrize("bgzip", [False, True])
+@pytest.mark.parametrize("processes", [1, 2])
+def test_gaps_chunks(monkeypatch, bgzip, processes):
+    # small chunks and tasks, so runs span chunks and lines
+    monkeypatch.setattr(genomepy.gaps, "CHUNK_SIZE", 20)
+    monkeypatch.setattr(genomepy.gaps, "TASK_SIZE", 100)
+
+    rnd = random.Random(1)
+    seqs = []
+    for i, length in enumerate([0, 1, 7, 50, 100, 333, 1000]):
+        seq = "".join(rnd.choice("ACGTNNNNn") for _ in range(length))
+        seqs.append(("chr{}".format(i), seq))
+    seqs.append(("allN", "N" * 123))
+
+    tmpdir = mkdtemp()
+    fname = os.path.join(tmpdir, "genome.fa")
+    with open(fname, "w") as f:
+        for name, seq in seqs:
+            f.write(">{} description\n".format(name))
+            for i in range(0, len(seq), 7):
+                f.write(seq[i : i + 7] + "\n")
+    if bgzip:
+        bgzip_fasta(fname)
+        fname += ".gz"
+
+    bed = os.path.join(tmpdir, "gaps.bed")
+    generate_gap_bed(fname, bed, processes=processes)
+    result = open(bed).read()
+    rmtree(tmpdir)
+
+    assert result == regex_gaps(seqs)
+
+
+def test_gap_index():
+    rnd = random.Random(2)
+    seq = "".join(rnd.choice("AN") * rnd.randint(1, 6) for _ in range(300))
+    tmpdir = mkdtemp()
+    bed = os.path.join(tmpdir, "genome.gaps.bed")
+    with open(bed, "w") as f:
+        f.write(regex_gaps([("chr1", seq), ("chr2", "AAAA")]))
+
+    index = genomepy.gaps.GapIndex.load(bed)
+    assert os.path.exists(os.path.join(tmpdir, "genome.gaps.npy"))
+    assert index.chroms() == ["chr1"]
+    assert index.gap_sizes() == {"chr1": seq.count("N")}
+    for _ in range(1000):
+        start = rnd.randint(0, len(seq))
+        end = rnd.randint(start, len(seq))
+        assert index.count_n("chr1", start, end) == seq[start:end].count("N")
+        assert index.overlaps("chr1", start, end) == ("N" in seq[start:end])
+    assert index.count_n("chr2", 0, 4) == 0
+    assert not index.overlaps("chr2", 0, 4)
+
+    # arrays of intervals
+    starts = np.arange(0, len(seq) - 10, 7)
+    expected = [seq[start : start + 10].count("N") for start in starts]
+    assert index.count_n("chr1", starts, starts + 10).tolist() == expected
+    rmtree(tmpdir)
+
+
+def test_random_sequences():
+    tmpdir = mkdtemp()
+    fname = os.path.join(tmpdir, "genome.fa")
+    with open(fname, "w") as f:
+        f.write(">chr1\n" + "A" * 1000 + "N" * 1000 + "C" * 1000 + "\n")
+        f.write(">chr2\n" + "G" * 3000 + "\n")
+        f.write(">small\n" + "T" * 100 + "\n")
+    exclude = os.path.join(tmpdir, "exclude.bed")
+    with open(exclude, "w") as f:
+        f.write("track name=blacklist\nchr2\t0\t2000\nchr2\t1500\t2500\n")
+
+    g = Genome(fname)
+    coords = g.get_random_sequences(n=2000, length=10, max_n=0, seed=1)
+    assert len(coords) == 2000
+    assert coords == g.get_random_sequences(n=2000, length=10, max_n=0, seed=1)
+    for chrom, start, end in coords:
+        assert end - start == 10
+        assert "N" not in g[chrom][start:end].seq
+    assert set(chrom for chrom, _, _ in coords) == {"chr1", "chr2"}
+    # the end of a chromosome can be sampled
+    assert max(end for chrom, _, end in coords if chrom == "chr1") > 2950
+
+    coords = g.get_random_sequences(n=1000, length=10, seed=2, exclude=exclude)
+    for chrom, start, _end in coords:
+        assert chrom == "chr1" or start >= 2500
+
+    with pytest.raises(ValueError):
+        g.get_random_sequences(n=10, length=1000)
+    rmtree(tmpdir)
+
+
+def test_random_sequences_unsaved_gaps(monkeypatch):
+    tmpdir = mkdtemp()
+    fname = os.path.join(tmpdir, "genome.fa")
+    with open(fname, "w") as f:
+        f.write(">chr1\n" + "A" * 1000 + "N" * 1000 + "C" * 1000 + "\n")
+    g = Genome(fname)
+
+    def read_only():
+        raise PermissionError("read-only genome_dir")
+
+    # the gaps are still excluded if the gap index can not be saved
+    monkeypatch.setattr(g, "gap_index", read_only)
+    coords = g.get_random_sequences(n=100, length=10, max_n=0, seed=1)
+    for chrom, start, end in coords:
+        assert "N" not in g[chrom][start:end].seq
+
+    # other errors are not ignored
+    def broken():
+        raise ValueError("broken gap file")
+
+    monkeypatch.setattr(g, "gap_index", broken)
+    with pytest.raises(ValueError):
+        g.get_random_sequences(n=100, length=10, max_n=0, seed=1)
+    rmtree(tmpdir)
@@ -1,3 +1,4 @@
+import gzip
 import os
 import pytest
 import re
@@ -18,6 +19,8 @@ from genomepy.plugins.bowtie2 import Bowtie2Plugin
 from genomepy.plugins.hisat2 import Hisat2Plugin
 from genomepy.plugins.star import StarPlugin
 from genomepy.plugins.blacklist import BlacklistPlugin
+from genomepy.plugins.sizes import SizesPlugin
+from genomepy.plugins.transcriptome import TranscriptomePlugin
 
 
 @pytest.fixture(scope="module")
@@ -73,6 +76,19 @@ def force_test(p, fname, genome, force):
     assert t0 != t1 if force else t0 == t1
 
 
+def test_sizes(genome, force):
+    """Create sizes file."""
+    assert os.path.exists(genome.filename)
+
+    force = True if force == "overwrite" else False
+    p = SizesPlugin()
+    p.after_genome_download(genome, force=force)
+    fname = p.get_properties(genome)["sizes"]
+    assert os.path.exists(fname)
+
+    force_test(p, fname, genome, force)
+
+
 def test_blacklist(genome, force):
     """Create blacklist."""
     assert os.path.exists(genome.filename)
@@ -187,3 +203,22 @@ def test_gmap(genome, force):
         assert os.path.exists(fname)
 
         force_test(p, fname, genome, force)
+
+
+def test_transcriptome(genome, force):
+    """Create transcriptome."""
+    assert os.path.exists(genome.filename)
+
+    force = True if force == "overwrite" else False
+    dirname = os.path.dirname(genome.filename)
+    annotation = os.path.join(dirname, "{}.annotation.bed.gz".format(genome.name))
+    with gzip.open(annotation, "wt") as f:
+        f.write("chrI\t100\t400\ttx1\t0\t-\t100\t400\t0\t2\t50,30,\t0,270,\n")
+
+    p = TranscriptomePlugin()
+    p.after_genome_download(genome, force=force)
+    fname = os.path.join(dirname, "index", "transcriptome", "transcripts.fa")
+    assert os.path.exists(fname)
+    assert os.path.exists(fname + ".fai")
+
+    force_test(p, fname, genome, force)
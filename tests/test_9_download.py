@@ -0,0 +1,437 @@
+import gzip
+import hashlib
+import json
+import os
+import pytest
+import random
+import re
+import socketserver
+import subprocess as sp
+import threading
+import time
+
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from tempfile import mkdtemp
+from shutil import rmtree
+
+import genomepy.download
+from genomepy.download import (
+    Checksum,
+    download_file,
+    download_stream,
+    partial_filename,
+    upstream_checksum,
+)
+from genomepy.exceptions import ChecksumError
+
+
+class _Server(socketserver.ThreadingMixIn, HTTPServer):
+    """Threaded HTTP server (http.server.ThreadingHTTPServer requires Python 3.7)."""
+
+    daemon_threads = True
+
+
+class RangeHandler(BaseHTTPRequestHandler):
+    """Serve files from memory, with support for ranges and dropped connections."""
+
+    def log_message(self, *args):
+        pass
+
+    def do_HEAD(self):
+        self.do_GET(body=False)
+
+    def do_GET(self, body=True):
+        server = self.server
+        server.requests.append((self.command, self.path, dict(self.headers)))
+        data = server.files.get(self.path)
+        if data is None:
+            self.send_error(404)
+            return
+
+        etag = '"{}"'.format(hashlib.md5(data).hexdigest())
+        start, end = 0, len(data)
+        m = re.match(r"bytes=(\d+)-(\d*)", self.headers.get("Range", ""))
+        if_range = self.headers.get("If-Range")
+        if m and server.ranges and if_range in [None, etag]:
+            start = int(m.group(1))
+            if start >= len(data):
+                self.send_response(416)
+                self.send_header("Content-Range", "bytes */{}".format(len(data)))
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            end = int(m.group(2)) + 1 if m.group(2) else len(data)
+            self.send_response(206)
+            self.send_header(
+                "Content-Range", "bytes {}-{}/{}".format(start, end - 1, len(data))
+            )
+        else:
+            self.send_response(200)
+        self.send_header("Content-Length", str(end - start))
+        self.send_header("ETag", etag)
+        if server.ranges:
+            self.send_header("Accept-Ranges", "bytes")
+        self.end_headers()
+
+        if body:
+            chunk = data[start:end]
+            if server.fail_after is not None and len(chunk) > server.fail_after:
+                # simulate a dropped connection
+                chunk = chunk[: server.fail_after]
+                server.fail_after = None
+                self.close_connection = True
+            if server.corrupt:
+                # simulate a corrupted transfer
+                chunk = chunk[::-1]
+                server.corrupt = False
+            self.wfile.write(chunk)
+
+
+@pytest.fixture(scope="module")
+def server():
+    """Local HTTP server."""
+    httpd = _Server(("127.0.0.1", 0), RangeHandler)
+    httpd.files = {}
+    httpd.requests = []
+    httpd.ranges = True
+    httpd.fail_after = None
+    httpd.corrupt = False
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield httpd
+    httpd.shutdown()
+
+
+@pytest.fixture
+def tempdir():
+    tmpdir = mkdtemp()
+    yield tmpdir
+    rmtree(tmpdir)
+
+
+@pytest.fixture
+def no_cache(monkeypatch):
+    """Disable the download cache."""
+    monkeypatch.setitem(genomepy.download.config, "download_cache_size", 0)
+
+
+@pytest.fixture
+def cache_dir(monkeypatch):
+    """Use a temporary download cache."""
+    tmpdir = mkdtemp()
+    monkeypatch.setitem(genomepy.download.config, "download_cache_dir", tmpdir)
+    monkeypatch.setitem(genomepy.download.config, "download_cache_size", 1)
+    yield tmpdir
+    rmtree(tmpdir)
+
+
+def genome_data(size=200000, seed=1):
+    rnd = random.Random(seed)
+    seq = "".join(rnd.choice("ACGT") for _ in range(size))
+    lines = [seq[i : i + 60] for i in range(0, size, 60)]
+    return gzip.compress(">chr1\n{}\n".format("\n".join(lines)).encode())
+
+
+def test_resume_download(server, tempdir, no_cache):
+    data = genome_data()
+    server.files["/genome.fa.gz"] = data
+    url = "http://127.0.0.1:{}/genome.fa.gz".format(server.server_port)
+    partial = partial_filename(url, tempdir)
+
+    server.requests.clear()
+    server.fail_after = len(data) // 2
+    result = download_stream(url, lambda f: gzip.GzipFile(fileobj=f).read(), tempdir)
+
+    assert result == gzip.decompress(data)
+    # the second request continued where the first stopped
+    ranges = [h.get("Range") for _, _, h in server.requests]
+    ranges = [r for r in ranges if r != "bytes=0-0"]
+    assert len(ranges) == 2
+    assert ranges[0] is None
+    assert int(ranges[1][6:-1]) > 0
+    # partial download is removed after success
+    assert not os.path.exists(partial)
+    assert not os.path.exists(partial + ".json")
+
+
+def test_restart_changed_download(server, tempdir, no_cache):
+    data = genome_data()
+    server.files["/changed.fa.gz"] = data
+    url = "http://127.0.0.1:{}/changed.fa.gz".format(server.server_port)
+    partial = partial_filename(url, tempdir)
+
+    # partial download of an older version of the file
+    with open(partial, "wb") as f:
+        f.write(b"old data")
+    with open(partial + ".json", "w") as f:
+        json.dump({"url": url, "etag": '"old"', "offset": 8}, f)
+
+    result = download_stream(url, lambda f: f.read(), tempdir)
+    assert result == data
+
+
+def test_resume_complete_download(server, tempdir, no_cache):
+    data = genome_data(seed=8)
+    server.files["/complete.fa.gz"] = data
+    url = "http://127.0.0.1:{}/complete.fa.gz".format(server.server_port)
+    partial = partial_filename(url, tempdir)
+
+    # a previous run downloaded the complete file, but failed to process it
+    with open(partial, "wb") as f:
+        f.write(data)
+    etag = '"{}"'.format(hashlib.md5(data).hexdigest())
+    with open(partial + ".json", "w") as f:
+        json.dump({"url": url, "etag": etag, "offset": len(data)}, f)
+
+    result = download_stream(url, lambda f: f.read(), tempdir)
+    assert result == data
+    assert not os.path.exists(partial)
+
+
+@pytest.fixture
+def segments(monkeypatch):
+    """Use small segments."""
+    monkeypatch.setattr(genomepy.download, "MIN_SEGMENT", 10000)
+
+
+def test_segmented_download(server, tempdir, segments):
+    data = genome_data(seed=2)
+    server.files["/segments.fa.gz"] = data
+    url = "http://127.0.0.1:{}/segments.fa.gz".format(server.server_port)
+    partial = partial_filename(url, tempdir)
+
+    server.requests.clear()
+    with genomepy.download.open_download(url, partial, connections=4) as f:
+        assert isinstance(f.raw, genomepy.download.SegmentedDownload)
+        result = f.read()
+    assert result == data
+
+    ranges = sorted(h.get("Range") for _, _, h in server.requests)
+    size = len(data)
+    expected = ["bytes=0-0"] + [
+        "bytes={}-{}".format(size * i // 4, size * (i + 1) // 4 - 1) for i in range(4)
+    ]
+    assert ranges == sorted(expected)
+
+
+def test_resume_segmented_download(server, tempdir, segments, no_cache):
+    data = genome_data(seed=3)
+    server.files["/resume_segments.fa.gz"] = data
+    url = "http://127.0.0.1:{}/resume_segments.fa.gz".format(server.server_port)
+    fname = os.path.join(tempdir, "resume_segments.fa.gz")
+
+    server.fail_after = 1000
+    download_file(url, fname)
+    with open(fname, "rb") as f:
+        assert f.read() == data
+    assert os.listdir(tempdir) == ["resume_segments.fa.gz"]
+
+
+def test_no_ranges(server, tempdir, segments, monkeypatch):
+    data = genome_data(size=3000000, seed=4)
+    server.files["/no_ranges.fa.gz"] = data
+    url = "http://127.0.0.1:{}/no_ranges.fa.gz".format(server.server_port)
+    partial = partial_filename(url, tempdir)
+
+    responses = []
+    session_get = genomepy.download.requests.Session.get
+
+    def get(self, *args, **kwargs):
+        r = session_get(self, *args, **kwargs)
+        responses.append(r)
+        return r
+
+    monkeypatch.setattr(genomepy.download.requests.Session, "get", get)
+    server.ranges = False
+    try:
+        with genomepy.download.open_download(url, partial, connections=4) as f:
+            assert isinstance(f.raw, genomepy.download.ResumableDownload)
+            assert f.read() == data
+    finally:
+        server.ranges = True
+    # the range probe did not read the complete file
+    assert len(responses) == 1
+    assert responses[0].raw.tell() < len(data)
+
+
+def test_download_cache(server, tempdir, cache_dir):
+    data = genome_data(seed=5)
+    server.files["/cached.fa.gz"] = data
+    url = "http://127.0.0.1:{}/cached.fa.gz".format(server.server_port)
+
+    server.requests.clear()
+    assert download_stream(url, lambda f: f.read(), tempdir) == data
+    assert len(server.requests) > 0
+    assert os.listdir(tempdir) == []
+
+    # cached urls are only revalidated
+    server.requests.clear()
+    assert download_stream(url, lambda f: f.read(), tempdir) == data
+    fname = os.path.join(tempdir, "cached.fa.gz")
+    download_file(url, fname)
+    with open(fname, "rb") as f:
+        assert f.read() == data
+    assert [r[0] for r in server.requests] == ["HEAD", "HEAD"]
+
+
+def test_download_cache_revalidate(server, tempdir, cache_dir):
+    data = genome_data(seed=10)
+    server.files["/changing.fa.gz"] = data
+    url = "http://127.0.0.1:{}/changing.fa.gz".format(server.server_port)
+    assert download_stream(url, lambda f: f.read(), tempdir) == data
+
+    # an unchanged file is revalidated without downloading it
+    server.requests.clear()
+    assert download_stream(url, lambda f: f.read(), tempdir) == data
+    assert [r[0] for r in server.requests] == ["HEAD"]
+
+    # a changed file is downloaded again
+    data = genome_data(seed=11)
+    server.files["/changing.fa.gz"] = data
+    assert download_stream(url, lambda f: f.read(), tempdir) == data
+
+    # refresh downloads the file again, disabled does not use the cache
+    server.requests.clear()
+    with genomepy.download.cache_options(refresh=True):
+        download_stream(url, lambda f: f.read(), tempdir)
+    assert "GET" in [r[0] for r in server.requests]
+    server.requests.clear()
+    with genomepy.download.cache_options(enabled=False):
+        assert genomepy.download.get_cache(url) is None
+        download_stream(url, lambda f: f.read(), tempdir)
+    assert "GET" in [r[0] for r in server.requests]
+    assert genomepy.download.get_cache(url) is not None
+
+
+def test_download_too_large_for_cache(server, tempdir, cache_dir, monkeypatch):
+    data = genome_data(seed=9)
+    server.files["/too_large.fa.gz"] = data
+    url = "http://127.0.0.1:{}/too_large.fa.gz".format(server.server_port)
+    monkeypatch.setitem(
+        genomepy.download.config, "download_cache_size", 1000 / 1024 ** 3
+    )
+
+    assert download_stream(url, lambda f: f.read(), tempdir) == data
+    fname = os.path.join(tempdir, "too_large.fa.gz")
+    download_file(url, fname)
+    with open(fname, "rb") as f:
+        assert f.read() == data
+
+    cache = genomepy.download.get_cache(url)
+    assert cache.get(url) is None
+    assert os.listdir(cache.partial_dir) == []
+
+
+def test_download_cache_eviction(tempdir):
+    cache = genomepy.download.DownloadCache(os.path.join(tempdir, "cache"), 25)
+    for i, url in enumerate(["http://a", "http://b", "http://c"]):
+        fname = os.path.join(tempdir, "download")
+        with open(fname, "wb") as f:
+            f.write(b"0123456789")
+        cache.add(url, fname, etag=str(i))
+        time.sleep(0.01)
+        # using a file makes it more recent
+        cache.get("http://a")
+
+    assert cache.get("http://a") is not None
+    assert cache.get("http://b") is None
+    assert cache.get("http://c") is not None
+
+    # a new version of a url replaces the old one
+    with open(fname, "wb") as f:
+        f.write(b"new")
+    new = cache.add("http://c", fname, etag="new")
+    assert cache.get("http://c") == new
+    assert open(new, "rb").read() == b"new"
+
+    # files without a validator expire
+    with open(fname, "wb") as f:
+        f.write(b"ftp")
+    cache.add("ftp://d", fname)
+    assert cache.get("ftp://d", max_age=60) is not None
+    time.sleep(0.01)
+    assert cache.get("ftp://d", max_age=0) is None
+    assert cache.get("http://c", max_age=0) == new
+
+
+def test_checksum(server, tempdir, cache_dir):
+    data = genome_data(seed=6)
+    md5 = hashlib.md5(data).hexdigest()
+    server.files["/checksum.fa.gz"] = data
+    server.files["/md5checksums.txt"] = "{}  ./checksum.fa.gz\n".format(md5).encode()
+    url = "http://127.0.0.1:{}/checksum.fa.gz".format(server.server_port)
+
+    checksum = upstream_checksum(url, "md5checksums.txt")
+    assert checksum.expected == md5
+
+    # a corrupted download is detected and downloaded again
+    server.corrupt = True
+    result = download_stream(url, lambda f: f.read(100), tempdir, checksum=checksum)
+    assert result == data[:100]
+    assert checksum.value == md5
+    assert str(checksum) == "md5 {} (verified)".format(md5)
+    assert not server.corrupt
+
+    # a download that never matches is not cached
+    checksum = Checksum("md5", "0" * 32)
+    with pytest.raises(ChecksumError):
+        download_file(url, os.path.join(tempdir, "wrong"), checksum=checksum)
+    assert genomepy.download.get_cache(url).get(url) is None
+
+    # no published checksum
+    checksum = upstream_checksum(url, "CHECKSUMS")
+    assert checksum.expected is None
+    download_file(url, os.path.join(tempdir, "checksum.fa.gz"), checksum=checksum)
+    assert checksum.value == md5
+
+
+def test_bsd_sum(tempdir):
+    fname = os.path.join(tempdir, "genome.fa.gz")
+    with open(fname, "wb") as f:
+        f.write(genome_data(seed=7))
+    with open(os.path.join(tempdir, "CHECKSUMS"), "wb") as f:
+        f.write(sp.check_output(["sum", "genome.fa.gz"], cwd=tempdir))
+
+    url = "file://" + fname
+    checksum = upstream_checksum(url, "CHECKSUMS", "sum")
+    assert checksum.expected is not None
+    download_file(url, os.path.join(tempdir, "copy.fa.gz"), checksum=checksum)
+    assert checksum.value == checksum.expected
+
+
+def test_bsd_sum_error(tempdir, monkeypatch):
+    fname = os.path.join(tempdir, "genome.fa.gz")
+    with open(fname, "wb") as f:
+        f.write(genome_data(seed=7))
+
+    hashers = []
+    new = Checksum.new
+
+    def checksum_new(self):
+        hashers.append(new(self))
+        return hashers[-1]
+
+    def process(f):
+        f.read(100)
+        raise ValueError("processing failed")
+
+    # `sum` is stopped when the processing fails
+    monkeypatch.setattr(Checksum, "new", checksum_new)
+    with pytest.raises(ValueError):
+        download_stream("file://" + fname, process, tempdir, checksum=Checksum("sum"))
+    assert hashers[0]._proc.returncode is not None
+
+
+def test_session(server, tempdir):
+    server.files["/exists.txt"] = b"data"
+    url = "http://127.0.0.1:{}/exists.txt".format(server.server_port)
+
+    assert genomepy.download.get_session() is genomepy.download.get_session()
+    assert genomepy.download.read_url(url) == b"data"
+
+    # existence is checked without downloading the file
+    server.requests.clear()
+    assert genomepy.download.url_exists(url)
+    assert not genomepy.download.url_exists(url + ".missing")
+    assert [r[0] for r in server.requests] == ["HEAD", "HEAD"]
+    assert not genomepy.download.url_exists("hg38")